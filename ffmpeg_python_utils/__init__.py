@@ -6,27 +6,52 @@
 """
 
 from .main import *
+from .config import Config
 from .other import remove_silence_from_audio_file, find_offsets
+from .proxy import get_proxy_video, render_calls
+from .fingerprint import AudioFingerprintIndex
+from .analysis import analyze
+from .tuning import get_tuned_codec_settings
+from .video_hash import VideoHashIndex, get_perceptual_hashes
+from .metrics import estimate_call_time, plan_jobs
 
-__all__ = ['add_audio_to_video',
+__all__ = ['AudioFingerprintIndex',
+           'Config',
+           'Stream',
+           'VideoHashIndex',
+           'add_audio_to_video',
            'add_blurred_space_around_video',
            'add_colored_space_around_video',
            'add_image_to_video',
            'add_rectangle_to_video',
            'add_text_to_video',
            'add_video_to_video',
+           'analyze',
+           'estimate_call_time',
            'get_audio_from_video',
            'get_audio_info',
+           'get_chained_video',
            'get_concantenated_videos',
            'get_cropped_video',
            'get_frame',
            'get_image_info',
+           'get_jump_cut_video',
+           'get_keyframe_times',
+           'get_loudness_measurement',
            'get_mirrored_video',
+           'get_perceptual_hashes',
+           'get_proxy_video',
            'get_resized_video',
+           'get_resized_videos',
            'get_rotated_video',
+           'get_silence_intervals',
+           'get_slideshow_video',
            'get_subclips_with_sound',
+           'get_tuned_codec_settings',
            'get_video_from_picture',
            'get_video_info',
+           'plan_jobs',
+           'render_calls',
            'remove_silence_from_audio_file',
            'find_offsets',
            ]
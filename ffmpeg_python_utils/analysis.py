@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import numpy as np
+from .config import settings
+from .graph import FilterGraph, Filter, escape_filter_value
+from .inc import print_info, get_file_fingerprint, temp_workspace, save_string_return_output, get_temp_path_near
+from .main import get_video_info
+
+DETECTORS = {
+    'scenes': ['v', 'scdet', {'threshold': 10}],
+    'black': ['v', 'blackdetect', {'d': 0.1, 'pix_th': 0.1}],
+    'freeze': ['v', 'freezedetect', {'n': '-60dB', 'd': 2}],
+    'silence': ['a', 'silencedetect', {'n': '-45dB', 'd': 0.5}],
+    'loudness': ['a', 'ebur128', {'metadata': 1}],
+}
+"""Detector name -> [stream, ffmpeg filter, default options]. Options can be changed by analyze(options=...)."""
+
+METADATA_KEYS = {
+    'lavfi.scd.score': ['scenes', 'scores', 'series'],
+    'lavfi.scd.time': ['scenes', 'times', 'value'],
+    'lavfi.black_start': ['black', 'intervals', 'start'],
+    'lavfi.black_end': ['black', 'intervals', 'end'],
+    'lavfi.freezedetect.freeze_start': ['freeze', 'intervals', 'start'],
+    'lavfi.freezedetect.freeze_end': ['freeze', 'intervals', 'end'],
+    'lavfi.silence_start': ['silence', 'intervals', 'start'],
+    'lavfi.silence_end': ['silence', 'intervals', 'end'],
+    'lavfi.r128.M': ['loudness', 'momentary', 'series'],
+    'lavfi.r128.I': ['loudness', 'integrated', 'last'],
+    'lavfi.r128.LRA': ['loudness', 'lra', 'last'],
+}
+"""Frame metadata key -> [detector, result field, how to collect it]."""
+
+RESULT_FIELDS = {
+    'scenes': {'scores': (0, 2), 'times': (0,)},
+    'black': {'intervals': (0, 2)},
+    'freeze': {'intervals': (0, 2)},
+    'silence': {'intervals': (0, 2)},
+    'loudness': {'momentary': (0, 2), 'integrated': (), 'lra': ()},
+}
+"""Detector -> its result arrays and their empty shapes."""
+
+
+class MetadataParser:
+    """
+    Collects detector results from lines printed by the metadata/ametadata filters:
+    'frame:0 pts:0 pts_time:0' followed by 'lavfi.key=value' lines of that frame.
+    """
+
+    def __init__(self, results: dict):
+        self.results = results
+        self.time = 0.0
+        # Lines which are not metadata, e.g. ffmpeg errors in stderr
+        self.other_lines = []
+
+    def parse_line(self, line: str):
+        if line.startswith('frame:'):
+            self.time = float(line.rsplit('pts_time:', 1)[1])
+            return
+        key, _, value = line.partition('=')
+        if key not in METADATA_KEYS:
+            if line and not line.startswith('lavfi.'):
+                self.other_lines.append(line)
+            return
+        detector, field, kind = METADATA_KEYS[key]
+        if detector not in self.results:
+            return
+        value = float(value)
+        collected = self.results[detector].setdefault(field, [])
+        if kind == 'series':
+            collected.append([self.time, value])
+        elif kind == 'value':
+            collected.append(value)
+        elif kind == 'last':
+            self.results[detector][field] = value
+        elif kind == 'start':
+            collected.append([max(value, 0), None])
+        elif kind == 'end' and collected:
+            collected[-1][1] = value
+
+    def parse_stream(self, stream):
+        for line in stream:
+            self.parse_line(line.decode(errors='replace').strip())
+
+
+def get_analysis_cache_path(input_path: str, detector: str, options: dict, fps: float, width: int) -> str:
+    key_settings = [options] + ([fps, width] if DETECTORS[detector][0] == 'v' else [])
+    key = hashlib.sha256(f'{get_file_fingerprint(input_path)}-{json.dumps(key_settings, sort_keys=True)}'.encode())
+    return os.path.join(settings.C_CACHE_DIR, 'analysis', f'{detector}_{key.hexdigest()[:32]}.npz')
+
+
+def analyze(input_path: str, detectors: list[str] = ('scenes', 'black', 'freeze', 'silence', 'loudness'),
+            options: dict = None, fps: float = None, width: int = None) -> dict:
+    """
+    Runs all requested detectors in one decode. Video is analyzed downscaled and at a low fps. Frame metadata is printed
+    to stdout (video) and stderr (audio) and parsed while ffmpeg runs. Results are cached per file fingerprint in
+    C_CACHE_DIR/analysis, so asking again (or for a subset) does not decode the file. Only missing detectors are run.
+
+    Usage:
+        results = analyze('in.mp4', ['scenes', 'silence'])
+        results['scenes']['times']  # times of scene cuts
+        results['silence']['intervals']  # [[start, end], ...]
+
+    Args:
+        input_path (str): The path to the input video or audio file.
+        detectors (list[str], optional): Names from DETECTORS:
+            'scenes' (scdet): 'scores' [[time, score]] for each analyzed frame and 'times' of cuts.
+            'black' (blackdetect), 'freeze' (freezedetect), 'silence' (silencedetect): 'intervals' [[start, end]].
+            'loudness' (ebur128): 'momentary' [[time, LUFS]], 'integrated' LUFS and 'lra' LU.
+        options (dict, optional): Filter options by detector, like {'scenes': {'threshold': 5}}.
+        fps (float, optional): Frame rate for video detectors, C_ANALYSIS_FPS by default.
+        width (int, optional): Width for video detectors, C_ANALYSIS_WIDTH by default.
+
+    Returns:
+        dict: {detector: {field: np.ndarray}}. Times are in seconds.
+    """
+    options = options or {}
+    fps, width = fps or settings.C_ANALYSIS_FPS, width or settings.C_ANALYSIS_WIDTH
+    detector_options = {d: {**DETECTORS[d][2], **options.get(d, {})} for d in detectors}
+    cache_paths = {d: get_analysis_cache_path(input_path, d, detector_options[d], fps, width) for d in detectors}
+    results = {}
+    for detector, cache_path in cache_paths.items():
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                results[detector] = dict(cached)
+    missing = [d for d in detectors if d not in results]
+    if not missing:
+        return results
+    print_info(f'Analyzing {input_path}: {", ".join(missing)}', to_print=settings.C_TO_PRINT_PACKAGE_INFO)
+
+    # One chain per stream: the video is downscaled once and passes all video detectors
+    graph = FilterGraph()
+    index = graph.add_input(input_path)
+    for stream, pipe in (('v', 'pipe:1'), ('a', 'pipe:2')):
+        filters = [Filter(DETECTORS[d][1], **detector_options[d]) for d in missing if DETECTORS[d][0] == stream]
+        if not filters:
+            continue
+        if stream == 'v':
+            filters = [Filter('fps', fps), Filter('scale', width, -2)] + filters + \
+                      [Filter('metadata', mode='print', file=escape_filter_value(pipe))]
+        else:
+            filters.append(Filter('ametadata', mode='print', file=escape_filter_value(pipe)))
+        graph.add_output(graph.add_chain([f'{index}:{stream}'], filters, prefix=stream))
+    graph.optimize()
+
+    new_results = {d: {} for d in missing}
+    parsers = [MetadataParser(new_results), MetadataParser(new_results)]
+    with temp_workspace() as workspace:
+        script_path = save_string_return_output(str(graph), os.path.join(workspace, 'filter_complex_script.txt'))
+        cmd = f'ffmpeg -nostats -loglevel error -filter_complex_script "{script_path}" ' \
+              f'{graph.get_inputs_str()} {graph.get_maps_str()} -f null -'
+        print_info(cmd, 'green', settings.C_TO_PRINT_PACKAGE_INFO)
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as ffmpeg_process:
+            # Audio metadata (and ffmpeg errors) come to stderr, it is read at the same time, so no pipe gets full
+            stderr_thread = threading.Thread(target=parsers[1].parse_stream, args=(ffmpeg_process.stderr,))
+            stderr_thread.start()
+            parsers[0].parse_stream(ffmpeg_process.stdout)
+            stderr_thread.join()
+    if ffmpeg_process.returncode:
+        raise subprocess.CalledProcessError(ffmpeg_process.returncode, cmd, stderr='\n'.join(parsers[1].other_lines))
+
+    # Intervals lasting until the end have no end. They end at the duration of the file, not at the last analyzed
+    # frame, which is up to a frame of the analysis fps earlier.
+    is_open = any(end is None for detector in missing for _, end in new_results[detector].get('intervals', []))
+    end_time = get_video_info(input_path)['duration'] if is_open else None
+    os.makedirs(os.path.join(settings.C_CACHE_DIR, 'analysis'), exist_ok=True)
+    for detector in missing:
+        result = {}
+        for field, empty_shape in RESULT_FIELDS[detector].items():
+            value = new_results[detector].get(field, [] if empty_shape else np.nan)
+            if field == 'intervals':
+                value = [[start, end_time if end is None else end] for start, end in value]
+            array = np.array(value, dtype=np.float64)
+            result[field] = array if array.size else array.reshape(empty_shape)
+        results[detector] = result
+        temp_path = get_temp_path_near(cache_paths[detector])
+        with open(temp_path, 'wb') as file:
+            np.savez_compressed(file, **result)
+        os.replace(temp_path, cache_paths[detector])
+    return results
@@ -0,0 +1,227 @@
+import argparse
+import contextvars
+import hashlib
+import json
+import os
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from .config import settings
+from .inc import print_info, get_temp_path_near, save_string_return_output
+from .metrics import load_records, estimate_call_time
+
+MANIFEST_EXAMPLE = '''
+{
+    "jobs": [
+        {"id": "texts", "function": "add_text_to_video",
+         "args": {"input_video_path": "in.mp4", "output_path": "texts.mp4", "texts": ["Hello"], ...}},
+        {"id": "final", "function": "add_image_to_video",
+         "args": {"input_video_path": "texts.mp4", "output_path": "final.mp4", ...}}
+    ]
+}
+'''
+
+
+def load_manifest(manifest_path: str) -> list[dict]:
+    """
+    Reads jobs from a JSON or YAML (if PyYAML is installed) manifest. Each job is {"function": name of a function
+    of the package, "args": its keyword arguments}, with optional "id" and "after" (ids of jobs to wait for).
+    """
+    with open(manifest_path, encoding='utf-8') as file:
+        if manifest_path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError('PyYAML is needed to read YAML manifests: pip install pyyaml')
+            manifest = yaml.safe_load(file)
+        else:
+            manifest = json.load(file)
+    jobs = manifest['jobs'] if isinstance(manifest, dict) else manifest
+    for i, job in enumerate(jobs):
+        job.setdefault('id', str(i))
+        job.setdefault('args', {})
+        job.setdefault('after', [])
+    return jobs
+
+
+def get_output_paths(job: dict) -> list[str]:
+    # Files a job writes: output_path, or output_paths of functions with many outputs (like get_resized_videos)
+    args = job['args']
+    paths = [args['output_path']] if isinstance(args.get('output_path'), str) else []
+    return paths + list(args.get('output_paths') or [])
+
+
+def get_outputs(jobs: list[dict]) -> dict:
+    # Absolute output path -> id of the job writing it
+    return {os.path.abspath(path): job['id'] for job in jobs for path in get_output_paths(job)}
+
+
+def get_dependencies(jobs: list[dict]) -> dict:
+    # A job depends on the jobs whose output paths it uses as arguments, and on the ones listed in "after"
+    outputs = get_outputs(jobs)
+    dependencies = {}
+    for job in jobs:
+        dependencies[job['id']] = set(job['after'])
+        for path in get_input_paths(job):
+            if os.path.abspath(path) in outputs and outputs[os.path.abspath(path)] != job['id']:
+                dependencies[job['id']].add(outputs[os.path.abspath(path)])
+    return dependencies
+
+
+def get_input_paths(job: dict) -> list[str]:
+    # All string arguments (also inside lists) except output paths, which may be files
+    paths = []
+
+    def collect(value):
+        if isinstance(value, str):
+            paths.append(value)
+        elif isinstance(value, (list, tuple)):
+            for v in value:
+                collect(v)
+
+    for name, value in job['args'].items():
+        if name not in ('output_path', 'output_paths'):
+            collect(value)
+    return paths
+
+
+def get_estimate_args(job: dict, outputs: dict) -> dict:
+    # Arguments for estimate_call_time. Inputs written by other jobs are hidden, they may not exist yet or be left
+    # from an earlier run, so only the existing sources are probed. Lists keep their lengths, they are the overlays.
+    def hide(value):
+        if isinstance(value, str) and outputs.get(os.path.abspath(value), job['id']) != job['id']:
+            return None
+        if isinstance(value, (list, tuple)):
+            return [hide(v) for v in value]
+        return value
+
+    return {name: hide(value) for name, value in job['args'].items()}
+
+
+def get_job_hash(job: dict) -> str:
+    return hashlib.sha256(json.dumps([job['function'], job['args']], sort_keys=True).encode()).hexdigest()
+
+
+def is_up_to_date(job: dict, state: dict) -> bool:
+    # Like make: the outputs exist, are newer than all input files, and the job was done with the same parameters
+    output_paths = get_output_paths(job)
+    if not output_paths or not all(os.path.exists(path) for path in output_paths) or \
+            state.get(job['id']) != get_job_hash(job):
+        return False
+    output_time = min(os.path.getmtime(path) for path in output_paths)
+    return all(os.path.getmtime(path) <= output_time for path in get_input_paths(job) if os.path.isfile(path))
+
+
+def run_manifest(manifest_path: str, max_workers: int = 2, force: bool = False, dry_run: bool = False) -> dict:
+    """
+    Runs jobs of a manifest. Jobs are ordered by their dependencies (an output_path or one of output_paths of one job
+    used as an argument of another one), independent jobs run in parallel. Jobs whose outputs are newer than their inputs and which were done
+    with the same arguments are skipped, so after a failure the same command resumes from the failed jobs.
+    Done jobs are saved in '<manifest_path>.state.json'.
+
+    Args:
+        manifest_path (str): Path to the JSON/YAML manifest.
+        max_workers (int, optional): The number of jobs run at the same time.
+        force (bool, optional): Whether to run all jobs even if they are up to date.
+        dry_run (bool, optional): Whether to only print what would be run.
+
+    Returns:
+        dict: Job id -> 'done', 'skipped', 'failed' or 'blocked' (a job it depends on failed).
+    """
+    import ffmpeg_python_utils
+    jobs = load_manifest(manifest_path)
+    jobs_by_id = {job['id']: job for job in jobs}
+    for job in jobs:
+        if job['function'] not in ffmpeg_python_utils.__all__:
+            raise ValueError(f'Job {job["id"]}: unknown function {job["function"]}')
+    dependencies = get_dependencies(jobs)
+    unknown = {d for ids in dependencies.values() for d in ids if d not in jobs_by_id}
+    if unknown:
+        raise ValueError(f'Unknown job ids in "after": {unknown}')
+
+    # Ready jobs are submitted longest first by estimate_call_time, so a long job does not start last
+    records = load_records()
+    outputs = get_outputs(jobs)
+    estimates = {job['id']: estimate_call_time(job['function'], get_estimate_args(job, outputs), records=records)
+                 for job in jobs}
+    jobs = sorted(jobs, key=lambda job: -estimates[job['id']])
+
+    state_path = f'{manifest_path}.state.json'
+    state = {}
+    if os.path.exists(state_path) and not force:
+        with open(state_path) as file:
+            state = json.load(file)
+
+    def save_state():
+        temp_path = get_temp_path_near(state_path)
+        save_string_return_output(json.dumps(state, indent=4), temp_path)
+        os.replace(temp_path, state_path)
+
+    def run_job(job):
+        getattr(ffmpeg_python_utils, job['function'])(**job['args'])
+
+    statuses = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while len(statuses) < len(jobs):
+            for job in jobs:
+                if job['id'] in statuses or job['id'] in running.values():
+                    continue
+                job_dependencies = dependencies[job['id']]
+                if any(statuses.get(d) in ('failed', 'blocked') for d in job_dependencies):
+                    statuses[job['id']] = 'blocked'
+                    print_info(f'Job {job["id"]} is blocked by a failed job', 'red', True)
+                    continue
+                if not all(statuses.get(d) in ('done', 'skipped') for d in job_dependencies):
+                    continue
+                # Dependencies which were re-run make the job outdated through modification times
+                if not force and is_up_to_date(job, state):
+                    statuses[job['id']] = 'skipped'
+                    print_info(f'Job {job["id"]} is up to date', to_print=settings.C_TO_PRINT_PACKAGE_INFO)
+                    continue
+                if dry_run:
+                    statuses[job['id']] = 'done'
+                    print_info(f'Would run job {job["id"]}: {job["function"]}({job["args"]})', 'green', True)
+                    continue
+                print_info(f'Running job {job["id"]}: {job["function"]}', 'green', True)
+                # Jobs run in a copy of the current context, so they use the Config the manifest is run with
+                running[executor.submit(contextvars.copy_context().run, run_job, job)] = job['id']
+            if not running:
+                if len(statuses) < len(jobs):
+                    raise ValueError(f'Jobs have circular dependencies: {set(jobs_by_id) - set(statuses)}')
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job_id = running.pop(future)
+                if future.exception():
+                    statuses[job_id] = 'failed'
+                    state.pop(job_id, None)
+                    print_info(f'Job {job_id} failed:\n' + ''.join(traceback.format_exception(future.exception())),
+                               'red', True)
+                else:
+                    statuses[job_id] = 'done'
+                    state[job_id] = get_job_hash(jobs_by_id[job_id])
+                if not dry_run:
+                    save_state()
+    return statuses
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog='ffmpeg-python-utils',
+                                     description='Runs jobs (calls of ffmpeg_python_utils functions) of a manifest. '
+                                                 'Up-to-date jobs are skipped, failed ones are run again next time.',
+                                     epilog=f'Manifest example: {MANIFEST_EXAMPLE}',
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('manifest', help='Path to the JSON or YAML manifest.')
+    parser.add_argument('-j', '--jobs', type=int, default=2, help='The number of jobs run at the same time.')
+    parser.add_argument('-f', '--force', action='store_true', help='Run all jobs even if they are up to date.')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='Only print jobs which would be run.')
+    args = parser.parse_args(argv)
+    statuses = run_manifest(args.manifest, max_workers=args.jobs, force=args.force, dry_run=args.dry_run)
+    failed = [job_id for job_id, status in statuses.items() if status in ('failed', 'blocked')]
+    print_info(f'{len(statuses) - len(failed)} of {len(statuses)} jobs are done.', 'red' if failed else 'green', True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
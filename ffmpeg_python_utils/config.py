@@ -1,3 +1,5 @@
+import contextvars
+
 C_CODEC = 'nvidia'  # nvidia, amd, cpu
 """
 The codec we use.
@@ -30,9 +32,139 @@ checks if to print only errors."""
 C_TO_PRINT_FFMPEG_DEBUG = False
 """Whether to show detailed information from ffmpeg."""
 
+C_TMP_DIR = None
+"""
+Root folder for temporary workspaces. Each call gets its own unique folder there, which is always removed after.
+None means the system temp folder. A tmpfs (like '/dev/shm') makes temporary files faster.
+"""
+C_CACHE_DIR = 'ffmpeg_python_utils_cache'
+"""Folder where cached results are saved (e.g. find_offsets searches)."""
+C_AUDIO_CACHE_SIZE = 10 * 1024 ** 3
+"""
+Maximum size in bytes of decoded audio cached in C_CACHE_DIR/audio. The least recently used files are removed first.
+One hour of mono 44.1 kHz audio takes ~635 MB.
+"""
+
+C_ASS_TEXTS_THRESHOLD = 50
+"""
+Implemented in add_text_to_video with backend='auto'. From this number of texts they are burned in with one ASS script
+instead of a chain of drawtext filters, which ffmpeg evaluates on every frame.
+"""
+C_MAX_TIME_BUCKETS = 50
+"""
+Implemented in add_rectangle_to_video. The video is split into at most this number of time buckets, and each bucket
+runs only the rectangles active in it. More buckets mean fewer idle filters per frame but a bigger filter graph.
+"""
+C_PROXY_HEIGHT = 360
+"""Implemented in proxy. The height of the low resolution proxies which previews are rendered against."""
+C_FINGERPRINT_SAMPLE_RATE = 8000
+"""Implemented in fingerprint. Audio is resampled to this rate before fingerprinting, higher frequencies are dropped."""
+C_FINGERPRINT_MIN_MATCHES = 20
+"""Implemented in fingerprint. The default number of matching hashes at one offset to count it as an appearance."""
+C_ANALYSIS_FPS = 5
+"""Implemented in analysis. Video detectors (scenes, black, freeze frames) get frames at this rate."""
+C_ANALYSIS_WIDTH = 320
+"""Implemented in analysis. Video detectors get frames downscaled to this width."""
+
+C_PIPE_SETTINGS = '-c:v rawvideo -c:a pcm_s16le -f nut'
+"""Implemented in get_chained_video. Stages send raw frames and PCM audio in NUT to the next one, nothing is encoded."""
+C_LOUDNESS_TARGET = {'I': -16, 'LRA': 11, 'TP': -1.5}
+"""
+Implemented in functions with normalize=True. The loudnorm target: integrated loudness (LUFS), loudness range (LU)
+and true peak (dBTP). Sources with a wider loudness range than LRA are normalized dynamically, not just by a gain.
+"""
+C_TUNING_CANDIDATES = {
+    'nvidia': [f'-c:v h264_nvenc -preset {preset} -tune hq -rc vbr -cq {cq} -b:v 0'
+               for preset in ('p1', 'p4', 'p7') for cq in (19, 23, 28)],
+    'amd': [f'-c:v h264_amf -quality {quality} -rc cqp -qp_i {qp} -qp_p {qp} -qp_b {qp}'
+            for quality in ('speed', 'balanced', 'quality') for qp in (18, 23, 28)],
+    'cpu': [f'-c:v libx264 -preset {preset} -crf {crf}'
+            for preset in ('ultrafast', 'veryfast', 'medium', 'slow') for crf in (15, 20, 25)],
+}
+"""Implemented in tuning. Settings tried for each codec, they replace C_CODEC_SETTINGS when applied."""
+C_TUNING_SAMPLES = 3
+"""Implemented in tuning. The number of sample segments of the source which candidates encode."""
+C_TUNING_SAMPLE_DURATION = 2
+"""Implemented in tuning. The duration of a sample segment in seconds."""
+C_SLIDESHOW_FPS = 25
+"""
+Implemented in get_slideshow_video. The frame rate of slideshows with transitions or with images of different formats,
+which need a constant rate.
+"""
+C_VIDEO_HASH_FPS = 2
+"""Implemented in video_hash. Perceptual hashes are computed for this number of frames per second."""
+C_VIDEO_HASH_MAX_DISTANCE = 7
+"""Implemented in video_hash. The default maximum Hamming distance of hashes of matching frames."""
+C_VIDEO_HASH_MIN_SIMILARITY = 0.5
+"""Implemented in video_hash. The default share of matching frames to call a video a duplicate."""
+C_TO_RECORD_METRICS = False
+"""Implemented in metrics. Whether to save the time of each call which ran ffmpeg to C_CACHE_DIR/metrics.sqlite.
+It probes the inputs after each call, so it is off by default."""
+C_METRICS_MIN_RECORDS = 5
+"""Implemented in metrics. Estimates use records of the same operation and codec if there are at least this many."""
+
 C_TO_RENAME_FILES = False
 """Whether to rename files. It should work with False."""
 C_TIME_AMONG_NEIGHBOUR_PEAKS = 1
 """
 Implemented in find_offsets. How far from each other should offsets be placed?
 """
+
+
+class Config:
+    """
+    Settings of calls: values of the C_ constants above which replace the module ones. Functions read settings through
+    settings.C_..., which takes them from the Config of the current context, so threads and asyncio tasks can run calls
+    with different codecs, logging and caches at the same time. Settings a Config does not set are read from this
+    module when used, so changing ffmpeg_python_utils.config.C_CODEC at runtime works too.
+
+    Usage:
+        # For one call
+        get_resized_video('in.mp4', 'preview.mp4', [640, -1], config=Config(C_CODEC='cpu'))
+        # For everything in the block (and in tasks and get_chained_video stages started there)
+        with Config(C_CODEC='cpu', C_TO_PRINT_PACKAGE_INFO=False, C_CACHE_DIR='/tmp/cache'):
+            get_resized_video('in.mp4', 'preview.mp4', [640, -1])
+
+    Args:
+        **overrides: C_ constants and their values, like C_CODEC='cpu'. Nested configs add theirs to the outer ones.
+    """
+
+    def __init__(self, **overrides):
+        unknown = [name for name in overrides if not (name.startswith('C_') and name in globals())]
+        if unknown:
+            raise ValueError(f'Unknown settings: {unknown}')
+        self.overrides = overrides
+        # Token of the entry which made this config current, `with` resets it on exit
+        self.token = None
+
+    def __getattr__(self, name):
+        if name in self.__dict__.get('overrides', {}):
+            return self.overrides[name]
+        if name.startswith('C_') and name in globals():
+            return globals()[name]
+        raise AttributeError(f'Unknown setting {name}')
+
+    def __enter__(self) -> 'Config':
+        # Each entry makes a merged copy which keeps its own token, so one Config can be entered by many threads and
+        # tasks at once and every exit restores the config its own entry replaced
+        merged = Config(**{**current_config.get().overrides, **self.overrides})
+        merged.token = current_config.set(merged)
+        return merged
+
+    def __exit__(self, *args):
+        current_config.reset(current_config.get().token)
+
+    def __repr__(self):
+        return f'Config({", ".join(f"{k}={v!r}" for k, v in self.overrides.items())})'
+
+
+class CurrentSettings:
+    # settings.C_CODEC is C_CODEC of the Config of the current context
+    def __getattr__(self, name):
+        return getattr(current_config.get(), name)
+
+
+current_config = contextvars.ContextVar('current_config', default=Config())
+"""The Config of the current context, set by `with Config(...)` and by the config argument of functions."""
+settings = CurrentSettings()
+"""Settings of the current context, read by all functions."""
@@ -0,0 +1,186 @@
+import os
+import sqlite3
+import librosa
+import numpy as np
+from scipy import ndimage
+from .config import settings
+from .inc import print_info, get_file_fingerprint
+from .other import delete_neighbors, load_audio
+
+N_FFT = 1024
+"""Window of the spectrogram. At 8000 Hz it gives 513 frequency bins."""
+HOP_LENGTH = 256
+"""Hop of the spectrogram, 32 ms at 8000 Hz. Offsets are found with this precision."""
+PEAK_NEIGHBORHOOD = (20, 20)
+"""A peak should be the maximum in this (frequency bins, frames) area, so there are ~40 peaks per second."""
+PEAK_FLOOR_DB = 60
+"""Peaks quieter than the loudest point by more than this are noise."""
+FAN_OUT = 10
+"""Each peak is paired with this number of next peaks."""
+MAX_DELTA_FRAMES = 63
+"""The maximum distance between paired peaks in frames. Stored in 6 bits of a hash."""
+
+
+def get_fingerprint_hashes(y: np.ndarray, sr: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Computes landmark hashes of audio: peaks of the spectrogram are paired with next peaks, and each pair gives a hash
+    of (frequency 1, frequency 2, time between them). Hashes do not depend on volume and survive noise and compression.
+
+    Args:
+        y (np.ndarray): Mono audio.
+        sr (int): Its sample rate.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Hashes and the frames of their first peaks.
+    """
+    spectrogram = librosa.amplitude_to_db(np.abs(librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH)), ref=np.max)
+    peaks = (ndimage.maximum_filter(spectrogram, size=PEAK_NEIGHBORHOOD) == spectrogram) & \
+            (spectrogram > -PEAK_FLOOR_DB)
+    frames, freqs = np.nonzero(peaks.T)
+
+    hashes, anchor_frames = [], []
+    for k in range(1, FAN_OUT + 1):
+        delta = frames[k:] - frames[:-k]
+        mask = (delta > 0) & (delta <= MAX_DELTA_FRAMES)
+        hashes.append((freqs[:-k][mask].astype(np.int64) << 16) | (freqs[k:][mask].astype(np.int64) << 6) |
+                      delta[mask])
+        anchor_frames.append(frames[:-k][mask])
+    return np.concatenate(hashes), np.concatenate(anchor_frames)
+
+
+class AudioFingerprintIndex:
+    """
+    On-disk index of landmark fingerprints for finding clips (ads, jingles) in a big library of recordings.
+    Unlike find_offsets, a query does not scan the recordings: hashes of the clip are looked up in an sqlite index and
+    matches vote for (recording, offset), so time depends on the clip, not on the size of the library.
+
+    Usage:
+        with AudioFingerprintIndex() as index:
+            index.add(['broadcast_1.mp4', 'broadcast_2.mp4'])
+            time_codes = index.find('ad.wav')  # {'broadcast_1.mp4': [12.45, 1803.2], 'broadcast_2.mp4': []}
+
+    Args:
+        index_path (str, optional): Path to the sqlite file. By default, 'fingerprints.sqlite' in C_CACHE_DIR.
+    """
+
+    def __init__(self, index_path: str = None):
+        self.index_path = index_path or os.path.join(settings.C_CACHE_DIR, 'fingerprints.sqlite')
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.index_path)
+        self.connection.executescript('''
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS recordings (id INTEGER PRIMARY KEY, path TEXT UNIQUE, fingerprint TEXT,
+                                                   sample_rate INTEGER, hop_length INTEGER);
+            CREATE TABLE IF NOT EXISTS hashes (hash INTEGER, recording_id INTEGER, frame INTEGER);
+            CREATE INDEX IF NOT EXISTS hashes_by_hash ON hashes (hash);
+            CREATE INDEX IF NOT EXISTS hashes_by_recording ON hashes (recording_id);
+        ''')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def add(self, input_paths: list[str]) -> list[str]:
+        """
+        Adds recordings to the index. Already indexed recordings are skipped, changed ones and ones indexed with
+        another C_FINGERPRINT_SAMPLE_RATE or HOP_LENGTH are indexed again.
+
+        Args:
+            input_paths (list[str]): Paths to audio or video files.
+
+        Returns:
+            list[str]: Paths which were (re)indexed.
+        """
+        indexed = []
+        for input_path in input_paths:
+            path = os.path.abspath(input_path)
+            fingerprint = get_file_fingerprint(path)
+            row = self.connection.execute('SELECT id, fingerprint, sample_rate, hop_length FROM recordings '
+                                          'WHERE path = ?', (path,)).fetchone()
+            if row and list(row[1:]) == [fingerprint, settings.C_FINGERPRINT_SAMPLE_RATE, HOP_LENGTH]:
+                continue
+            print_info(f'Indexing fingerprints of {path}', to_print=settings.C_TO_PRINT_PACKAGE_INFO)
+            y, sr = load_audio(path, sr=settings.C_FINGERPRINT_SAMPLE_RATE)
+            hashes, frames = get_fingerprint_hashes(y, sr)
+            with self.connection:
+                if row:
+                    self.connection.execute('DELETE FROM hashes WHERE recording_id = ?', (row[0],))
+                    self.connection.execute('DELETE FROM recordings WHERE id = ?', (row[0],))
+                recording_id = self.connection.execute(
+                    'INSERT INTO recordings (path, fingerprint, sample_rate, hop_length) VALUES (?, ?, ?, ?)',
+                    (path, fingerprint, sr, HOP_LENGTH)).lastrowid
+                self.connection.executemany('INSERT INTO hashes VALUES (?, ?, ?)',
+                                            zip(hashes.tolist(), [recording_id] * len(hashes), frames.tolist()))
+            indexed.append(input_path)
+        return indexed
+
+    def remove(self, input_path: str):
+        """Removes a recording from the index."""
+        path = os.path.abspath(input_path)
+        with self.connection:
+            self.connection.execute('DELETE FROM hashes WHERE recording_id IN '
+                                    '(SELECT id FROM recordings WHERE path = ?)', (path,))
+            self.connection.execute('DELETE FROM recordings WHERE path = ?', (path,))
+
+    def find(self, find_file: str, within_file: str = None, min_matches: int = None):
+        """
+        Finds time codes of appearance of find_file in the indexed recordings.
+
+        Args:
+            find_file (str): Path to the clip to search for.
+            within_file (str, optional): Search only in this recording. It is indexed first if needed.
+            min_matches (int, optional): Minimum number of hashes matching at one offset to count as an appearance.
+                Bigger values give fewer false positives, smaller ones find shorter or noisier clips.
+                C_FINGERPRINT_MIN_MATCHES by default.
+
+        Returns:
+            list if within_file else dict: Time codes in seconds like find_offsets returns, or {path: time codes}.
+        """
+        min_matches = min_matches or settings.C_FINGERPRINT_MIN_MATCHES
+        if within_file:
+            self.add([within_file])
+        y, sr = load_audio(find_file, sr=settings.C_FINGERPRINT_SAMPLE_RATE)
+        hashes, frames = get_fingerprint_hashes(y, sr)
+
+        # Frames of hashes made with another sample rate or hop are other times, such recordings are indexed again
+        parameters = [settings.C_FINGERPRINT_SAMPLE_RATE, HOP_LENGTH]
+        outdated = [path for path, *recording_parameters in
+                    self.connection.execute('SELECT path, sample_rate, hop_length FROM recordings')
+                    if recording_parameters != parameters]
+        missing = [path for path in outdated if not os.path.exists(path)]
+        if missing:
+            print_info(f'Recordings indexed with other parameters are missing and skipped: {missing}', 'red', True)
+        self.add([path for path in outdated if path not in missing])
+        recordings = {recording_id: path for recording_id, path in self.connection.execute(
+            'SELECT id, path FROM recordings WHERE sample_rate = ? AND hop_length = ?', parameters)}
+        if within_file:
+            recordings = {k: v for k, v in recordings.items() if v == os.path.abspath(within_file)}
+
+        self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS query (hash INTEGER, frame INTEGER)')
+        self.connection.execute('DELETE FROM query')
+        self.connection.executemany('INSERT INTO query VALUES (?, ?)', zip(hashes.tolist(), frames.tolist()))
+        matches = np.array(self.connection.execute(
+            'SELECT h.recording_id, h.frame - q.frame FROM query q JOIN hashes h ON h.hash = q.hash').fetchall(),
+            dtype=np.int64).reshape(-1, 2)
+
+        time_codes = {}
+        for recording_id, path in recordings.items():
+            offsets = matches[matches[:, 0] == recording_id, 1]
+            offsets = offsets[offsets >= 0]
+            points_of_time = []
+            if len(offsets):
+                votes = np.bincount(offsets)
+                # Offsets are quantized to frames, so the votes of neighbour frames are summed
+                votes = np.convolve(votes, np.ones(3, dtype=np.int64), mode='same')
+                found = np.nonzero((votes >= min_matches) & (votes == ndimage.maximum_filter1d(votes, 3)))[0]
+                points_of_time = delete_neighbors([round(float(offset) * HOP_LENGTH / sr, 2) for offset in found])
+            time_codes[path] = points_of_time
+        print_info(f'Found {find_file} in {sum(bool(v) for v in time_codes.values())} of {len(recordings)} '
+                   f'recordings.', to_print=settings.C_TO_PRINT_PACKAGE_INFO)
+        return time_codes[os.path.abspath(within_file)] if within_file else time_codes
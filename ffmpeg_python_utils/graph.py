@@ -0,0 +1,304 @@
+import re
+from .inc import print_info
+from .config import settings
+
+FORMAT_PRESERVING_FILTERS = {'drawbox', 'drawtext', 'fade', 'colorchannelmixer', 'setpts', 'select', 'trim', 'crop',
+                             'hflip', 'vflip', 'gblur', 'null'}
+"""Filters which output frames in the same pixel format as they get. A format= after them can be merged."""
+
+
+class Filter:
+    """
+    One filter of a chain, like scale=1920:-1 or drawbox=x=0:y=0:color=red.
+
+    Args:
+        name (str): Name of the ffmpeg filter. 'scale=1920:-1' style strings are accepted too.
+        *args: Positional (unnamed) filter options, joined with ':'.
+        enable (list, optional): [start, end] in seconds when the filter is active. None means always.
+        **kwargs: Named filter options. Values are put as they are, so quote expressions with commas yourself.
+    """
+
+    def __init__(self, name: str, *args, enable: list = None, **kwargs):
+        if '=' in name and not args and not kwargs:
+            name, raw_args = name.split('=', 1)
+            args = (raw_args,)
+        self.name = name
+        self.args = [str(arg) for arg in args]
+        self.kwargs = {k: str(v) for k, v in kwargs.items()}
+        self.enable = enable
+
+    def __str__(self):
+        options = self.args + [f'{k}={v}' for k, v in self.kwargs.items()]
+        if self.enable is not None:
+            options.append(f"enable='between(t,{self.enable[0]},{self.enable[1]})'")
+        return self.name + ('=' + ':'.join(options) if options else '')
+
+    def __eq__(self, other):
+        return isinstance(other, Filter) and str(self) == str(other)
+
+    def __repr__(self):
+        return f'Filter({str(self)!r})'
+
+
+class Chain:
+    """A linear chain of filters: [in0][in1]filter0,filter1[out0][out1]"""
+
+    def __init__(self, inputs: list[str], filters: list[Filter], outputs: list[str]):
+        self.inputs = inputs
+        self.filters = filters
+        self.outputs = outputs
+
+    def __str__(self):
+        return ''.join(f'[{pad}]' for pad in self.inputs) + ','.join(str(f) for f in self.filters) + \
+            ''.join(f'[{pad}]' for pad in self.outputs)
+
+
+def is_input_pad(pad: str) -> bool:
+    # Input file streams are referenced like 0, 1:v, 2:a. Labels made by FilterGraph never start with a digit.
+    return pad[:1].isdigit()
+
+
+class FilterGraph:
+    """
+    Builds -filter_complex graphs. Inputs, chains and labels are objects, so functions do not concatenate strings and
+    invent labels themselves. Call optimize() before building the command and pass the graph to run_command, which
+    saves it to a -filter_complex_script file.
+
+    Usage:
+        graph = FilterGraph()
+        video = graph.add_chain([f'{graph.add_input(input_path)}:v'], [Filter('scale', 1920, -1)])
+        graph.add_output(video)
+        graph.optimize()
+        cmd = f'ffmpeg -y {graph.get_inputs_str()} {graph.get_maps_str()} "{output_path}"'
+        run_command(cmd, graph)
+    """
+
+    def __init__(self):
+        self.inputs = []
+        self.chains = []
+        self.outputs = []
+        self._aliases = {}
+        self._label_counter = 0
+
+    def add_input(self, path: str, options: str = '', reuse: bool = True) -> int:
+        """
+        Adds an input file. Identical inputs (same path and options) are opened only once.
+
+        Args:
+            path (str): Path to the input file.
+            options (str, optional): Input options like '-loop 1' or '-ss 5 -to 10'.
+            reuse (bool, optional): Whether to reuse an identical input. Pass False if the streams are read one after
+                another (like by concat), otherwise the decoded frames would wait in memory for the next reader.
+
+        Returns:
+            int: Index of the input to reference its streams like f'{index}:v'.
+        """
+        if reuse and [path, options] in self.inputs:
+            return self.inputs.index([path, options])
+        self.inputs.append([path, options])
+        return len(self.inputs) - 1
+
+    def new_label(self, prefix: str = 's') -> str:
+        self._label_counter += 1
+        return f'{prefix}{self._label_counter}'
+
+    def add_chain(self, inputs: list[str], filters: list, outputs: int = 1, prefix: str = 's'):
+        """
+        Adds a chain of filters. Streams mapped directly from inputs (like '0:a') should be added by add_output too,
+        so they are renumbered if unused inputs are dropped.
+
+        Args:
+            inputs (list[str]): Input pads: input streams like '0:v' or labels returned by add_chain before.
+            filters (list): List of Filter or 'name=options' strings.
+            outputs (int, optional): Number of output pads.
+            prefix (str, optional): Prefix of the new labels, just to make the script readable.
+
+        Returns:
+            str if outputs == 1 else list[str]: Labels of the output pads.
+        """
+        filters = [f if isinstance(f, Filter) else Filter(f) for f in filters]
+        labels = [self.new_label(prefix) for _ in range(outputs)]
+        self.chains.append(Chain(list(inputs), filters, labels))
+        return labels[0] if outputs == 1 else labels
+
+    def add_output(self, pad: str):
+        """Marks a pad to be mapped to the output file."""
+        self.outputs.append(pad)
+
+    def resolve(self, pad: str) -> str:
+        while pad in self._aliases:
+            pad = self._aliases[pad]
+        return pad
+
+    def get_inputs_str(self) -> str:
+        return ' '.join(f'{options} -i "{path}"'.strip() for path, options in self.inputs)
+
+    def get_maps_str(self, indexes: list[int] = None) -> str:
+        # indexes of outputs to map, all by default. Several output files can map different outputs of one graph.
+        maps = []
+        for i, pad in enumerate(self.outputs):
+            if indexes is not None and i not in indexes:
+                continue
+            pad = self.resolve(pad)
+            # A bare input index is its video stream here (all filters of a video output were dropped), -map of the
+            # whole input would add its audio and other streams again
+            if pad.isdigit():
+                pad = f'{pad}:v'
+            maps.append(f'-map {pad}' if is_input_pad(pad) else f'-map "[{pad}]"')
+        return ' '.join(maps)
+
+    def __str__(self):
+        return ';\n'.join(str(chain) for chain in self.chains)
+
+    def __bool__(self):
+        return bool(self.chains)
+
+    # Optimization passes
+
+    def optimize(self, duration: float = None):
+        """
+        Runs all optimization passes.
+
+        Args:
+            duration (float, optional): Duration of the media. If passed, timed filters outside it are dropped.
+        """
+        length_before = len(str(self))
+        if duration is not None:
+            self.drop_filters_out_of_duration(duration)
+        self.drop_unused_chains()
+        self.merge_linear_chains()
+        self.merge_format_filters()
+        self.collapse_scale_filters()
+        self.drop_unused_inputs()
+        print_info(f'Filter graph optimized: {length_before} -> {len(str(self))} characters.',
+                   to_print=settings.C_TO_PRINT_PACKAGE_INFO)
+
+    def _replace_pad(self, old: str, new: str):
+        self._aliases[old] = new
+        for chain in self.chains:
+            chain.inputs = [new if pad == old else pad for pad in chain.inputs]
+
+    def drop_filters_out_of_duration(self, duration: float):
+        # Removes overlays, drawboxes etc. whose enable window is outside [0, duration].
+        # An overlay without its overlaid input just passes the main input.
+        for chain in list(self.chains):
+            for f in list(chain.filters):
+                if f.enable is None or (f.enable[0] < duration and f.enable[1] > 0):
+                    continue
+                if chain.filters.index(f) == 0:
+                    chain.inputs = chain.inputs[:1]
+                chain.filters.remove(f)
+            if not chain.filters and len(chain.inputs) == 1 and len(chain.outputs) == 1:
+                self.chains.remove(chain)
+                self._replace_pad(chain.outputs[0], chain.inputs[0])
+
+    def drop_unused_chains(self):
+        # Removes chains whose outputs go nowhere (e.g. preparing an image for a dropped overlay)
+        while True:
+            used = {self.resolve(pad) for pad in self.outputs} | \
+                   {pad for chain in self.chains for pad in chain.inputs}
+            unused = [chain for chain in self.chains if not any(pad in used for pad in chain.outputs)]
+            if not unused:
+                return
+            for chain in unused:
+                self.chains.remove(chain)
+
+    def merge_linear_chains(self):
+        # [a]f1[b];[b]f2[c] -> [a]f1,f2[c] if [b] is used only there
+        merged = True
+        while merged:
+            merged = False
+            mapped = {self.resolve(pad) for pad in self.outputs}
+            for chain in self.chains:
+                if len(chain.outputs) != 1:
+                    continue
+                pad = chain.outputs[0]
+                consumers = [c for c in self.chains if pad in c.inputs]
+                if len(consumers) != 1 or consumers[0].inputs != [pad] or pad in mapped:
+                    continue
+                consumer = consumers[0]
+                chain.filters += consumer.filters
+                chain.outputs = consumer.outputs
+                self.chains.remove(consumer)
+                merged = True
+                break
+
+    def merge_format_filters(self):
+        # format=X after a format=X with only format preserving filters between them does nothing
+        for chain in self.chains:
+            filters = []
+            current_format = None
+            for f in chain.filters:
+                if f.name == 'format':
+                    if str(f) == current_format:
+                        continue
+                    # format=a,format=b -> format=b
+                    if filters and filters[-1].name == 'format':
+                        filters.pop()
+                    current_format = str(f)
+                elif f.name not in FORMAT_PRESERVING_FILTERS:
+                    current_format = None
+                filters.append(f)
+            chain.filters = filters
+
+    def collapse_scale_filters(self):
+        # scale=a:b,scale=c:d -> scale=c:d if c and d are absolute; identical scales are collapsed too
+        for chain in self.chains:
+            filters = []
+            for f in chain.filters:
+                if f.name == 'scale' and filters and filters[-1].name == 'scale':
+                    if f == filters[-1]:
+                        continue
+                    size = get_scale_size(f)
+                    if size and all(isinstance(s, int) and s > 0 for s in size):
+                        filters.pop()
+                filters.append(f)
+            chain.filters = filters
+
+    def drop_unused_inputs(self):
+        # Inputs are referenced by index, so the left ones are renumbered
+        used = {int(re.match(r'\d+', pad).group()) for chain in self.chains for pad in chain.inputs
+                if is_input_pad(pad)}
+        used |= {int(re.match(r'\d+', self.resolve(pad)).group()) for pad in self.outputs
+                 if is_input_pad(self.resolve(pad))}
+        if len(used) == len(self.inputs):
+            return
+        new_indexes = {old: new for new, old in enumerate(sorted(used))}
+
+        def renumber(pad):
+            if not is_input_pad(pad):
+                return pad
+            index, rest = re.match(r'(\d+)(.*)', pad).groups()
+            return f'{new_indexes[int(index)]}{rest}'
+
+        for chain in self.chains:
+            chain.inputs = [renumber(pad) for pad in chain.inputs]
+        self.outputs = [renumber(self.resolve(pad)) for pad in self.outputs]
+        self.inputs = [self.inputs[old] for old in sorted(used)]
+
+
+def escape_filter_value(value) -> str:
+    """
+    Escapes a filter option value (like a path) for both levels of filter graph parsing:
+    first for the filter options (':' and '=' separators), then for the graph ('[', ']', ',', ';').
+
+    Args:
+        value: Value to escape, e.g. 'C:\\Fonts' or 'pipe:1'.
+
+    Returns:
+        str: Escaped value to pass as Filter(..., option=escape_filter_value(value)).
+    """
+    value = re.sub(r"([\\':])", r'\\\1', str(value))
+    return re.sub(r"([\\'\[\],;])", r'\\\1', value)
+
+
+def get_scale_size(scale_filter: Filter):
+    # Returns [w, h] of a scale filter, ints where possible, or None if it can't be parsed
+    if scale_filter.args:
+        size = ':'.join(scale_filter.args).split(':')[:2]
+    else:
+        size = [scale_filter.kwargs.get('w', scale_filter.kwargs.get('width')),
+                scale_filter.kwargs.get('h', scale_filter.kwargs.get('height'))]
+    if len(size) != 2 or None in size:
+        return None
+    return [int(s) if re.fullmatch(r'-?\d+', s) else s for s in size]
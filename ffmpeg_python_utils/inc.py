@@ -1,4 +1,10 @@
+import bisect
+import hashlib
+import heapq
 import re
+import tempfile
+import time
+from contextlib import contextmanager, suppress
 from pathlib import Path
 import os
 from ffmpeg_python_utils.config import *
@@ -27,7 +33,7 @@ def make_lists_equal(**kwargs):
     max_len = max([len(kwargs[i]) if kwargs[i] else 0 for i in kwargs])
     for k, v in kwargs.items():
         if v and len(v) < max_len:
-            print_info(f'List "{k}" is less than the longest ({max_len}). Appending the last element until it is equal.', 'red', C_TO_PRINT_PACKAGE_INFO)
+            print_info(f'List "{k}" is less than the longest ({max_len}). Appending the last element until it is equal.', 'red', settings.C_TO_PRINT_PACKAGE_INFO)
 
     for k, v in kwargs.items():
         if v:
@@ -72,12 +78,12 @@ def replace_forbidden_chars(file_path, to_rename: bool):
         new_file_path = os.path.join(parent_folder, new_file_name)
         if to_rename:
             os.rename(file_path, new_file_path)
-            print_info(f"{file_path} has been renamed to {new_file_path}", C_TO_PRINT_PACKAGE_INFO)
+            print_info(f"{file_path} has been renamed to {new_file_path}", settings.C_TO_PRINT_PACKAGE_INFO)
         else:
-            print_info(f"{file_path} has been changed (not renamed) to {new_file_path}", C_TO_PRINT_PACKAGE_INFO)
+            print_info(f"{file_path} has been changed (not renamed) to {new_file_path}", settings.C_TO_PRINT_PACKAGE_INFO)
         return str(new_file_path)
     else:
-        print_info(f"{file_path} does not need to be renamed", C_TO_PRINT_PACKAGE_INFO)
+        print_info(f"{file_path} does not need to be renamed", settings.C_TO_PRINT_PACKAGE_INFO)
         return file_path
 
 
@@ -87,6 +93,76 @@ def check_relative_position(position):
     elif not isinstance(position[0], str) and (position[0] > 1.0 or position[0] < 0.0):
         raise ValueError(f'position must be between 0 and 1, got {position}')
 
+def temp_workspace():
+    """
+    Creates a unique temporary folder in C_TMP_DIR, so parallel calls never share temporary files.
+    Use it as a context manager, the folder is removed on exit even if an error occurs.
+    :return: tempfile.TemporaryDirectory, which gives the folder path on enter
+    """
+    return tempfile.TemporaryDirectory(prefix='ffmpeg_python_utils_', dir=settings.C_TMP_DIR)
+
+
+def get_temp_path_near(path):
+    """
+    Creates a unique empty file in the folder of path with the same extension (ffmpeg picks the format by it).
+    Write there and os.replace path with it, so nobody sees a half-written file at path.
+    :param path: path to be replaced later
+    :return: path of the temporary file
+    """
+    path_obj = Path(path)
+    file_descriptor, temp_path = tempfile.mkstemp(suffix=path_obj.suffix, prefix=f'.{path_obj.stem}_',
+                                                  dir=path_obj.parent)
+    os.close(file_descriptor)
+    # mkstemp makes the file private, the replaced file should keep usual permissions
+    os.chmod(temp_path, os.stat(path).st_mode if os.path.exists(path) else 0o644)
+    return temp_path
+
+
+@contextmanager
+def locked_file(path, stale_after=600):
+    """
+    Lock for a read-modify-write of a file shared by threads and processes (caches in C_CACHE_DIR). It holds
+    path + '.lock', created exclusively, so it works on every OS and file system.
+    Use it as a context manager, others wait on enter until the lock is released.
+    :param path: path to the locked file
+    :param stale_after: seconds after which a lock is taken over, it was left by a killed process
+    """
+    lock_path = f'{path}.lock'
+    while True:
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            with suppress(FileNotFoundError):
+                if time.time() - os.path.getmtime(lock_path) > stale_after:
+                    os.remove(lock_path)
+                    continue
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        with suppress(FileNotFoundError):
+            os.remove(lock_path)
+
+
+def get_file_fingerprint(path, chunk_size=1024 * 1024):
+    """
+    Quick fingerprint of a file to notice that it was changed: its size, modification time and hash of its first and
+    last chunks. The whole file is not read, so it is fast for long videos.
+    :param path: path to the file
+    :param chunk_size: size of the hashed chunks in bytes
+    :return: fingerprint string
+    """
+    stat = os.stat(path)
+    hash_object = hashlib.sha256()
+    with open(path, 'rb') as file:
+        hash_object.update(file.read(chunk_size))
+        if stat.st_size > chunk_size:
+            file.seek(max(stat.st_size - chunk_size, chunk_size))
+            hash_object.update(file.read(chunk_size))
+    return f'{stat.st_size}-{stat.st_mtime_ns}-{hash_object.hexdigest()}'
+
+
 def save_string_return_output(string, output_path:str):
     with open(output_path, 'w') as file:
         file.write(string)
@@ -100,11 +176,11 @@ def get_codec_meeting_constraints(sizes):
     :param sizes: list of pair-sizes or just pair-sizes
     :return: codec to use
     """
-    if C_CODEC == 'cpu':
-        return C_CODEC
-    elif C_CODEC == 'amd':
-        return C_CODEC
-    elif C_CODEC == 'nvidia':
+    if settings.C_CODEC == 'cpu':
+        return settings.C_CODEC
+    elif settings.C_CODEC == 'amd':
+        return settings.C_CODEC
+    elif settings.C_CODEC == 'nvidia':
         use_cpu = False
         if isinstance(sizes[0], list):
             for size_pair in sizes:
@@ -126,6 +202,86 @@ def get_codec_meeting_constraints(sizes):
             print_info(
                 f'Width or height is less then 145, which is not compatible with nvidia codec. '
                 f'Using cpu (libx264) instead.',
-                'red', C_TO_PRINT_PACKAGE_INFO)
+                'red', settings.C_TO_PRINT_PACKAGE_INFO)
             return 'cpu'
-    return C_CODEC
\ No newline at end of file
+    return settings.C_CODEC
+
+def merge_intervals(intervals):
+    """
+    Sorts [start, end] intervals and merges the overlapping/touching ones.
+    :param intervals: list of [start, end]
+    :return: list of merged [start, end]
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def invert_intervals(intervals, duration, padding=0):
+    """
+    Returns the parts of [0, duration] which are not covered by intervals.
+    Each kept part is widened by padding on both sides (e.g. to keep some silence around the speech).
+    :param intervals: list of [start, end] to exclude
+    :param duration: total duration
+    :param padding: how much to widen each kept part, in seconds
+    :return: list of merged [start, end]
+    """
+    kept = []
+    position = 0
+    for start, end in merge_intervals(intervals):
+        if start > position:
+            kept.append([max(position - padding, 0), min(start + padding, duration)])
+        position = max(position, end)
+    if position < duration:
+        kept.append([max(position - padding, 0), duration])
+    return merge_intervals(kept)
+
+
+def get_time_buckets(intervals, duration, max_buckets):
+    """
+    Splits [0, duration] into buckets at the starts/ends of intervals, so each bucket knows which intervals are active
+    in it. Neighbour buckets are joined until there are at most max_buckets of them.
+    :param intervals: list of [start, end]
+    :param duration: total duration
+    :param max_buckets: maximum number of buckets
+    :return: list of [start, end, indexes of intervals overlapping the bucket]
+    """
+    bounds = sorted({0, duration} | {min(max(t, 0), duration) for interval in intervals for t in interval})
+    buckets = [[start, end, set()] for start, end in zip(bounds, bounds[1:])]
+    for i, (start, end) in enumerate(intervals):
+        for bucket in buckets[max(bisect.bisect_right(bounds, start) - 1, 0):bisect.bisect_left(bounds, end)]:
+            bucket[2].add(i)
+
+    # Only neighbours are joined, so buckets are a linked list and a heap keeps the costs of joining each one with
+    # the next. Costs of joined buckets are outdated, they are recognized by the versions and skipped.
+    def cost(left, right):
+        # Active intervals the join adds, weighted by the duration they are added for
+        return len(right[2] - left[2]) * (left[1] - left[0]) + len(left[2] - right[2]) * (right[1] - right[0])
+
+    next_bucket = list(range(1, len(buckets))) + [None]
+    previous_bucket = [None] + list(range(len(buckets) - 1))
+    versions = [0] * len(buckets)
+    heap = [(cost(buckets[i], buckets[i + 1]), i, 0, 0) for i in range(len(buckets) - 1)]
+    heapq.heapify(heap)
+    count = len(buckets)
+    while count > max(max_buckets, 1):
+        _, i, version, next_version = heapq.heappop(heap)
+        j = next_bucket[i]
+        if buckets[i] is None or j is None or versions[i] != version or versions[j] != next_version:
+            continue
+        buckets[i] = [buckets[i][0], buckets[j][1], buckets[i][2] | buckets[j][2]]
+        buckets[j] = None
+        next_bucket[i] = next_bucket[j]
+        if next_bucket[j] is not None:
+            previous_bucket[next_bucket[j]] = i
+        versions[i] += 1
+        count -= 1
+        for left, right in ((previous_bucket[i], i), (i, next_bucket[i])):
+            if left is not None and right is not None:
+                heapq.heappush(heap, (cost(buckets[left], buckets[right]), left, versions[left], versions[right]))
+    buckets = [bucket for bucket in buckets if bucket is not None]
+    return [[start, end, sorted(active)] for start, end, active in buckets]
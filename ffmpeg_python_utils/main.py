@@ -1,22 +1,180 @@
+import contextvars
 import datetime
+import hashlib
 import inspect
 import json
 import subprocess
 import os
-from functools import wraps
-from .config import C_TO_RENAME_FILES, C_TO_PRINT_PACKAGE_INFO, C_TO_SAVE_LOGS, C_TO_PRINT_FFMPEG_DEBUG, \
-    C_TO_PRINT_EXECUTION_TIME, C_CODEC, C_CODEC_SETTINGS, C_TO_PRINT_ONLY_FFMPEG_ERRORS
+import re
+import threading
+from contextlib import contextmanager, suppress
+from functools import lru_cache, wraps
+from .config import settings, Config
+from .graph import FilterGraph, Filter, escape_filter_value
+from .subtitles import save_ass_script, is_ass_compatible
+from .other import mix_audio_blocks
 from .inc import replace_forbidden_chars, print_info, make_lists_equal, \
-    get_codec_meeting_constraints, save_string_return_output
+    get_codec_meeting_constraints, save_string_return_output, invert_intervals, temp_workspace, get_temp_path_near, \
+    get_time_buckets, merge_intervals, get_file_fingerprint
+from .metrics import record_call
+
+PIPE_INPUT = 'pipe:0'
+"""Input path of a stage of get_chained_video or of a Stream input. ffmpeg reads it from stdin."""
+PIPE_OUTPUT = 'pipe:1'
+"""Output path of a stage of get_chained_video or of a Stream output. ffmpeg writes it to stdout."""
+PIPE_CHUNK_SIZE = 1024 ** 2
+"""Bytes moved at once between a Stream and ffmpeg."""
+pipe_ends = contextvars.ContextVar('pipe_ends', default=None)
+"""[stdin, stdout] file descriptors of pipe:0 and pipe:1 of the function running in the current context."""
+pipe_formats = contextvars.ContextVar('pipe_formats', default=[None, None])
+"""[input, output] ffmpeg formats of Streams. None means NUT of get_chained_video stages."""
+call_metrics = contextvars.ContextVar('call_metrics', default=None)
+"""
+{'commands', 'ffmpeg_time', 'codec'} of ffmpeg commands run by the outermost function call in the current context.
+codec is the key of C_CODEC_SETTINGS the last encoding command used, None if the commands only copied streams.
+"""
+AUDIO_COPY_EXTENSIONS = {'aac': ('.m4a', '.aac'), 'alac': ('.m4a',), 'mp3': ('.mp3',), 'opus': ('.opus', '.ogg'),
+                         'vorbis': ('.ogg',), 'flac': ('.flac',), 'ac3': ('.ac3',), 'pcm_s16le': ('.wav',)}
+"""Audio codec -> extensions of files get_audio_from_video copies it into without re-encoding. .mka keeps any codec."""
+AUDIO_ENCODERS = {'mp3': 'libmp3lame', 'opus': 'libopus', 'vorbis': 'libvorbis'}
+"""Audio codec (as ffprobe names it) -> ffmpeg encoder, where they differ."""
+CHAIN_STAGE_FUNCTIONS = ('add_rectangle_to_video', 'add_text_to_video', 'add_image_to_video',
+                         'add_colored_space_around_video', 'add_blurred_space_around_video', 'add_video_to_video',
+                         'get_cropped_video', 'get_resized_video', 'get_subclips_with_sound', 'get_jump_cut_video',
+                         'get_mirrored_video', 'get_rotated_video')
+"""Functions get_chained_video runs as stages. They write their output by get_output_str, which streams raw frames
+to the next stage. Functions copying streams (like add_audio_to_video) or writing audio and images can't be stages."""
+INPUT_PROBING_FUNCTIONS = ('get_video_info', 'get_audio_info', 'get_image_info', 'get_keyframe_times',
+                           'get_loudness_measurement', 'get_silence_intervals')
+"""Functions which need a file input, since ffprobe or a separate pass reads it before the render. Functions calling
+them for their input (like add_text_to_video for the duration) can't read a Stream or a stage pipe either."""
+PER_CHANGE_ARGUMENTS = {
+    'add_rectangle_to_video': ('start_times', 'durations', 'x_y_coordinates', 'sizes', 'rect_colors', 'opacities'),
+    'add_text_to_video': ('texts', 'fonts_paths', 'font_sizes', 'font_colors', 'start_times', 'durations',
+                          'x_y_coordinates'),
+    'add_image_to_video': ('input_image_paths', 'x_y_coordinates', 'start_times', 'durations', 'img_goal_sizes',
+                           'opacities'),
+    'add_video_to_video': ('video_to_overlay_paths', 'goal_sizes', 'x_y_coordinates', 'start_times', 'durations',
+                           'opacities'),
+}
+"""Arguments with one element per change of the functions render_only_affected_ranges splits between ranges."""
+MOVFLAGS_EXTENSIONS = ('.mp4', '.mov', '.m4v', '.m4a', '.3gp')
+"""Containers of the mov muxer, which takes -movflags. +faststart moves their index to the front for streaming."""
+ROTATION_METADATA_EXTENSIONS = ('.mp4', '.mov', '.m4v')
+"""Containers with a display matrix, so get_rotated_video turns them by multiples of 90 degrees without encoding."""
+
+
+class Stream:
+    """
+    An input or output of a function which is not a regular file: a binary file-like object (like an upload stream or
+    sys.stdout.buffer), a socket, a file descriptor of a pipe or a path to a named FIFO. ffmpeg reads and writes
+    it through stdin and stdout, and pump threads move the data, so nothing is saved on disk. Its format can't be
+    guessed from an extension, so it is given explicitly. mp4 and mov outputs are fragmented, since a pipe can't
+    be rewritten at the end.
+    Functions which probe their input (INPUT_PROBING_FUNCTIONS) or run several ffmpeg commands can only take a Stream
+    as the output: add_text_to_video, add_rectangle_to_video, add_image_to_video, add_video_to_video (for the
+    duration), get_jump_cut_video, add_audio_to_video with premix or normalize and get_audio_from_video with
+    normalize. They raise a ValueError for a Stream input. With only_affected_ranges they can't write a Stream
+    output either. get_audio_from_video and get_rotated_video take a Stream
+    input, but encode it, as they can't probe whether it could be copied.
+
+    Usage:
+        get_resized_video(Stream(upload, 'mpegts'), Stream(sys.stdout.buffer, 'mpegts'), [1280, 720])
+
+    Args:
+        target: The file-like object, socket, file descriptor or FIFO path.
+        format (str): ffmpeg format of the data, like 'mpegts', 'matroska', 'mp4' or 'nut'.
+    """
+
+    def __init__(self, target, format: str):
+        self.target = target
+        self.format = format
+
+    def open(self, mode: str):
+        # Binary file object to read ('rb') or write ('wb'), and whether it was opened here and should be closed
+        if isinstance(self.target, str):
+            return open(self.target, mode), True
+        if isinstance(self.target, int):
+            return os.fdopen(self.target, mode, closefd=False), True
+        if hasattr(self.target, 'makefile') and not hasattr(self.target, 'read' if 'r' in mode else 'write'):
+            return self.target.makefile(mode), True
+        return self.target, False
+
+    def __repr__(self):
+        return f'Stream({self.target!r}, {self.format!r})'
+
+
+@contextmanager
+def connect_streams(kwargs: dict, input_name: str):
+    # Replaces Stream arguments with pipe:0 and pipe:1 and connects them to ffmpeg with OS pipes and pump threads.
+    # The pipes are closed when the function finishes, so the pumps get the end of file or a broken pipe.
+    ends, formats, pumps, errors = [None, None], [None, None], [], []
+
+    def pump(source, destination, files_to_close):
+        try:
+            while chunk := source.read(PIPE_CHUNK_SIZE):
+                destination.write(chunk)
+        except BrokenPipeError:
+            # ffmpeg stopped reading, its return code tells why
+            pass
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            with suppress(BrokenPipeError):
+                destination.flush()
+            for file in files_to_close:
+                with suppress(BrokenPipeError):
+                    file.close()
+
+    for i, name in enumerate([input_name, 'output_path']):
+        stream = kwargs.get(name)
+        if not isinstance(stream, Stream):
+            continue
+        read_end, write_end = os.pipe()
+        if i == 0:
+            source, is_opened = stream.open('rb')
+            pipe_file = os.fdopen(write_end, 'wb')
+            files_to_close = [pipe_file, source] if is_opened else [pipe_file]
+            pumps.append(threading.Thread(target=pump, args=(source, pipe_file, files_to_close)))
+            ends[0], kwargs[name] = read_end, PIPE_INPUT
+        else:
+            destination, is_opened = stream.open('wb')
+            pipe_file = os.fdopen(read_end, 'rb')
+            files_to_close = [pipe_file, destination] if is_opened else [pipe_file]
+            pumps.append(threading.Thread(target=pump, args=(pipe_file, destination, files_to_close)))
+            ends[1], kwargs[name] = write_end, PIPE_OUTPUT
+        formats[i] = stream.format
+
+    ends_token, formats_token = pipe_ends.set(ends), pipe_formats.set(formats)
+    for thread in pumps:
+        thread.start()
+    try:
+        yield kwargs
+    finally:
+        pipe_ends.reset(ends_token)
+        pipe_formats.reset(formats_token)
+        for fd in ends:
+            if fd is not None:
+                os.close(fd)
+        for thread in pumps:
+            thread.join()
+    if errors:
+        raise errors[0]
 
 
 def process(function_to_modify):
-    # Renames input_path if input_path == output_path, then deletes it.
+    # If input_path == output_path, renders into a temp file next to output_path, then replaces output_path with it.
     # If needed renames input file if space in its name to avoid problems.
     # Catches and prints errors from console during .run() ffmpeg-python command.
+    # Stream inputs and outputs are replaced with pipe:0 and pipe:1, which pump threads connect with them.
+    # A config (Config or a dict of C_ settings) applies to the call and the calls it makes.
 
     @wraps(function_to_modify)
-    def wrapper(input_path=None, *args, **kwargs):
+    def wrapper(input_path=None, *args, config=None, **kwargs):
+        if config is not None:
+            with config if isinstance(config, Config) else Config(**config):
+                return wrapper(input_path, *args, **kwargs)
+
         # Get the names of the arguments in the decorated function
         arg_names = inspect.getfullargspec(function_to_modify).args
         if input_path:
@@ -27,105 +185,347 @@ def process(function_to_modify):
         else:
             input_path = kwargs[arg_names[0]]
 
+        if isinstance(input_path, Stream) or isinstance(kwargs.get('output_path'), Stream):
+            output_stream = kwargs.get('output_path')
+            with connect_streams(kwargs, arg_names[0]) as kwargs:
+                res = wrapper(**kwargs)
+            return output_stream if res == PIPE_OUTPUT else res
+
         # Checking if readable
         # Renaming file if needed
-        # Rewriting input_path with output_path
         iterable_input_path = input_path if not isinstance(input_path, str) else [input_path]
-        files_to_delete_after_renaming = []
         for i, input_path in enumerate(iterable_input_path):
-            # Checking if list was initially passed, and there are duplicates in iterable_input_path,
-            # and we rewrite file (at some point there will be file with "_tmp" at the end, and it will try to read it without "_tmp")
-            if len(iterable_input_path) > 1 and input_path in iterable_input_path[i:] and 'output_path' in kwargs and \
-                    kwargs['output_path'] in iterable_input_path:
-                raise IOError(
-                    f"If you want to rewrite file, then please exclude duplicates from input_paths. Consider not rewriting input_path with output_path ({kwargs['output_path']})")
-
-            # Check if there is a readable file at path
+            # Check if there is a readable file at path. Stages of get_chained_video and Streams are read from stdin
+            if input_path == PIPE_INPUT:
+                if function_to_modify.__name__ in INPUT_PROBING_FUNCTIONS:
+                    raise ValueError(f'{function_to_modify.__name__} can not read a Stream or a stage pipe, the input '
+                                     f'is probed by ffprobe. See Stream for functions which take a Stream input.')
+                continue
             if not os.access(input_path, os.R_OK):
                 raise IOError(
                     f"Path {input_path} is not readable.")
 
             # Rename input file if special symbols in name
-            if C_TO_RENAME_FILES:
-                input_path = replace_forbidden_chars(input_path, True)
+            if settings.C_TO_RENAME_FILES:
+                iterable_input_path[i] = replace_forbidden_chars(input_path, True)
                 if 'output_path' in kwargs:
                     kwargs['output_path'] = replace_forbidden_chars(kwargs['output_path'], True)
 
-            # Dealing with input file rewriting ffmpeg feature
-            # If there is 'output_path' in kwargs then check if it is equal to path
-            if 'output_path' in kwargs:
-                # If it equals, then we rename input_path due to the limitation of ffmpeg - it can't rewrite the input file
-                if kwargs['output_path'] == input_path:
-                    files_to_delete_after_renaming.append(input_path + '_tmp')
-                    try:
-                        os.rename(input_path, input_path + '_tmp')
-                        iterable_input_path[i] = input_path + '_tmp'
-                        print_info(f'Renamed {input_path} to {input_path + "_tmp"}', to_print=C_TO_PRINT_PACKAGE_INFO)
-                    except FileExistsError:
-                        # if we already have the input_path+'_tmp', we delete it, bc it is probably due to error
-                        os.remove(input_path + '_tmp')
-                        os.rename(input_path, input_path + '_tmp')
-                        iterable_input_path[i] = input_path + '_tmp'
-                        print_info(
-                            f'Found already created {input_path + "_tmp"} in the {input_path}! Deleted the old one and '
-                            f'renamed {input_path} to {input_path + "_tmp"}.', to_print=C_TO_PRINT_PACKAGE_INFO)
-
         # Dealing with iterable_input_path
         if len(iterable_input_path) == 1:
             arg_dict = {arg_names[0]: iterable_input_path[0]}
             kwargs.update(arg_dict)
 
-        # Running function
+        # Dealing with input file rewriting ffmpeg feature.
+        # ffmpeg can't rewrite the input file, so we write to a unique temp file and replace output_path after.
+        # The input file is never renamed, so other calls can read it at the same time.
+        output_to_replace = None
+        if 'output_path' in kwargs and kwargs['output_path'] in iterable_input_path:
+            output_to_replace = kwargs['output_path']
+            kwargs['output_path'] = get_temp_path_near(output_to_replace)
+            print_info(f'Rewriting {output_to_replace}, rendering to {kwargs["output_path"]} first',
+                       to_print=settings.C_TO_PRINT_PACKAGE_INFO)
+
+        # Running function. ffmpeg commands of nested calls are counted in the metrics of the outermost one.
         print_info(f'Running {function_to_modify} in ffmpeg_python_utils package with kwargs: \n{kwargs}',
-                   to_print=C_TO_PRINT_PACKAGE_INFO)
-        res = function_to_modify(**kwargs)
-
-        # If we rewrite the input_path, we have {input_path + "_tmp"} there. Deleting it.
-        if files_to_delete_after_renaming:
-            for file in files_to_delete_after_renaming:
-                os.remove(file)
+                   to_print=settings.C_TO_PRINT_PACKAGE_INFO)
+        metrics_token = call_metrics.set({'commands': 0, 'ffmpeg_time': 0.0, 'codec': None}) \
+            if call_metrics.get() is None else None
+        start_time = datetime.datetime.now()
+        try:
+            res = function_to_modify(**kwargs)
+        except BaseException:
+            if output_to_replace and os.path.exists(kwargs['output_path']):
+                os.remove(kwargs['output_path'])
+            raise
+        finally:
+            metrics = call_metrics.get()
+            if metrics_token:
+                call_metrics.reset(metrics_token)
+        # Probes are not recorded, only calls which ran ffmpeg. Piped inputs can't be probed for the features.
+        # The codec is the one the commands used (get_codec_meeting_constraints may fall back from C_CODEC).
+        if metrics_token and metrics['commands'] and settings.C_TO_RECORD_METRICS and \
+                kwargs[arg_names[0]] != PIPE_INPUT:
+            record_call(function_to_modify.__name__, metrics['codec'] or 'copy', kwargs[arg_names[0]], kwargs,
+                        (datetime.datetime.now() - start_time).total_seconds(), metrics['ffmpeg_time'])
+
+        # If we rewrite the input_path, the result is in the temp file. Replacing output_path with it.
+        if output_to_replace:
+            os.replace(kwargs['output_path'], output_to_replace)
+            if res == kwargs['output_path']:
+                res = output_to_replace
         return res
 
     return wrapper
 
 
-def run_command(cmd, filter_str=None):
+def run_command(cmd, filter_graph=None, input_chunks=None):
     # Get the current time
     start_time = datetime.datetime.now()
     # Check program
     is_ffprobe = cmd.startswith('ffprobe')
+    if is_ffprobe and PIPE_INPUT in cmd:
+        raise ValueError('A piped input can not be probed. Use the function as the first stage of get_chained_video '
+                         'or with a file input.')
+    # Pipes of get_chained_video stages and Streams
+    ends = pipe_ends.get() or [None, None]
+    if ends[0] is not None or ends[1] is not None:
+        cmd = get_piped_command(cmd, ends)
     # Construct cmd line
-    cmd += ' -report' if C_TO_SAVE_LOGS else ''
-    if C_TO_PRINT_ONLY_FFMPEG_ERRORS:
+    cmd += ' -report' if settings.C_TO_SAVE_LOGS else ''
+    if settings.C_TO_PRINT_ONLY_FFMPEG_ERRORS:
         cmd += ' -loglevel fatal'
-    elif C_TO_PRINT_FFMPEG_DEBUG:
+    elif settings.C_TO_PRINT_FFMPEG_DEBUG:
         cmd += ' -loglevel debug'
     else:
         cmd += ' -loglevel warning'
-    cmd += ' -stats' if not is_ffprobe and not C_TO_PRINT_ONLY_FFMPEG_ERRORS else ''
-    command_file = ''
-    if len(cmd) > 8000:
-        command_file = save_string_return_output(filter_str, 'cmd_tmp.txt')
-        cmd = cmd.replace(f' -filter_complex "{filter_str}"', ' -filter_complex_script "cmd_tmp.txt"')
-    # Print final command
-    if not is_ffprobe: print_info(cmd, 'green', C_TO_PRINT_PACKAGE_INFO)
-    # Run
-    res = subprocess.run(cmd, check=True, stdout=subprocess.PIPE).stdout
-    # Clear tmp file
-    if command_file:
-        os.remove(command_file)
+    cmd += ' -stats' if not is_ffprobe and not settings.C_TO_PRINT_ONLY_FFMPEG_ERRORS else ''
+    with temp_workspace() as workspace:
+        # The filter graph is always passed as a script file, so the command line length is never a problem
+        if filter_graph:
+            command_file = save_string_return_output(str(filter_graph),
+                                                     os.path.join(workspace, 'filter_complex_script.txt'))
+            program, args = cmd.split(' ', 1)
+            cmd = f'{program} -filter_complex_script "{command_file}" {args}'
+        # Print final command
+        if not is_ffprobe: print_info(cmd, 'green', settings.C_TO_PRINT_PACKAGE_INFO)
+        # Run. Chunks (e.g. raw audio) are streamed to the stdin of ffmpeg, which reads them from pipe:0
+        stdout = ends[1] if PIPE_OUTPUT in cmd else None
+        if input_chunks is None:
+            stdin = ends[0] if PIPE_INPUT in cmd else None
+            res = subprocess.run(cmd, check=True, stdin=stdin, stdout=stdout or subprocess.PIPE).stdout or b''
+        else:
+            with subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=stdout or subprocess.DEVNULL) as ffmpeg_process:
+                try:
+                    for chunk in input_chunks:
+                        ffmpeg_process.stdin.write(chunk)
+                    ffmpeg_process.stdin.close()
+                except BrokenPipeError:
+                    # ffmpeg exited early, its return code tells why
+                    pass
+            if ffmpeg_process.returncode:
+                raise subprocess.CalledProcessError(ffmpeg_process.returncode, cmd)
+            res = b''
     # Calculate the time it took. Since ffprobe is lightning fast we do not use it there
     if not is_ffprobe:
         time_diff = datetime.datetime.now() - start_time
         time_diff_seconds = time_diff.total_seconds()
-        print_info(f"Time it took (seconds): {time_diff_seconds:.2f}.", 'green', C_TO_PRINT_EXECUTION_TIME)
+        metrics = call_metrics.get()
+        if metrics is not None:
+            metrics['commands'] += 1
+            metrics['ffmpeg_time'] += time_diff_seconds
+            metrics['codec'] = get_command_codec(cmd) or metrics['codec']
+        print_info(f"Time it took (seconds): {time_diff_seconds:.2f}.", 'green', settings.C_TO_PRINT_EXECUTION_TIME)
     return res
 
 
+def get_command_codec(cmd: str) -> str:
+    # Key of C_CODEC_SETTINGS whose settings the command encodes with, None if it only copies or writes stage pipes
+    return next((codec for codec, codec_settings in settings.C_CODEC_SETTINGS.items() if codec_settings in cmd), None)
+
+
+def get_piped_command(cmd: str, ends: list) -> str:
+    # Sets the formats of pipe:0 and pipe:1, which ffmpeg can't guess. Stages of get_chained_video read NUT.
+    # mp4 written to a pipe can't be rewritten at the end to move the index forward, so it is fragmented.
+    # Inputs which set their own format (like raw audio of premix) keep it.
+    input_format, output_format = pipe_formats.get()
+    if ends[0] is not None:
+        parts = cmd.split(f'-i "{PIPE_INPUT}"')
+        for i in range(len(parts) - 1):
+            options = parts[i].rsplit(' -i ', 1)[-1]
+            if '-f ' not in options:
+                parts[i] += f'-f {input_format or "nut"} '
+        cmd = f'-i "{PIPE_INPUT}"'.join(parts)
+    if output_format:
+        movflags = '-movflags frag_keyframe+empty_moov' if output_format in ('mp4', 'mov') else ''
+        cmd = cmd.replace('-movflags +faststart', movflags)
+        cmd = cmd.replace(f'"{PIPE_OUTPUT}"', f'-f {output_format} "{PIPE_OUTPUT}"')
+    return cmd
+
+
+def get_output_str(output_path: str, codec_to_use: str = None, options: str = '') -> str:
+    # Encoding options and the output path, which end ffmpeg commands.
+    # Stages of get_chained_video don't encode, they pass raw streams to the next stage.
+    if output_path == PIPE_OUTPUT and not pipe_formats.get()[1]:
+        return f'{settings.C_PIPE_SETTINGS} {PIPE_OUTPUT}'
+    # The last stage gets PCM audio, which mp4 can't keep, so audio is encoded even if the command copies it
+    ends = pipe_ends.get()
+    audio_str = ' -c:a aac' if ends and ends[0] is not None and not pipe_formats.get()[0] else ''
+    codec_settings = settings.C_CODEC_SETTINGS[codec_to_use or settings.C_CODEC]
+    return f'{options} {get_movflags_str(output_path)}{codec_settings}{audio_str} "{output_path}"'.strip()
+
+
+def get_movflags_str(output_path: str) -> str:
+    # Only the mov muxer takes -movflags. For pipes get_piped_command replaces it by the flags of their format.
+    if output_path == PIPE_OUTPUT or os.path.splitext(output_path)[1].lower() in MOVFLAGS_EXTENSIONS:
+        return '-movflags +faststart '
+    return ''
+
+
+def get_audio_codec_str(input_path: str) -> str:
+    # Encodes audio with the codec, sample rate and channels of input_path, so the result can be joined with
+    # stream-copied parts of it by the concat demuxer
+    audio_info = get_audio_info(input_path)
+    encoder = AUDIO_ENCODERS.get(audio_info['codec'], audio_info['codec'])
+    return f'-c:a {encoder} -ar {audio_info["sample_rate"]} -ac {audio_info["channels"]}'
+
+
+def render_intervals(input_video_path: str, output_path: str, intervals: list[list[float]],
+                     codec_to_use: str = None, options: str = '') -> str:
+    # Keeps only the given [start, end] intervals of the video and audio in one decode using select/aselect.
+    # Input is seeked to the first interval, so only the needed part of the file is decoded.
+    # options (like get_audio_codec_str) go before the encoding settings.
+    start, end = intervals[0][0], intervals[-1][1]
+    select_str = '+'.join(f'between(t,{s - start:.3f},{e - start:.3f})' for s, e in intervals)
+    graph = FilterGraph()
+    index = graph.add_input(input_video_path, f'-ss {start} -to {end}')
+    graph.add_output(graph.add_chain([f'{index}:v'], [Filter('select', f"'{select_str}'"),
+                                                      Filter('setpts', 'N/FRAME_RATE/TB')], prefix='v'))
+    graph.add_output(graph.add_chain([f'{index}:a'], [Filter('aselect', f"'{select_str}'"),
+                                                      Filter('asetpts', 'N/SR/TB')], prefix='a'))
+    graph.optimize()
+    cmd = f'ffmpeg -y {graph.get_inputs_str()} {graph.get_maps_str()} ' \
+          f'{get_output_str(output_path, codec_to_use, options)}'
+    run_command(cmd, graph)
+    return output_path
+
+
+def get_stream_copied_subclip(input_video_path: str, output_path: str, start: float, end: float) -> str:
+    # Cuts [start, end] without re-encoding. Start should be a keyframe, otherwise ffmpeg starts at the previous one.
+    cmd = f'ffmpeg -y -ss {start} -to {end} -i "{input_video_path}" -map 0:v -map 0:a? -c copy ' \
+          f'-avoid_negative_ts make_zero "{output_path}"'
+    run_command(cmd)
+    return output_path
+
+
+def save_concat_list(input_paths: list[str], list_path: str, durations: list[float] = None) -> str:
+    # Saves a list for the concat demuxer. With durations each file (like an image) is shown for its duration.
+    escaped_paths = [os.path.abspath(path).replace("'", "'\\''") for path in input_paths]
+    if durations:
+        # The demuxer uses the duration of the last file only if another file follows it
+        escaped_paths.append(escaped_paths[-1])
+    list_str = ''
+    for i, escaped_path in enumerate(escaped_paths):
+        list_str += f"file '{escaped_path}'\n"
+        if durations and i < len(durations):
+            list_str += f'duration {durations[i]}\n'
+    return save_string_return_output(list_str, list_path)
+
+
+def concat_without_reencoding(input_video_paths: list[str], output_path: str) -> str:
+    # Joins segments with the concat demuxer. Segments must share codecs and their parameters.
+    with temp_workspace() as tmp_dir:
+        list_path = save_concat_list(input_video_paths, os.path.join(tmp_dir, 'concat_list.txt'))
+        cmd = f'ffmpeg -y -f concat -safe 0 -i "{list_path}" -c copy {get_movflags_str(output_path)}"{output_path}"'
+        run_command(cmd)
+    return output_path
+
+
+def render_only_affected_ranges(function, arguments: dict) -> str:
+    # Re-encodes only the parts of the video touched by timed changes and stream-copies the rest.
+    # arguments are all arguments of function. The ones in PER_CHANGE_ARGUMENTS describe one change per element, so
+    # they are split between the ranges, and start_times are shifted to each range.
+    # Ranges are widened to keyframes, so the copied parts are cut at keyframes and the concat demuxer joins them.
+    # A manifest of the render is saved next to the output. On the next call with the same source and settings,
+    # ranges with the same changes are copied from the previous output, so only the changed ones are re-encoded.
+    input_video_path = arguments.get('input_video_path', arguments.get('input_path'))
+    output_path = arguments['output_path']
+    if output_path == PIPE_OUTPUT:
+        raise ValueError('only_affected_ranges can not write a Stream or a stage pipe, the output is joined from '
+                         'segments and read back on the next call.')
+    arguments = {k: (list(v) if isinstance(v, list) else v) for k, v in arguments.items()
+                 if k not in ('input_video_path', 'input_path', 'output_path', 'only_affected_ranges')}
+    plural_names = [k for k in PER_CHANGE_ARGUMENTS[function.__name__] if isinstance(arguments.get(k), list)
+                    and arguments[k]]
+    make_lists_equal(**{k: arguments[k] for k in plural_names})
+    windows = [[start, start + duration] for start, duration in zip(arguments['start_times'], arguments['durations'])]
+
+    duration = get_video_info(input_video_path)['duration']
+    keyframes = get_keyframe_times(input_video_path)
+    ranges = []
+    for start, end in merge_intervals(windows):
+        start = max([k for k in keyframes if k <= max(start, 0)], default=0)
+        end = min([k for k in keyframes if k >= end], default=duration)
+        if start < end:
+            ranges.append([start, min(end, duration)])
+    ranges = merge_intervals(ranges)
+    print_info(f'Re-encoding {len(ranges)} ranges, {sum(e - s for s, e in ranges):.2f} of {duration:.2f} seconds.',
+               to_print=settings.C_TO_PRINT_PACKAGE_INFO)
+    if ranges == [[0, duration]]:
+        return function(input_video_path, output_path, **arguments)
+    if not ranges:
+        return get_stream_copied_subclip(input_video_path, output_path, 0, duration)
+
+    # Manifest describes the render. Changes are compared as json, files they use are compared by fingerprints
+    def describe(value):
+        if isinstance(value, str) and os.path.isfile(value):
+            return [value, get_file_fingerprint(value)]
+        return value
+
+    manifest_path = f'{output_path}.manifest.json'
+    manifest = {'function': function.__name__, 'source': get_file_fingerprint(input_video_path),
+                'codec': settings.C_CODEC,
+                'settings': json.dumps({k: describe(v) for k, v in arguments.items() if k not in plural_names},
+                                       sort_keys=True, default=str),
+                'segments': []}
+    changes = [json.dumps({k: describe(arguments[k][j]) for k in plural_names}, sort_keys=True, default=str)
+               for j in range(len(windows))]
+    previous_segments = []
+    if os.path.exists(manifest_path) and os.path.exists(output_path):
+        with open(manifest_path) as file:
+            previous = json.load(file)
+        if all(previous.get(k) == manifest[k] for k in ('function', 'source', 'codec', 'settings')) and \
+                previous.get('output') == get_file_fingerprint(output_path):
+            previous_segments = previous['segments']
+
+    with temp_workspace() as tmp_dir:
+        segment_paths = []
+        position = 0
+        for i, (start, end) in enumerate(ranges + [[duration, duration]]):
+            if start > position:
+                segment_paths.append(get_stream_copied_subclip(
+                    input_video_path, os.path.join(tmp_dir, f'segment_{i}_copied.mkv'), position, start))
+            position = end
+            if start == end:
+                continue
+            # Changes of this range, with times relative to its start
+            indexes = [j for j, (s, e) in enumerate(windows) if s < end and e > start]
+            segment = {'start': start, 'end': end, 'changes': sorted(changes[j] for j in indexes)}
+            manifest['segments'].append(segment)
+            if segment in previous_segments:
+                print_info(f'Range {start}-{end} is not changed, copying it from {output_path}.',
+                           to_print=settings.C_TO_PRINT_PACKAGE_INFO)
+                segment_paths.append(get_stream_copied_subclip(
+                    output_path, os.path.join(tmp_dir, f'segment_{i}_reused.mkv'), start, end))
+                continue
+            range_arguments = dict(arguments)
+            for k in plural_names:
+                range_arguments[k] = [arguments[k][j] for j in indexes]
+            range_arguments['start_times'] = [arguments['start_times'][j] - start for j in indexes]
+            subclip_path = get_stream_copied_subclip(input_video_path, os.path.join(tmp_dir, f'range_{i}.mkv'),
+                                                     start, end)
+            segment_paths.append(function(subclip_path, os.path.join(tmp_dir, f'segment_{i}_rendered.mkv'),
+                                          **range_arguments))
+        # The previous output is read above, so the new one is written to a temp file first
+        temp_output_path = get_temp_path_near(output_path)
+        try:
+            concat_without_reencoding(segment_paths, temp_output_path)
+            os.replace(temp_output_path, output_path)
+        finally:
+            if os.path.exists(temp_output_path):
+                os.remove(temp_output_path)
+
+    manifest['output'] = get_file_fingerprint(output_path)
+    temp_manifest_path = get_temp_path_near(manifest_path)
+    save_string_return_output(json.dumps(manifest, indent=4), temp_manifest_path)
+    os.replace(temp_manifest_path, manifest_path)
+    return output_path
+
+
 @process
 def add_rectangle_to_video(input_path: str, output_path: str, start_times: list[float], durations: list[float],
                            x_y_coordinates: list[list], sizes: list[list], rect_colors: list[str],
-                           opacities: list[float]) -> str:
+                           opacities: list[float], only_affected_ranges: bool = False) -> str:
     """
     Adds a rectangle to a video using ffmpeg.
 
@@ -138,28 +538,62 @@ def add_rectangle_to_video(input_path: str, output_path: str, start_times: list[
         sizes (list[list]): A list of sizes [w,h] for each rectangle. Can be passed as built-in ffmpeg thing like ['iw/2', -1]  or as [int, int]
         rect_colors (list[str]): A list of colors for each rectangle. Can be passed as built-in ffmpeg color name (black, red etc.) or as hex string like 'FFFFFF'.
         opacities (list[float]): A list of opacities for each rectangle.
+        only_affected_ranges (bool, optional): Whether to re-encode only the keyframe-aligned ranges around the
+            changes and stream-copy the rest. Much faster for short changes in long videos, but the source should be
+            encoded with the same codec and parameters as C_CODEC_SETTINGS produce, so the parts can be joined.
 
     Returns:
         str: The path to the output video file.
     """
+    if only_affected_ranges:
+        return render_only_affected_ranges(add_rectangle_to_video, locals())
     # Make lists equal
     start_times, durations, x_y_coordinates, sizes, rect_colors, opacities = make_lists_equal(
         start_times=start_times, durations=durations, x_y_coordinates=x_y_coordinates, sizes=sizes, colors=rect_colors,
         opacities=opacities)
 
-    # Constructing filter str
-    filter_str = ''
-    for i in range(len(start_times)):
-        filter_str += '' if i == 0 else f'[box{i}]'
-        filter_str += f'drawbox=enable=\'between(t,{start_times[i]},{start_times[i] + durations[i]})\':x={x_y_coordinates[i][0]}' \
-                      f':y={x_y_coordinates[i][1]}:w={sizes[i][0]}:h={sizes[i][1]}:color={rect_colors[i]}@{opacities[i]}:t=fill,' \
-                      f'format=yuva420p[box{i + 1}];'
+    # Constructing filter graph
+    # The video is split into time buckets, and each bucket gets only the rectangles active in it.
+    # So a frame runs only the drawboxes around its time, not all of them. The pixel format is converted once.
+    duration = get_video_info(input_path)['duration']
+    intervals = [[start_times[i], start_times[i] + durations[i]] for i in range(len(start_times))]
+    buckets = get_time_buckets(intervals, duration, settings.C_MAX_TIME_BUCKETS)
+    graph = FilterGraph()
+    video = graph.add_chain([f'{graph.add_input(input_path)}:v'], [Filter('format', 'yuva420p')], prefix='v')
+    if len(buckets) > 1:
+        bucket_inputs = graph.add_chain([video], [Filter('split', len(buckets))], len(buckets), prefix='split')
+    else:
+        bucket_inputs = [video]
+    bucket_outputs = []
+    for j, (bucket_start, bucket_end, active) in enumerate(buckets):
+        filters = []
+        if len(buckets) > 1:
+            trim_kwargs = {}
+            if j > 0:
+                trim_kwargs['start'] = bucket_start
+            if j < len(buckets) - 1:
+                trim_kwargs['end'] = bucket_end
+            # Timestamps of each bucket start from 0 for concat, so enable times are relative to the bucket
+            filters += [Filter('trim', **trim_kwargs), Filter('setpts', 'PTS-STARTPTS')]
+        offset = bucket_start if len(buckets) > 1 else 0
+        for i in active:
+            start, end = intervals[i]
+            # A rectangle covering the whole bucket needs no enable expression
+            enable = None if start <= bucket_start and end >= bucket_end else [start - offset, end - offset]
+            filters.append(Filter('drawbox', enable=enable,
+                                  x=x_y_coordinates[i][0], y=x_y_coordinates[i][1], w=sizes[i][0], h=sizes[i][1],
+                                  color=f'{rect_colors[i]}@{opacities[i]}', t='fill'))
+        bucket_outputs.append(graph.add_chain([bucket_inputs[j]], filters or ['null'], prefix='bucket'))
+    if len(buckets) > 1:
+        video = graph.add_chain(bucket_outputs, [Filter('concat', n=len(buckets), v=1, a=0)], prefix='v')
+    else:
+        video = bucket_outputs[0]
+    graph.add_output(video)
+    graph.add_output('0:a?')
+    graph.optimize(duration)
     # Run
-    cmd = f'ffmpeg -y -i "{input_path}" -movflags +faststart ' \
-          f'-filter_complex "{filter_str}" -map [box{len(start_times)}] ' \
-          f'{C_CODEC_SETTINGS[C_CODEC]} ' \
-          f'-c:a copy "{output_path}"'
-    run_command(cmd, filter_str)
+    cmd = f'ffmpeg -y {graph.get_inputs_str()} {graph.get_maps_str()} -c:a copy {get_output_str(output_path)}'
+    run_command(cmd, graph)
     return output_path
 
 
@@ -167,7 +601,7 @@ def add_rectangle_to_video(input_path: str, output_path: str, start_times: list[
 def add_text_to_video(input_video_path: str, output_path: str, texts: list[str], fonts_paths: list[str],
                       font_sizes: list[int], font_colors: list[str], start_times: list[float], durations: list[float],
                       x_y_coordinates: list[list], fade_duration: float = 0, border_color='black',
-                      border_width: int = 5):
+                      border_width: int = 5, backend: str = 'drawtext', only_affected_ranges: bool = False):
     """
     Adds text to a video and saves it.
 
@@ -184,38 +618,68 @@ def add_text_to_video(input_video_path: str, output_path: str, texts: list[str],
         fade_duration (float, optional): Duration of the fade effect.
         border_color (str, optional): Color of the border. Can be passed as built-in ffmpeg color name (black, red etc.) or as hex string like 'FFFFFF'.
         border_width (int, optional): Width of the border.
+        backend (str, optional): 'drawtext' renders each text with its own drawtext filter. 'ass' compiles all texts
+            into one ASS script burned in by one ass filter, which keeps the speed flat for thousands of captions,
+            but needs numeric x_y_coordinates and an ffmpeg built with libass, and renders a bit differently. 'auto'
+            uses 'ass' from C_ASS_TEXTS_THRESHOLD texts when it is possible.
+        only_affected_ranges (bool, optional): Whether to re-encode only the keyframe-aligned ranges around the
+            changes and stream-copy the rest. Much faster for short changes in long videos, but the source should be
+            encoded with the same codec and parameters as C_CODEC_SETTINGS produce, so the parts can be joined.
 
     Returns:
         str: Path to the new video (output_path).
     """
+    if only_affected_ranges:
+        return render_only_affected_ranges(add_text_to_video, locals())
     # Making dict lists equal
     texts, fonts_paths, font_sizes, font_colors, x_y_coordinates, durations, start_times = \
         make_lists_equal(texts=texts, fonts=fonts_paths, font_sizes=font_sizes,
                          font_colors=font_colors, x_y_coordinates=x_y_coordinates,
                          durations=durations, start_times=start_times)
-    # Setting files and filter strings
-    filter_str = ''
-    for i in range(len(texts)):
-        fade_str = ''
-        if fade_duration:
-            fade_duration_to_use = min(fade_duration, durations[i] / 2)
-            fade_str = f":alpha='if(lt(t,{start_times[i]}),0,if(lt(t,{start_times[i] + fade_duration_to_use}),(t-{start_times[i]})/{fade_duration_to_use},if(lt(t,{start_times[i] + fade_duration_to_use}),1,if(lt(t,{start_times[i] + durations[i]}),({fade_duration_to_use}-(t-{start_times[i] - fade_duration_to_use + durations[i]}))/{fade_duration_to_use},0))))'"
-        border_str = ''
-        if border_color:
-            border_str += f':bordercolor={border_color}'
-        if border_width:
-            border_str += f':borderw={border_width}'
-        filter_str += f'[0:v]' if i == 0 else f'[v{i}]'
-        filter_str += f"drawtext=fontfile='{fonts_paths[i]}':text='{texts[i]}':fontsize={font_sizes[i]}:" \
-                      f"fontcolor={font_colors[i]}{fade_str}:x={x_y_coordinates[i][0]}:y={x_y_coordinates[i][1]}{border_str}"
-        if start_times is not None and durations is not None:
-            filter_str += f":enable='between(t,{start_times[i]},{start_times[i] + durations[i]})'"
-        filter_str += f'[v{i + 1}]'
-        filter_str += ';' if i != len(texts) - 1 else ''
-    # Run
-    cmd = f'ffmpeg -y -i "{input_video_path}" -movflags +faststart ' \
-          f'-filter_complex "{filter_str}" -map [v{len(texts)}] -map 0:a {C_CODEC_SETTINGS[C_CODEC]} {output_path}'
-    run_command(cmd, filter_str)
+    video_info = get_video_info(input_video_path)
+    # Choosing backend
+    if backend == 'auto':
+        backend = 'ass' if len(texts) >= settings.C_ASS_TEXTS_THRESHOLD and \
+                           is_ass_compatible(x_y_coordinates, font_colors, border_color) else 'drawtext'
+    elif backend == 'ass' and not is_ass_compatible(x_y_coordinates, font_colors, border_color):
+        raise ValueError('The ass backend needs numeric x_y_coordinates and colors known by subtitles.FFMPEG_COLORS.')
+    print_info(f'Rendering {len(texts)} texts with {backend}.', to_print=settings.C_TO_PRINT_PACKAGE_INFO)
+
+    # Constructing filter graph
+    graph = FilterGraph()
+    video = f'{graph.add_input(input_video_path)}:v'
+    with temp_workspace() as workspace:
+        if backend == 'ass':
+            # libass renders only the texts shown at the current frame, so speed does not depend on their number
+            script_path, fonts_dir = save_ass_script(
+                workspace, video_info['width'], video_info['height'], texts, fonts_paths, font_sizes, font_colors,
+                start_times, durations, x_y_coordinates, fade_duration, border_color, border_width)
+            video = graph.add_chain([video], [Filter('ass', filename=escape_filter_value(script_path),
+                                                     fontsdir=escape_filter_value(fonts_dir))], prefix='v')
+        else:
+            for i in range(len(texts)):
+                options = {}
+                if fade_duration:
+                    fade_duration_to_use = min(fade_duration, durations[i] / 2)
+                    options['alpha'] = f"'if(lt(t,{start_times[i]}),0,if(lt(t,{start_times[i] + fade_duration_to_use}),(t-{start_times[i]})/{fade_duration_to_use},if(lt(t,{start_times[i] + fade_duration_to_use}),1,if(lt(t,{start_times[i] + durations[i]}),({fade_duration_to_use}-(t-{start_times[i] - fade_duration_to_use + durations[i]}))/{fade_duration_to_use},0))))'"
+                options['x'] = x_y_coordinates[i][0]
+                options['y'] = x_y_coordinates[i][1]
+                if border_color:
+                    options['bordercolor'] = border_color
+                if border_width:
+                    options['borderw'] = border_width
+                enable = None
+                if start_times is not None and durations is not None:
+                    enable = [start_times[i], start_times[i] + durations[i]]
+                video = graph.add_chain([video], [
+                    Filter('drawtext', enable=enable, fontfile=f"'{fonts_paths[i]}'", text=f"'{texts[i]}'",
+                           fontsize=font_sizes[i], fontcolor=font_colors[i], **options)], prefix='v')
+        graph.add_output(video)
+        graph.add_output('0:a')
+        graph.optimize(video_info['duration'])
+        # Run
+        cmd = f'ffmpeg -y {graph.get_inputs_str()} {graph.get_maps_str()} -c:a copy {get_output_str(output_path)}'
+        run_command(cmd, graph)
 
     return output_path
 
@@ -223,7 +687,8 @@ def add_text_to_video(input_video_path: str, output_path: str, texts: list[str],
 @process
 def add_image_to_video(input_video_path: str, output_path: str, input_image_paths: list[str],
                        x_y_coordinates: list[list], start_times: list[float], durations: list[float],
-                       img_goal_sizes: list, opacities: list = None, fade_duration: float = 0) -> str:
+                       img_goal_sizes: list, opacities: list = None, fade_duration: float = 0,
+                       only_affected_ranges: bool = False) -> str:
     """
     Adds images to a video at specified times and positions.
 
@@ -237,60 +702,64 @@ def add_image_to_video(input_video_path: str, output_path: str, input_image_path
         img_goal_sizes (list): List of [w, h] specifying the width and height of each image after resizing. Can be passed as built-in ffmpeg thing like ['iw/2', -1]
         opacities (list, optional): List of opacities for each image.
         fade_duration (float, optional): Duration of fade in and fade out for each image in seconds.
+        only_affected_ranges (bool, optional): Whether to re-encode only the keyframe-aligned ranges around the
+            changes and stream-copy the rest. Much faster for short changes in long videos, but the source should be
+            encoded with the same codec and parameters as C_CODEC_SETTINGS produce, so the parts can be joined.
 
     Returns:
         str: Path to the output video file.
     """
+    if only_affected_ranges:
+        return render_only_affected_ranges(add_image_to_video, locals())
     # Make lists equal
     input_image_paths, x_y_coordinates, start_times, durations, img_goal_sizes, opacities = \
         make_lists_equal(input_image_paths=input_image_paths, x_y_coordinates=x_y_coordinates,
                          start_times=start_times, durations=durations,
                          img_goal_sizes=img_goal_sizes, opacities=opacities)
 
-    # Constructing input str and complex filter
-    files_str = f'-i "{input_video_path}"'
-    filter_str_0 = ''
-    filter_str_1 = ''
-    for i in range(len(input_image_paths)):
-        # Resizing img
-        input_image_paths[i] = get_resized_image(input_image_paths[i], f'temp_image__{i}.png',
-                                                 [img_goal_sizes[i][0], img_goal_sizes[i][1]])
-        files_str += f' -loop 1 -i "{input_image_paths[i]}"'
-        if_img_str = ''
-        if fade_duration or (opacities and opacities[i] and opacities[i] != 1):
-            filter_str_0 += f'[{i + 1}]'
-            if_img_str = 'img'
-        if fade_duration:
-            fade_duration = min(fade_duration, durations[i] / 2)
-            filter_str_0 += f'fade=t=in:st={start_times[i]}:d={fade_duration}:alpha=1,' \
-                            f'fade=t=out:st={start_times[i] + durations[i] - fade_duration}:d={fade_duration}:alpha=1'
-            filter_str_0 += ',' if opacities else ''
-        if opacities and opacities[i] and opacities[i] != 1:
-            filter_str_0 += f'format=pix_fmts=rgba,colorchannelmixer=aa={opacities[i]}'
-        if fade_duration or (opacities and opacities[i] and opacities[i] != 1):
-            filter_str_0 += f'[img{i + 1}];'
-
-        filter_str_1 += f"[0]" if i == 0 else f"[bg{i - 1}]"
-        filter_str_1 += f"[{if_img_str}{i + 1}]overlay=x={x_y_coordinates[i][0]}:y={x_y_coordinates[i][1]}:" \
-                        f"enable='between(t,{start_times[i]},{start_times[i] + durations[i]})':shortest=1[bg{i}]"
-        filter_str_1 += ';' if i != len(input_image_paths) - 1 else ''
-
-    # Run command
-    cmd = (f'ffmpeg -y {files_str} '
-           f'-filter_complex "{filter_str_0 + filter_str_1}" '
-           f'-map [bg{len(input_image_paths) - 1}]  -map 0 -map 0:a  -c:a copy {C_CODEC_SETTINGS[C_CODEC]} '
-           f'-movflags +faststart "{output_path}" ')
-    run_command(cmd, filter_str_0 + filter_str_1)
-
-    # Remove temporary image file
-    [os.remove(i) for i in os.listdir() if i.startswith('temp_image') and i.endswith('.png')]
+    # Resized images are kept in a unique temp folder, removed after rendering
+    with temp_workspace() as workspace:
+        # Constructing filter graph
+        graph = FilterGraph()
+        video = f'{graph.add_input(input_video_path)}:v'
+        resized_images = {}
+        for i in range(len(input_image_paths)):
+            # Resizing img. The same image of the same size is resized and opened only once
+            image_key = (input_image_paths[i], str(img_goal_sizes[i][0]), str(img_goal_sizes[i][1]))
+            if image_key not in resized_images:
+                resized_images[image_key] = get_resized_image(
+                    input_image_paths[i], os.path.join(workspace, f'temp_image__{i}.png'),
+                    [img_goal_sizes[i][0], img_goal_sizes[i][1]])
+            image = f'{graph.add_input(resized_images[image_key], "-loop 1")}'
+            filters = []
+            if fade_duration:
+                fade_duration = min(fade_duration, durations[i] / 2)
+                filters += [Filter('fade', t='in', st=start_times[i], d=fade_duration, alpha=1),
+                            Filter('fade', t='out', st=start_times[i] + durations[i] - fade_duration,
+                                   d=fade_duration, alpha=1)]
+            if opacities and opacities[i] and opacities[i] != 1:
+                filters += [Filter('format', pix_fmts='rgba'), Filter('colorchannelmixer', aa=opacities[i])]
+            if filters:
+                image = graph.add_chain([image], filters, prefix='img')
+
+            video = graph.add_chain([video, image], [
+                Filter('overlay', enable=[start_times[i], start_times[i] + durations[i]],
+                       x=x_y_coordinates[i][0], y=x_y_coordinates[i][1], shortest=1)], prefix='bg')
+        graph.add_output(video)
+        graph.add_output('0:a')
+        graph.optimize(get_video_info(input_video_path)['duration'])
+
+        # Run command
+        cmd = f'ffmpeg -y {graph.get_inputs_str()} {graph.get_maps_str()} -c:a copy {get_output_str(output_path)}'
+        run_command(cmd, graph)
 
     return output_path
 
 
 @process
 def add_audio_to_video(input_video_path: str, output_path: str, input_audio_paths: list[str],
-                       sound_volumes: list[float], start_times: list[float], durations: list[float] = None) -> str:
+                       sound_volumes: list[float], start_times: list[float], durations: list[float] = None,
+                       premix: bool = False, normalize: bool = False) -> str:
     """
     Adds audio tracks to a video using ffmpeg.
 
@@ -299,8 +768,16 @@ def add_audio_to_video(input_video_path: str, output_path: str, input_audio_path
         output_path (str): The path to the output video file.
         input_audio_paths (list[str]): A list of paths to the input audio files.
         sound_volumes (list[float]): A list of sound volumes for each audio track.
-        start_times (list[float]): A list of start times for each audio track in seconds.
-        durations (list[float], optional): A list of durations for each audio track.
+        start_times (list[float]): A list of start times for each audio track in seconds, not negative.
+        durations (list[float], optional): A list of durations for each audio track. Without premix a track is cut
+            at this time counted from the start of the video. With premix it is how many seconds of the track play
+            from its start time. None or 0 plays all of it.
+        premix (bool, optional): Whether to mix the tracks with NumPy and stream the mix to ffmpeg as one input.
+            Each distinct file is decoded once, so it is much faster for hundreds of sound effects. Volumes are added
+            as they are, without amix normalization.
+        normalize (bool, optional): Whether to bring the audio of the video and each track to C_LOUDNESS_TARGET
+            before mixing, so sound_volumes are relative to the target. Tracks are added without amix normalization.
+            Sources are measured once (see get_loudness_measurement), the render itself is one pass.
 
     Returns:
         str: The path to the output video file.
@@ -308,23 +785,53 @@ def add_audio_to_video(input_video_path: str, output_path: str, input_audio_path
     # Make lists equal
     input_audio_paths, sound_volumes, start_times, durations = make_lists_equal(
         input_audio_paths=input_audio_paths, sound_volumes=sound_volumes, start_times=start_times, durations=durations)
-
-    # Setting files and filter strings
-    filter_str_0 = ''
-    filter_str_1 = ''
-    files_str = f'-i "{input_video_path}"'
+    if any(start_time < 0 for start_time in start_times):
+        raise ValueError(f'start_times can not be negative: {start_times}')
+
+    # The audio of the video, brought to the loudness target if needed
+    graph = FilterGraph()
+    graph.add_input(input_video_path)
+    loudnorm_filters = get_loudnorm_filters(input_video_path) if normalize else []
+    video_audio = graph.add_chain(['0:a'], loudnorm_filters, prefix='norm') if loudnorm_filters else '0:a'
+    graph.add_output('0:v')
+
+    if premix:
+        audio_info = get_audio_info(input_video_path)
+        sr, channels = audio_info['sample_rate'], audio_info['channels']
+        if normalize:
+            # Linear loudnorm of a track is just a gain, so it is applied in the premix
+            sound_volumes = [volume * get_loudness_gain(path) for volume, path in zip(sound_volumes, input_audio_paths)]
+        mix = graph.add_input('pipe:0', f'-f f32le -ar {sr} -ac {channels}')
+        graph.add_output(graph.add_chain([video_audio, f'{mix}:a'], [
+            Filter('amix', inputs=2, duration='longest', normalize=0)], prefix='audio_out'))
+        graph.optimize()
+        cmd = f'ffmpeg {graph.get_inputs_str()} {get_movflags_str(output_path)}' \
+              f'{graph.get_maps_str()} -c:v copy -y "{output_path}"'
+        run_command(cmd, graph, mix_audio_blocks(input_audio_paths, sound_volumes, start_times, durations,
+                                                 sr, channels))
+        return output_path
+
+    # Constructing filter graph. Each placement reads its own input, a shared one would keep the decoded audio in
+    # memory between the placements. premix decodes each distinct file once.
+    audios = []
     for i in range(len(input_audio_paths)):
-        files_str += f' -i "{input_audio_paths[i]}"'
-        filter_str_0 += f'[{i + 1}:a]volume={sound_volumes[i]},adelay={start_times[i] * 1000}|{start_times[i] * 1000}'
-        filter_str_0 += f', atrim=start=0:duration={durations[i]}' if durations and durations[i] else ''
-        filter_str_0 += f'[a{i + 1}];'
-        filter_str_1 += f'[a{i + 1}]'
-    filter_str_1 += f'[0:a]amix=inputs={len(input_audio_paths) + 1}:duration=longest[audio_out]'
+        filters = get_loudnorm_filters(input_audio_paths[i]) if normalize else []
+        filters += [Filter('volume', sound_volumes[i]),
+                    Filter('adelay', f'{start_times[i] * 1000}|{start_times[i] * 1000}')]
+        if durations and durations[i]:
+            filters.append(Filter('atrim', start=0, duration=durations[i]))
+        audios.append(graph.add_chain([f'{graph.add_input(input_audio_paths[i], reuse=False)}:a'], filters,
+                                      prefix='a'))
+    # Normalized tracks are already at the target, amix should not scale them down
+    amix_options = {'normalize': 0} if normalize else {}
+    graph.add_output(graph.add_chain(audios + [video_audio], [
+        Filter('amix', inputs=len(input_audio_paths) + 1, duration='longest', **amix_options)], prefix='audio_out'))
+    graph.optimize()
 
     # Run command
-    cmd = f'ffmpeg {files_str} -movflags +faststart -filter_complex "{filter_str_0 + filter_str_1}" ' \
-          f'-map 0:v -map "[audio_out]" -c:v copy -y "{output_path}"'
-    run_command(cmd, filter_str_0 + filter_str_1)
+    cmd = f'ffmpeg {graph.get_inputs_str()} {get_movflags_str(output_path)}' \
+          f'{graph.get_maps_str()} -c:v copy -y "{output_path}"'
+    run_command(cmd, graph)
 
     return output_path
 
@@ -350,12 +857,16 @@ def add_colored_space_around_video(input_video_path: str, output_path: str, goal
     codec_to_use = get_codec_meeting_constraints(goal_size)
     scale_w = (goal_size[0] if goal_size[0] < goal_size[1] else -1)
     scale_h = (goal_size[1] if goal_size[1] < goal_size[0] else -1)
-    resize_str = f'scale={scale_w}:{scale_h},' if to_resize_video else ''
-    filter_str = f'[0:v]{resize_str}pad=width={goal_size[0]}:height={goal_size[1]}:x={x_y_coordinate[0]}:y={x_y_coordinate[1]}:color={color}[v]'
-    cmd = f'ffmpeg -y -i  "{input_video_path}" -movflags +faststart ' \
-          f'-filter_complex "{filter_str}" -map "[v]" -map 0:a {C_CODEC_SETTINGS[codec_to_use]} "{output_path}"'
-
-    run_command(cmd, filter_str)
+    graph = FilterGraph()
+    filters = [Filter('scale', scale_w, scale_h)] if to_resize_video else []
+    filters.append(Filter('pad', width=goal_size[0], height=goal_size[1], x=x_y_coordinate[0], y=x_y_coordinate[1],
+                          color=color))
+    graph.add_output(graph.add_chain([f'{graph.add_input(input_video_path)}:v'], filters, prefix='v'))
+    graph.add_output('0:a')
+    graph.optimize()
+    cmd = f'ffmpeg -y {graph.get_inputs_str()} {graph.get_maps_str()} {get_output_str(output_path, codec_to_use)}'
+
+    run_command(cmd, graph)
     return output_path
 
 
@@ -381,12 +892,19 @@ def add_blurred_space_around_video(input_video_path: str, output_path: str, goal
     scale_copy_w = (goal_size[0] if goal_size[0] > goal_size[1] else -1)
     scale_copy_h = (goal_size[1] if goal_size[1] > goal_size[0] else -1)
 
-    resize_str = f'[original]scale={scale_w}:{scale_h}[original];' if to_resize_video else ''
-    filter_str = f'[0:v]split[original][copy];{resize_str}' \
-                 f'[copy]scale={scale_copy_w}:{scale_copy_h},crop={goal_size[0]}:{goal_size[1]},gblur=sigma={sigma}[blurred];' \
-                 f'[blurred][original]overlay=(main_w-overlay_w)/2:(main_h-overlay_h)/2'
-    command = f'ffmpeg -y -i "{input_video_path}" -movflags +faststart -filter_complex "{filter_str}" {C_CODEC_SETTINGS[codec_to_use]} "{output_path}"'
-    run_command(command, filter_str)
+    graph = FilterGraph()
+    original, copy = graph.add_chain([f'{graph.add_input(input_video_path)}:v'], [Filter('split')], outputs=2)
+    if to_resize_video:
+        original = graph.add_chain([original], [Filter('scale', scale_w, scale_h)], prefix='original')
+    blurred = graph.add_chain([copy], [Filter('scale', scale_copy_w, scale_copy_h),
+                                       Filter('crop', goal_size[0], goal_size[1]),
+                                       Filter('gblur', sigma=sigma)], prefix='blurred')
+    graph.add_output(graph.add_chain([blurred, original],
+                                     [Filter('overlay', '(main_w-overlay_w)/2', '(main_h-overlay_h)/2')]))
+    graph.add_output('0:a?')
+    graph.optimize()
+    command = f'ffmpeg -y {graph.get_inputs_str()} {graph.get_maps_str()} {get_output_str(output_path, codec_to_use)}'
+    run_command(command, graph)
     return output_path
 
 
@@ -394,7 +912,8 @@ def add_blurred_space_around_video(input_video_path: str, output_path: str, goal
 def add_video_to_video(input_video_path: str, output_path: str, video_to_overlay_paths: list[str],
                        goal_sizes: list[list], x_y_coordinates: list[list],
                        start_times: list[float], durations: list[float],
-                       opacities: list[float] = None, fade_duration: float = 0) -> str:
+                       opacities: list[float] = None, fade_duration: float = 0,
+                       only_affected_ranges: bool = False) -> str:
     """
     Adds a video overlay to a video using ffmpeg.
 
@@ -404,14 +923,21 @@ def add_video_to_video(input_video_path: str, output_path: str, video_to_overlay
         video_to_overlay_paths (list[str]): A list of paths to the video files to overlay.
         goal_sizes (list[list]): A list of sizes [w,h] for each overlay video. Can be passed as built-in ffmpeg thing like ['iw/2', -1] or as [int, int]
         x_y_coordinates (list[list]): A list of [x,y] coordinates for each overlay video. Can be passed as built-in ffmpeg thing like ['iw/2', -1] or as [int, int]
-        start_times (list[float]): A list of start times for each overlay video in seconds.
-        durations (list[float]): A list of durations for each overlay video.
+        start_times (list[float]): A list of start times for each overlay video in seconds. An overlay video plays
+            from its own beginning at its start time.
+        durations (list[float]): A list of durations for each overlay video. It is shown for its duration or until
+            it ends, whichever is first.
         opacities (list[float], optional): A list of opacities for each overlay video.
         fade_duration (float, optional): The duration of the fade in/out effect for each overlay video.
+        only_affected_ranges (bool, optional): Whether to re-encode only the keyframe-aligned ranges around the
+            changes and stream-copy the rest. Much faster for short changes in long videos, but the source should be
+            encoded with the same codec and parameters as C_CODEC_SETTINGS produce, so the parts can be joined.
 
     Returns:
         str: The path to the output video file.
     """
+    if only_affected_ranges:
+        return render_only_affected_ranges(add_video_to_video, locals())
     # Make lists equal
     video_to_overlay_paths, goal_sizes, x_y_coordinates, start_times, durations, opacities = make_lists_equal(
         video_to_overlay_paths=video_to_overlay_paths, goal_sizes=goal_sizes, x_y_coordinates=x_y_coordinates,
@@ -420,39 +946,43 @@ def add_video_to_video(input_video_path: str, output_path: str, video_to_overlay
     # Get codec to use according to constraints
     codec_to_use = get_codec_meeting_constraints(goal_sizes)
 
-    # Construct input and filter strings
-    filter_str_0 = '[0]format=pix_fmts=rgba[orig];'
-    filter_str_1 = ''
-    input_str = ''
+    # Construct filter graph
+    graph = FilterGraph()
+    video = graph.add_chain([f'{graph.add_input(input_video_path)}:v'], [Filter('format', pix_fmts='rgba')],
+                            prefix='orig')
     for i in range(len(video_to_overlay_paths)):
-        input_str += f'-i "{video_to_overlay_paths[i]}" '
-
-        filter_str_0 += f'[{i + 1}]'
+        # The overlay video starts at its start time
+        filters = [Filter('setpts', f'PTS-STARTPTS+{start_times[i]}/TB')]
         if fade_duration:
             fade_duration = min(fade_duration, durations[i] / 2)
-            filter_str_0 += f'fade=t=in:st={start_times[i]}:d={fade_duration}:alpha=1,fade=t=out:st={start_times[i] + durations[i] - fade_duration}:d={fade_duration}:alpha=1,'
+            filters += [Filter('fade', t='in', st=start_times[i], d=fade_duration, alpha=1),
+                        Filter('fade', t='out', st=start_times[i] + durations[i] - fade_duration, d=fade_duration,
+                               alpha=1)]
         if fade_duration or (opacities and opacities[i] and opacities[i] != 1):
-            filter_str_0 += f'format=pix_fmts=rgba,colorchannelmixer=aa={opacities[i]},'
-        filter_str_0 += f'scale={goal_sizes[i][0]}:{goal_sizes[i][1]}[v{i + 1}];'
-
-        filter_str_1 += f'[orig]' if i == 0 else f'[fin{i}]'
-        filter_str_1 += f'[v{i + 1}]overlay={x_y_coordinates[i][0]}:{x_y_coordinates[i][1]}[fin{i + 1}]'
-        filter_str_1 += ';' if i != len(video_to_overlay_paths) - 1 else ''
+            filters += [Filter('format', pix_fmts='rgba'), Filter('colorchannelmixer', aa=opacities[i])]
+        filters.append(Filter('scale', goal_sizes[i][0], goal_sizes[i][1]))
+        # Each placement reads its own input, a shared one would keep frames in memory between the placements
+        overlay_input = graph.add_input(video_to_overlay_paths[i], reuse=False)
+        overlay = graph.add_chain([f'{overlay_input}:v'], filters, prefix='v')
+
+        video = graph.add_chain([video, overlay], [
+            Filter('overlay', x_y_coordinates[i][0], x_y_coordinates[i][1],
+                   enable=[start_times[i], start_times[i] + durations[i]], eof_action='pass')], prefix='fin')
+    graph.add_output(video)
+    graph.add_output('0:a')
+    graph.optimize(get_video_info(input_video_path)['duration'])
 
     # Run command
-    cmd = f'ffmpeg -y -i "{input_video_path}" {input_str} -movflags +faststart -filter_complex ' \
-          f'"{filter_str_0 + filter_str_1}"' \
-          f' -map [fin{len(video_to_overlay_paths)}] -map 0:a ' \
-          f'{C_CODEC_SETTINGS[codec_to_use]}' \
-          f' -c:a copy "{output_path}"'
-    run_command(cmd, filter_str_0 + filter_str_1)
+    cmd = f'ffmpeg -y {graph.get_inputs_str()} {graph.get_maps_str()} ' \
+          f'-c:a copy {get_output_str(output_path, codec_to_use)}'
+    run_command(cmd, graph)
 
     return output_path
 
 
 @process
 def get_concantenated_videos(input_video_paths: list[str], output_path: str, effects: list[str] = None,
-                             transition_durations: list[float] = None) -> str:
+                             transition_durations: list[float] = None, normalize: bool = False) -> str:
     """
     Concatenates multiple videos together using ffmpeg.
     If effects is False-like, then no transition_duration implemented.
@@ -462,6 +992,8 @@ def get_concantenated_videos(input_video_paths: list[str], output_path: str, eff
         output_path (str): The path to the output video file.
         effects (list[str]): A list of transition effects to use between each video. See https://trac.ffmpeg.org/wiki/Xfade for options.
         transition_durations (list[float]): A list of durations for each transition.
+        normalize (bool, optional): Whether to bring the audio of each video to C_LOUDNESS_TARGET, so the joined
+            videos sound equally loud. Sources are measured once (see get_loudness_measurement).
 
     Returns:
         str: The path to the output video file.
@@ -490,30 +1022,37 @@ def get_concantenated_videos(input_video_paths: list[str], output_path: str, eff
             offset += offsets[i - 1] if i > 0 else 0
             offsets.append(offset)
 
-    # Construct input and filter str
-    input_str = ''
-    filter_vid_str = ''
-    filter_aud_str = ''
-    for i in range(len(input_video_paths)):
-        input_str += f'-i "{input_video_paths[i]}" '
-        if not effects:
-            filter_vid_str += f'[{i}:v][{i}:a]'
+    # Construct filter graph. Inputs are read one after another, so each path is opened separately
+    graph = FilterGraph()
+    indexes = [graph.add_input(path, reuse=False) for path in input_video_paths]
+    audios = [f'{index}:a' for index in indexes]
+    if normalize:
+        for i, path in enumerate(input_video_paths):
+            loudnorm_filters = get_loudnorm_filters(path)
+            if loudnorm_filters:
+                audios[i] = graph.add_chain([audios[i]], loudnorm_filters, prefix='norm')
     if effects:
+        video, audio = f'{indexes[0]}:v', audios[0]
         for i in range(len(input_video_paths) - 1):
-            filter_vid_str += f'[0]' if i == 0 else f'[vv{i}]'
-            filter_aud_str += f'[0:a]' if i == 0 else f'[afade{i}]'
-            filter_vid_str += f'[{i + 1}:v]xfade=transition={effects[i]}:duration=1:offset={offsets[i]},format=yuv420p[vv{i + 1}];'
-            filter_aud_str += f'[{i + 1}:a]acrossfade=d={transition_durations[i]}[afade{i + 1}];'
-
-    filter_vid_str += f'concat=n={len(input_video_paths)}:v=1:a=1[outv]' if not effects else ''
-    map_str = f'-map "[afade{len(input_video_paths) - 1}]" -map "[vv{len(input_video_paths) - 1}]"' if effects else '-map [outv]'
+            video = graph.add_chain([video, f'{indexes[i + 1]}:v'], [
+                Filter('xfade', transition=effects[i], duration=1, offset=offsets[i]),
+                Filter('format', 'yuv420p')], prefix='vv')
+            audio = graph.add_chain([audio, audios[i + 1]], [
+                Filter('acrossfade', d=transition_durations[i])], prefix='afade')
+        graph.add_output(audio)
+        graph.add_output(video)
+    else:
+        pads = [pad for index, audio_pad in zip(indexes, audios) for pad in (f'{index}:v', audio_pad)]
+        video, audio = graph.add_chain(pads, [Filter('concat', n=len(input_video_paths), v=1, a=1)], outputs=2,
+                                       prefix='out')
+        graph.add_output(video)
+        graph.add_output(audio)
+    graph.optimize()
 
     # Run command
-    cmd = f'ffmpeg -y {input_str}-movflags +faststart ' \
-          f'-filter_complex "{filter_vid_str + filter_aud_str}" ' \
-          f'{map_str} {C_CODEC_SETTINGS[codec_to_use]} ' \
-          f'-fps_mode vfr "{output_path}"'
-    run_command(cmd, filter_vid_str + filter_aud_str)
+    cmd = f'ffmpeg -y {graph.get_inputs_str()} {graph.get_maps_str()} ' \
+          f'-fps_mode vfr {get_output_str(output_path, codec_to_use)}'
+    run_command(cmd, graph)
     return output_path
 
 
@@ -548,7 +1087,7 @@ def get_audio_info(input_audio_file: str) -> dict:
         input_audio_file (str): The path to the input audio file.
 
     Returns:
-        dict: A dictionary containing the duration, bitrate, and sample rate of the audio.
+        dict: A dictionary containing the duration, bitrate, sample rate and number of channels of the audio.
     """
     # Run ffprobe command to get information about the input audio file
     cmd = f'ffprobe -v error -print_format json -show_format -show_streams "{input_audio_file}"'
@@ -557,25 +1096,27 @@ def get_audio_info(input_audio_file: str) -> dict:
     ffprobe_data = json.loads(ffprobe_output)
     # Get the audio stream information
     audio_stream = next((stream for stream in ffprobe_data['streams'] if stream['codec_type'] == 'audio'), None)
-    # Get the audio duration in seconds
-    duration = float(audio_stream['duration'])
+    # Get the audio duration in seconds. Some containers (mkv) keep it only in the format
+    duration = float(audio_stream.get('duration', ffprobe_data['format']['duration']))
     # Get the audio bitrate in kbps
-    bitrate = int(audio_stream['bit_rate']) // 1000
+    bitrate = int(audio_stream.get('bit_rate', ffprobe_data['format'].get('bit_rate', 0))) // 1000
     # Get the audio sample rate in Hz
     sample_rate = int(audio_stream['sample_rate'])
-    return {'duration': duration, 'bitrate': bitrate, 'sample_rate': sample_rate}
+    return {'duration': duration, 'bitrate': bitrate, 'sample_rate': sample_rate,
+            'channels': int(audio_stream['channels']), 'codec': audio_stream['codec_name']}
 
 
 @process
 def get_video_info(input_video_path: str) -> dict:
     """
-    Get the duration, width, height, and FPS of a video file using ffprobe.
+    Get the duration, width, height, FPS and rotation of a video file using ffprobe.
 
     Args:
         input_video_path (str): The path to the input video file.
 
     Returns:
-        dict: A dictionary containing the duration, width, height, and FPS of the video.
+        dict: A dictionary containing the duration, width, height, FPS and rotation of the video. Rotation is the
+            counterclockwise angle of its display matrix in degrees, players rotate the video by it.
     """
     # Get the metadata of the video
     cmd = f'ffprobe -v error -print_format json -show_format -show_streams "{input_video_path}"'
@@ -584,13 +1125,34 @@ def get_video_info(input_video_path: str) -> dict:
     # Get the duration of the video
     duration = float(metadata['format']['duration'])
     # Get the size and FPS of the video
-    width, height, fps = None, None, None
+    width, height, fps, rotation = None, None, None, 0
     for stream in metadata['streams']:
         if stream['codec_type'] == 'video':
             width = stream['width']
             height = stream['height']
             fps = eval(stream['r_frame_rate'])
-    return {'duration': duration, 'width': width, 'height': height, 'fps': fps}
+            rotation = next((float(data['rotation']) for data in stream.get('side_data_list', [])
+                             if 'rotation' in data), 0)
+    return {'duration': duration, 'width': width, 'height': height, 'fps': fps, 'rotation': rotation}
+
+
+@process
+def get_keyframe_times(input_video_path: str) -> list[float]:
+    """
+    Get the times of the keyframes of a video file using ffprobe. Only packets are read, nothing is decoded.
+
+    Args:
+        input_video_path (str): The path to the input video file.
+
+    Returns:
+        list[float]: Sorted list of keyframe times in seconds.
+    """
+    cmd = f'ffprobe -v error -select_streams v:0 -show_entries packet=pts_time,flags -print_format json ' \
+          f'"{input_video_path}"'
+    result = run_command(cmd)
+    packets = json.loads(result)['packets']
+    return sorted(float(packet['pts_time']) for packet in packets
+                  if 'K' in packet.get('flags', '') and packet.get('pts_time') not in (None, 'N/A'))
 
 
 @process
@@ -608,11 +1170,15 @@ def get_cropped_video(input_video_path: str, output_path: str, size: list, x_y_c
         str: The path to the cropped video file.
     """
     codec_to_use = get_codec_meeting_constraints(size)
-    filter_str = f"crop={size[0]}:{size[1]}:{x_y_coordinate[0]}:{x_y_coordinate[1]}"
+    graph = FilterGraph()
+    graph.add_output(graph.add_chain([f'{graph.add_input(input_video_path)}:v'], [
+        Filter('crop', size[0], size[1], x_y_coordinate[0], x_y_coordinate[1])]))
+    graph.add_output('0:a?')
+    graph.optimize()
     # Crop the video
-    cmd = f'ffmpeg -y -i "{input_video_path}" -movflags use_metadata_tags -movflags +faststart -filter_complex "{filter_str}" ' \
-          f' -preset slow {C_CODEC_SETTINGS[codec_to_use]} -c:a copy "{output_path}" '
-    run_command(cmd, filter_str)
+    cmd = f'ffmpeg -y {graph.get_inputs_str()} {graph.get_maps_str()} -c:a copy ' \
+          f'{get_output_str(output_path, codec_to_use, "-movflags use_metadata_tags -preset slow")}'
+    run_command(cmd, graph)
     return output_path
 
 
@@ -630,14 +1196,57 @@ def get_resized_video(input_video_path: str, output_path: str, size: list) -> st
         str: The path to the resized video file.
     """
     codec_to_use = get_codec_meeting_constraints(size)
-    filter_str = f"[0:v]scale={size[0]}:{size[1]}[fin]"
+    graph = FilterGraph()
+    graph.add_output(graph.add_chain([f'{graph.add_input(input_video_path)}:v'], [Filter('scale', size[0], size[1])],
+                                     prefix='fin'))
+    graph.add_output('0:a')
+    graph.optimize()
     # Run command
-    cmd = f'ffmpeg -y -i "{input_video_path}"  -movflags +faststart ' \
-          f'-filter_complex "{filter_str}" -map [fin] -map 0:a -c:a copy {C_CODEC_SETTINGS[codec_to_use]} "{output_path}"'
-    run_command(cmd, filter_str)
+    cmd = f'ffmpeg -y {graph.get_inputs_str()} {graph.get_maps_str()} ' \
+          f'-c:a copy {get_output_str(output_path, codec_to_use)}'
+    run_command(cmd, graph)
     return output_path
 
 
+@process
+def get_resized_videos(input_video_path: str, output_paths: list[str], sizes: list[list]) -> list[str]:
+    """
+    Resize a video file to several sizes at once, like renditions of an upload. The video is decoded once and split
+    into a scale branch and an encoder for each size in one ffmpeg process. The codec of each rendition is chosen by
+    get_codec_meeting_constraints, so small ones can fall back to the cpu.
+
+    Usage:
+        get_resized_videos('upload.mp4', ['1080.mp4', '720.mp4', '360.mp4'], [[-1, 1080], [-1, 720], [-1, 360]])
+
+    Args:
+        input_video_path (str): The path to the input video file.
+        output_paths (list[str]): The paths to save the resized video files.
+        sizes (list[list]): Sizes of the resized videos, one for each output path, like in get_resized_video.
+
+    Returns:
+        list[str]: The paths to the resized video files.
+    """
+    if len(output_paths) != len(sizes):
+        raise ValueError(f'Got {len(output_paths)} output paths for {len(sizes)} sizes.')
+    if input_video_path in output_paths:
+        raise ValueError('get_resized_videos can\'t rewrite its input, use get_resized_video for it.')
+    graph = FilterGraph()
+    branches = [f'{graph.add_input(input_video_path)}:v']
+    if len(sizes) > 1:
+        branches = graph.add_chain(branches, [Filter('split', len(sizes))], outputs=len(sizes), prefix='split')
+    for branch, size in zip(branches, sizes):
+        graph.add_output(graph.add_chain([branch], [Filter('scale', size[0], size[1])], prefix='fin'))
+    graph.add_output('0:a')
+    graph.optimize()
+    # Run command, each output file maps its branch and the audio
+    outputs_str = ' '.join(f'{graph.get_maps_str([i, len(sizes)])} -c:a copy '
+                           f'{get_output_str(output_path, get_codec_meeting_constraints(size))}'
+                           for i, (output_path, size) in enumerate(zip(output_paths, sizes)))
+    cmd = f'ffmpeg -y {graph.get_inputs_str()} {outputs_str}'
+    run_command(cmd, graph)
+    return output_paths
+
+
 @process
 def get_resized_image(input_image_path: str, output_path: str, size: list) -> str:
     """
@@ -651,10 +1260,12 @@ def get_resized_image(input_image_path: str, output_path: str, size: list) -> st
     Returns:
         str: The path to the resized image file.
     """
-    filter_str = f'scale={size[0]}:{size[1]}'
+    graph = FilterGraph()
+    graph.add_output(graph.add_chain([f'{graph.add_input(input_image_path)}:v'], [Filter('scale', size[0], size[1])]))
+    graph.optimize()
     # Run command
-    cmd = f'ffmpeg -y -i "{input_image_path}"  -filter_complex "{filter_str}" -frames:v 1 -update 1 "{output_path}"'
-    run_command(cmd, filter_str)
+    cmd = f'ffmpeg -y {graph.get_inputs_str()} {graph.get_maps_str()} -frames:v 1 -update 1 "{output_path}"'
+    run_command(cmd, graph)
     return output_path
 
 
@@ -677,7 +1288,8 @@ def get_frame(input_video_path: str, output_path: str, time: float) -> str:
 
 
 @process
-def get_subclips_with_sound(input_video_path: str, output_path: str, subclip_times: list[list[float]]) -> str:
+def get_subclips_with_sound(input_video_path: str, output_path: str, subclip_times: list[list[float]],
+                            single_input: bool = False) -> str:
     """
     Extract subclips from a video file and concatenate them into a single video file with sound.
 
@@ -685,36 +1297,246 @@ def get_subclips_with_sound(input_video_path: str, output_path: str, subclip_tim
         input_video_path (str): The path to the input video file.
         output_path (str): The path to save the concatenated video file.
         subclip_times (list[list[float]]): A list of lists containing the start and end times in seconds of each subclip in the format [[start1, end1], [start2, end2], ...].
+        single_input (bool, optional): Whether to open the video once and keep all subclips with select/aselect in one
+            decode. Memory does not grow with the number of subclips, so use it for hundreds of cuts. Subclips should
+            go in order and not overlap.
 
     Returns:
         str: The path to the concatenated video file.
     """
-    # Construct filter and input str
-    input_str = ''
-    filter_str = ''
-    for i, (start, end) in enumerate(subclip_times):
-        input_str += f'-ss {start} -to {end} -i "{input_video_path}" '
-        filter_str += f'[{i}:v][{i}:a]'
-    filter_str += f'concat=a=1:n={len(subclip_times)}:v=1[s0]'
+    if single_input:
+        if any(subclip_times[i][1] > subclip_times[i + 1][0] for i in range(len(subclip_times) - 1)):
+            raise ValueError('single_input needs subclips in order and not overlapping, since they are selected '
+                             'from one decode.')
+        return render_intervals(input_video_path, output_path, subclip_times)
+
+    # Construct filter graph
+    graph = FilterGraph()
+    pads = []
+    for start, end in subclip_times:
+        index = graph.add_input(input_video_path, f'-ss {start} -to {end}', reuse=False)
+        pads += [f'{index}:v', f'{index}:a']
+    video, audio = graph.add_chain(pads, [Filter('concat', a=1, n=len(subclip_times), v=1)], outputs=2)
+    graph.add_output(video)
+    graph.add_output(audio)
+    graph.optimize()
     # Run command
-    cmd = f'ffmpeg -y {input_str} -movflags +faststart ' \
-          f'-filter_complex "{filter_str}" -map [s0] {C_CODEC_SETTINGS[C_CODEC]} "{output_path}"'
-    run_command(cmd, filter_str)
+    cmd = f'ffmpeg -y {graph.get_inputs_str()} {graph.get_maps_str()} {get_output_str(output_path)}'
+    run_command(cmd, graph)
+    return output_path
+
+
+@process
+def get_silence_intervals(input_path: str, min_silence_len: int = 500, silence_thresh: int = -45) -> list[list[float]]:
+    """
+    Detects silence in the audio stream of a file using ffmpeg silencedetect. Only audio is decoded.
+
+    Args:
+        input_path (str): The path to the input video or audio file.
+        min_silence_len (int, optional): The minimum length of silence, in milliseconds.
+        silence_thresh (int, optional): The threshold for silence, in decibels.
+
+    Returns:
+        list[list[float]]: A list of [start, end] silence intervals in seconds.
+    """
+    graph = FilterGraph()
+    graph.add_output(graph.add_chain([f'{graph.add_input(input_path)}:a'], [
+        Filter('silencedetect', noise=f'{silence_thresh}dB', duration=min_silence_len / 1000),
+        Filter('ametadata', mode='print', file=escape_filter_value('pipe:1'))]))
+    graph.optimize()
+    cmd = f'ffmpeg {graph.get_inputs_str()} {graph.get_maps_str()} -f null -'
+    result = run_command(cmd, graph).decode()
+
+    intervals = []
+    for line in result.splitlines():
+        if line.startswith('lavfi.silence_start='):
+            intervals.append([max(float(line.split('=')[1]), 0), None])
+        elif line.startswith('lavfi.silence_end=') and intervals:
+            intervals[-1][1] = float(line.split('=')[1])
+    # Silence lasting until the end of the file may have no silence_end
+    if intervals and intervals[-1][1] is None:
+        intervals[-1][1] = get_video_info(input_path)['duration']
+    return intervals
+
+
+@process
+def get_loudness_measurement(input_path: str) -> dict:
+    """
+    Measures the loudness of the first audio stream with the first pass of ffmpeg loudnorm. Measurements are cached in
+    C_CACHE_DIR/loudness by fingerprint of the file and C_LOUDNESS_TARGET, so each source is measured only once.
+
+    Args:
+        input_path (str): The path to the input video or audio file.
+
+    Returns:
+        dict: loudnorm results as numbers (input_i, input_lra, input_tp, input_thresh, target_offset etc.) and the
+            sample_rate of the stream.
+    """
+    target_str = json.dumps(settings.C_LOUDNESS_TARGET, sort_keys=True)
+    key = hashlib.sha256(f'{get_file_fingerprint(input_path)}-{target_str}'.encode())
+    cache_path = os.path.join(settings.C_CACHE_DIR, 'loudness', f'{key.hexdigest()[:32]}.json')
+    if os.path.exists(cache_path):
+        with open(cache_path) as file:
+            return json.load(file)
+
+    # loudnorm prints its results at the info log level, so the command is not run by run_command
+    loudnorm = Filter('loudnorm', **settings.C_LOUDNESS_TARGET, print_format='json')
+    cmd = f'ffmpeg -hide_banner -nostats -i "{input_path}" -map 0:a:0 -af {loudnorm} -f null -'
+    print_info(cmd, 'green', settings.C_TO_PRINT_PACKAGE_INFO)
+    log = subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE).stderr.decode()
+    measurement = {k: float(v) if k != 'normalization_type' else v
+                   for k, v in json.loads(log[log.rindex('{'):log.rindex('}') + 1]).items()}
+    measurement['sample_rate'] = get_audio_info(input_path)['sample_rate']
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temp_path = get_temp_path_near(cache_path)
+    save_string_return_output(json.dumps(measurement, indent=4), temp_path)
+    os.replace(temp_path, cache_path)
+    return measurement
+
+
+@lru_cache(maxsize=None)
+def get_ffmpeg_version() -> tuple:
+    # (major, minor) of ffmpeg in PATH. Git builds ('N-113000-g...') are newer than any release.
+    output = subprocess.run('ffmpeg -version', check=True, stdout=subprocess.PIPE).stdout.decode()
+    match = re.match(r'ffmpeg version n?(\d+)\.(\d+)', output)
+    return (int(match[1]), int(match[2])) if match else (float('inf'), 0)
+
+
+def get_loudnorm_filters(input_path: str) -> list[Filter]:
+    # The second pass of loudnorm for the first audio stream of input_path. It runs in the main render, with the
+    # cached measurement. If the target is reachable by a gain, it is linear, otherwise loudnorm switches to dynamic
+    # mode, which resamples to 192 kHz, so the stream is resampled back. Silent sources are kept as they are.
+    measurement = get_loudness_measurement(input_path)
+    if measurement['input_i'] == float('-inf'):
+        return []
+    return [Filter('loudnorm', **settings.C_LOUDNESS_TARGET,
+                   measured_I=measurement['input_i'], measured_LRA=measurement['input_lra'],
+                   measured_TP=measurement['input_tp'], measured_thresh=measurement['input_thresh'],
+                   offset=measurement['target_offset'], linear='true'),
+            Filter('aresample', measurement['sample_rate'])]
+
+
+def get_loudness_gain(input_path: str) -> float:
+    # The gain which linear loudnorm applies: up to the target loudness, but not above the target true peak
+    measurement = get_loudness_measurement(input_path)
+    if measurement['input_i'] == float('-inf'):
+        return 1
+    target = settings.C_LOUDNESS_TARGET
+    gain_db = min(target['I'] - measurement['input_i'], target['TP'] - measurement['input_tp'])
+    return 10 ** (gain_db / 20)
+
+
+@process
+def get_jump_cut_video(input_video_path: str, output_path: str, min_silence_len: int = 500,
+                       silence_thresh: int = -45, keep_silence: int = 100, min_copy_duration: float = None) -> str:
+    """
+    Cuts silent parts out of a video. Silence is detected on an audio-only decode, then video and audio are cut
+    together in one select/aselect render.
+
+    Args:
+        input_video_path (str): The path to the input video file.
+        output_path (str): The path to the output video file.
+        min_silence_len (int, optional): The minimum length of silence to be removed, in milliseconds.
+        silence_thresh (int, optional): The threshold for silence, in decibels.
+        keep_silence (int, optional): The length of silence to keep around each kept part, in milliseconds.
+        min_copy_duration (float, optional): If set, kept parts longer than this (in seconds) are stream-copied between
+            their first and last keyframes instead of being re-encoded. The source must be encoded with the same codec
+            and parameters as C_CODEC_SETTINGS produce, otherwise the joined parts may not play correctly. Audio of
+            re-encoded parts gets the codec, sample rate and channels of the source audio.
+
+    Returns:
+        str: The path to the output video file.
+    """
+    duration = get_video_info(input_video_path)['duration']
+    silences = get_silence_intervals(input_video_path, min_silence_len=min_silence_len,
+                                     silence_thresh=silence_thresh)
+    kept = invert_intervals(silences, duration, keep_silence / 1000)
+    if not kept:
+        raise ValueError(f'Nothing is left in {input_video_path} after removing silence.')
+    print_info(f'Keeping {len(kept)} parts, {sum(e - s for s, e in kept):.2f} of {duration:.2f} seconds.',
+               to_print=settings.C_TO_PRINT_PACKAGE_INFO)
+
+    if not min_copy_duration:
+        return render_intervals(input_video_path, output_path, kept)
+
+    # Split kept parts into [start, end, to_copy] segments. Long parts are copied between their inner keyframes.
+    keyframes = get_keyframe_times(input_video_path)
+    segments = []
+    for start, end in kept:
+        inner_keyframes = [k for k in keyframes if start <= k <= end]
+        if end - start >= min_copy_duration and len(inner_keyframes) > 1:
+            first_keyframe, last_keyframe = inner_keyframes[0], inner_keyframes[-1]
+            if first_keyframe > start:
+                segments.append([start, first_keyframe, False])
+            segments.append([first_keyframe, last_keyframe, True])
+            if end > last_keyframe:
+                segments.append([last_keyframe, end, False])
+        else:
+            segments.append([start, end, False])
+
+    # Neighbour re-encoded segments are rendered together. Their audio is encoded like the copied one, so the
+    # concat demuxer can join them
+    audio_codec_str = get_audio_codec_str(input_video_path)
+    with temp_workspace() as tmp_dir:
+        segment_paths = []
+        to_render = []
+        for i, (start, end, to_copy) in enumerate(segments + [[None, None, True]]):
+            if not to_copy:
+                to_render.append([start, end])
+                continue
+            if to_render:
+                segment_paths.append(render_intervals(input_video_path,
+                                                      os.path.join(tmp_dir, f'segment_{i}_rendered.mkv'), to_render,
+                                                      options=audio_codec_str))
+                to_render = []
+            if start is not None:
+                segment_paths.append(get_stream_copied_subclip(input_video_path,
+                                                               os.path.join(tmp_dir, f'segment_{i}_copied.mkv'),
+                                                               start, end))
+        concat_without_reencoding(segment_paths, output_path)
     return output_path
 
 
 @process
-def get_audio_from_video(input_video_path: str, output_path: str = 'audio.wav') -> str:
+def get_audio_from_video(input_video_path: str, output_path: str = 'audio.wav', normalize: bool = False,
+                         to_reencode: bool = False) -> str:
     """
-    Extracts the audio from a video file using ffmpeg and saves it to a WAV file.
+    Extracts the audio from a video file using ffmpeg and saves it to a WAV file (16 bit, 44.1 kHz, stereo).
+    If the extension of output_path can keep the codec of the source (like .m4a for AAC, see AUDIO_COPY_EXTENSIONS),
+    the track is copied without re-encoding.
 
     Args:
         input_video_path (str): The path to the input video file.
         output_path (str): The path to save the output audio file.
+        normalize (bool, optional): Whether to bring the audio to C_LOUDNESS_TARGET. The source is measured once (see
+            get_loudness_measurement), the extraction itself is one pass.
+        to_reencode (bool, optional): Whether to always convert to 16 bit 44.1 kHz stereo PCM, even if the track
+            could be copied.
 
     Returns:
         str: The path to the output audio file.
     """
+    # A Stream can't be probed for its codec, so it is converted
+    if not normalize and not to_reencode and input_video_path != PIPE_INPUT:
+        audio_info = get_audio_info(input_video_path)
+        extension = os.path.splitext(output_path)[1].lower()
+        # A WAV is copied only if it already is what the conversion gives
+        is_converted_wav = audio_info['sample_rate'] == 44100 and audio_info['channels'] == 2
+        if extension == '.mka' or (extension in AUDIO_COPY_EXTENSIONS.get(audio_info['codec'], ()) and
+                                   (extension != '.wav' or is_converted_wav)):
+            cmd = f'ffmpeg -y -i "{input_video_path}" -map 0:a:0 -c copy "{output_path}"'
+            run_command(cmd)
+            return output_path
+    loudnorm_filters = get_loudnorm_filters(input_video_path) if normalize else []
+    if loudnorm_filters:
+        graph = FilterGraph()
+        graph.add_output(graph.add_chain([f'{graph.add_input(input_video_path)}:a:0'], loudnorm_filters))
+        graph.optimize()
+        cmd = f'ffmpeg -y {graph.get_inputs_str()} {graph.get_maps_str()} -acodec pcm_s16le -ar 44100 -ac 2 ' \
+              f'"{output_path}"'
+        run_command(cmd, graph)
+        return output_path
     cmd = f'ffmpeg -y -i "{input_video_path}" -vn -acodec pcm_s16le -ar 44100 -ac 2 "{output_path}"'
     run_command(cmd)
     return output_path
@@ -732,29 +1554,52 @@ def get_mirrored_video(input_video_path: str, output_path: str) -> str:
     Returns:
         str: The path to the output mirrored video file.
     """
-    filter_str = "hflip"
-    cmd = f'ffmpeg -y -i "{input_video_path}" -movflags +faststart ' \
-          f'-vf "{filter_str}" {C_CODEC_SETTINGS[C_CODEC]} -c:a copy "{output_path}"'
-    run_command(cmd)
+    graph = FilterGraph()
+    graph.add_output(graph.add_chain([f'{graph.add_input(input_video_path)}:v'], [Filter('hflip')]))
+    graph.add_output('0:a?')
+    graph.optimize()
+    cmd = f'ffmpeg -y {graph.get_inputs_str()} {graph.get_maps_str()} -c:a copy {get_output_str(output_path)}'
+    run_command(cmd, graph)
     return output_path
 
 
 @process
-def get_rotated_video(input_video_path: str, output_path: str, degree: float) -> str:
+def get_rotated_video(input_video_path: str, output_path: str, degree: float, to_reencode: bool = False) -> str:
     """
     Rotates a video file clockwise by a specified degree using ffmpeg and saves it to a new file.
+    Multiples of 90 degrees into mp4/mov files only change the display matrix, and the streams are copied. Players
+    rotate the video when showing it, and its width and height are swapped for 90 and 270 degrees.
 
     Args:
         input_video_path (str): The path to the input video file.
         output_path (str): The path to save the output rotated video file.
         degree (float): The degree to rotate the video clockwise.
+        to_reencode (bool, optional): Whether to always rotate the frames with the rotate filter and encode them. The
+            frame size is kept then, so corners are cut.
 
     Returns:
         str: The path to the output rotated video file.
     """
-    cmd = f'ffmpeg -y -i "{input_video_path}" -movflags +faststart ' \
-          f'-vf "rotate={degree}*(PI/180)" {C_CODEC_SETTINGS[C_CODEC]} "{output_path}"'
-    run_command(cmd)
+    if not to_reencode and degree % 90 == 0 and input_video_path != PIPE_INPUT and \
+            os.path.splitext(output_path)[1].lower() in ROTATION_METADATA_EXTENSIONS:
+        # The display matrix is counterclockwise and replaces the existing one, so the existing rotation is added
+        rotation = (get_video_info(input_video_path)['rotation'] - degree) % 360
+        # -display_rotation is there since ffmpeg 6.0, older muxers turn the clockwise rotate tag into the matrix
+        if get_ffmpeg_version() >= (6, 0):
+            input_options, output_options = f'-display_rotation:v:0 {rotation:g} ', ''
+        else:
+            input_options, output_options = '', f'-metadata:s:v:0 rotate={-rotation % 360:g} '
+        cmd = f'ffmpeg -y {input_options}-i "{input_video_path}" -map 0:v:0 -map 0:a? -c copy {output_options}' \
+              f'-movflags +faststart "{output_path}"'
+        run_command(cmd)
+        return output_path
+    graph = FilterGraph()
+    graph.add_output(graph.add_chain([f'{graph.add_input(input_video_path)}:v'], [
+        Filter('rotate', f'{degree}*(PI/180)')]))
+    graph.add_output('0:a?')
+    graph.optimize()
+    cmd = f'ffmpeg -y {graph.get_inputs_str()} {graph.get_maps_str()} {get_output_str(output_path)}'
+    run_command(cmd, graph)
     return output_path
 
 
@@ -771,7 +1616,165 @@ def get_video_from_picture(input_path: str, output_path: str, duration: float) -
     Returns:
         str: The path to the output video file.
     """
-    cmd = f'ffmpeg -y -loop 1 -i {input_path} {C_CODEC_SETTINGS[C_CODEC]} -t {duration} ' \
-          f'-movflags +faststart -pix_fmt yuv420p {output_path}'
+    cmd = f'ffmpeg -y -loop 1 -i "{input_path}" -t {duration} -pix_fmt yuv420p {get_output_str(output_path)}'
     run_command(cmd)
     return output_path
+
+
+@process
+def get_slideshow_video(input_image_paths: list[str], output_path: str, durations: list[float], size: list = None,
+                        effects: list[str] = None, transition_durations: list[float] = None, fps: float = None) -> str:
+    """
+    Makes a slideshow from images in one encode. Without effects the images are read by the concat demuxer with their
+    durations, and each image is one frame lasting its duration (variable frame rate), so a still costs almost
+    nothing to encode. With effects the images are joined by xfade at a constant frame rate. The concat demuxer
+    decodes all images with the decoder of the first one, so images of different formats (like jpg and png) are
+    joined by the concat filter at a constant frame rate too. libx264 is tuned for still images.
+
+    Args:
+        input_image_paths (list[str]): A list of paths to the images.
+        output_path (str): The path to the output video file.
+        durations (list[float]): A list of durations of the images in seconds. With effects they include transitions.
+        size (list, optional): The size [w,h] of the video. Images are fitted into it with black bars. By default, the
+            size of the first image.
+        effects (list[str], optional): A list of transition effects between images. See
+            https://trac.ffmpeg.org/wiki/Xfade for options. All images are opened at once then, so for hundreds of
+            images expect more memory.
+        transition_durations (list[float], optional): A list of durations for each transition.
+        fps (float, optional): A constant frame rate. By default, variable without effects and C_SLIDESHOW_FPS with them
+            or with images of different formats.
+
+    Returns:
+        str: The path to the output video file.
+    """
+    # Make lists equal
+    input_image_paths, durations, effects, transition_durations = make_lists_equal(
+        input_image_paths=input_image_paths, durations=durations, effects=effects,
+        transition_durations=transition_durations)
+    if not size:
+        image_info = get_image_info(input_image_paths[0])
+        size = [image_info['width'] // 2 * 2, image_info['height'] // 2 * 2]
+    codec_to_use = get_codec_meeting_constraints(size)
+    options = '-tune stillimage' if codec_to_use == 'cpu' else ''
+    fitting_filters = [Filter('scale', size[0], size[1], force_original_aspect_ratio='decrease'),
+                       Filter('pad', size[0], size[1], '(ow-iw)/2', '(oh-ih)/2'),
+                       Filter('setsar', 1), Filter('format', 'yuv420p')]
+
+    graph = FilterGraph()
+    image_formats = {os.path.splitext(path)[1].lower().replace('.jpeg', '.jpg') for path in input_image_paths}
+    with temp_workspace() as workspace:
+        if effects or len(image_formats) > 1:
+            fps = fps or settings.C_SLIDESHOW_FPS
+            images = []
+            for i, path in enumerate(input_image_paths):
+                index = graph.add_input(path, f'-loop 1 -framerate {fps} -t {durations[i]}', reuse=False)
+                images.append(graph.add_chain([f'{index}:v'], fitting_filters, prefix='image'))
+            if effects:
+                video = images[0]
+                offset = 0
+                for i in range(1, len(images)):
+                    # The next image starts when the transition to it starts
+                    offset += durations[i - 1] - transition_durations[i - 1]
+                    video = graph.add_chain([video, images[i]], [
+                        Filter('xfade', transition=effects[i - 1], duration=transition_durations[i - 1],
+                               offset=offset)], prefix='xfade')
+            else:
+                video = graph.add_chain(images, [Filter('concat', n=len(images), v=1, a=0)], prefix='concat')
+            graph.add_output(video)
+        else:
+            list_path = save_concat_list(input_image_paths, os.path.join(workspace, 'slideshow.txt'), durations)
+            filters = fitting_filters + ([Filter('fps', fps)] if fps else [])
+            graph.add_output(graph.add_chain([f'{graph.add_input(list_path, "-f concat -safe 0")}:v'], filters))
+        graph.optimize()
+        fps_mode_str = '' if fps else '-fps_mode vfr '
+        cmd = f'ffmpeg -y {graph.get_inputs_str()} {graph.get_maps_str()} ' \
+              f'{fps_mode_str}{get_output_str(output_path, codec_to_use, options)}'
+        run_command(cmd, graph)
+    return output_path
+
+
+@process
+def get_chained_video(input_video_path: str, output_path: str, calls: list) -> str:
+    """
+    Runs functions one after another like separate calls, but without intermediate files. All stages run at the same
+    time and stream raw video and PCM audio in NUT to the next one through OS pipes. Only the last stage encodes with
+    C_CODEC_SETTINGS. A stage waits while the pipe to the next one is full, so memory is bounded for any video length.
+
+    Usage:
+        get_chained_video('in.mp4', 'out.mp4', [
+            (get_cropped_video, {'size': [1080, 1080], 'x_y_coordinate': [420, 0]}),
+            (get_resized_video, {'size': [720, 720]}),
+            (add_colored_space_around_video, {'goal_size': [720, 1280], 'x_y_coordinate': [0, 280]})])
+
+    The input and the output may be Streams. The first stage reads the input Stream and the last stage encodes into
+    the output Stream, so the first stage can't probe its input then.
+
+    Args:
+        input_video_path (str): The path to the input video file.
+        output_path (str): The path to the output video file.
+        calls (list): List of (function, kwargs without the input and output paths). Functions are from
+            CHAIN_STAGE_FUNCTIONS. Only the first one may probe its input (like add_video_to_video). No stage can
+            use only_affected_ranges, which joins its output from files.
+
+    Returns:
+        str: The path to the output video file.
+    """
+    unsupported = [function.__name__ for function, _ in calls if function.__name__ not in CHAIN_STAGE_FUNCTIONS]
+    if unsupported:
+        raise ValueError(f'{unsupported} can not be stages of get_chained_video, see CHAIN_STAGE_FUNCTIONS.')
+    # A Stream output is written by the last stage, there is no file to replace
+    temp_path = get_temp_path_near(output_path) if output_path != PIPE_OUTPUT else PIPE_OUTPUT
+    # Pipes and formats of Streams of this call. The first stage reads the input one, the last writes the output one.
+    outer_ends, outer_formats = pipe_ends.get() or [None, None], pipe_formats.get()
+    # Stage i reads pipes[i - 1] and writes pipes[i]
+    pipes = [os.pipe() for _ in range(len(calls) - 1)]
+    errors = [None] * len(calls)
+    # Stages count their ffmpeg commands separately, they are added to the metrics of this call after
+    stage_metrics = [{'commands': 0, 'ffmpeg_time': 0.0, 'codec': None} for _ in calls]
+
+    def run_stage(i, function, kwargs):
+        stdin = pipes[i - 1][0] if i > 0 else None
+        stdout = pipes[i][1] if i < len(pipes) else None
+        # Pipes between stages carry NUT (format None), Streams keep their formats
+        pipe_ends.set([outer_ends[0] if i == 0 else stdin, outer_ends[1] if i == len(pipes) else stdout])
+        pipe_formats.set([outer_formats[0] if i == 0 else None, outer_formats[1] if i == len(pipes) else None])
+        call_metrics.set(stage_metrics[i])
+        try:
+            function(PIPE_INPUT if stdin is not None else input_video_path,
+                     PIPE_OUTPUT if stdout is not None else temp_path, **kwargs)
+        except BaseException as e:
+            errors[i] = e
+        finally:
+            # The next stage gets the end of file (and the previous one a broken pipe) only when all ends are closed.
+            # Pipes of Streams are closed by connect_streams.
+            for fd in (stdin, stdout):
+                if fd is not None:
+                    os.close(fd)
+
+    # Each stage runs in a copy of the current context, so it uses the same Config
+    threads = [threading.Thread(target=contextvars.copy_context().run, args=(run_stage, i, function, kwargs))
+               for i, (function, kwargs) in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    metrics = call_metrics.get()
+    if metrics is not None:
+        for key in ('commands', 'ffmpeg_time'):
+            metrics[key] += sum(stage[key] for stage in stage_metrics)
+        # Only the last stage encodes
+        metrics['codec'] = stage_metrics[-1]['codec'] or metrics['codec']
+
+    failed = [i for i, error in enumerate(errors) if error]
+    if failed:
+        if temp_path != PIPE_OUTPUT and os.path.exists(temp_path):
+            os.remove(temp_path)
+        # When one stage fails, its neighbours fail on the pipes, so all errors are shown.
+        # An error raised before ffmpeg ran (like a wrong argument) is the cause, the others are broken pipes.
+        for i in failed:
+            print_info(f'Stage {i} ({calls[i][0].__name__}) failed: {errors[i]!r}', 'red', True)
+        causes = [i for i in failed if not isinstance(errors[i], subprocess.CalledProcessError)]
+        raise errors[(causes or failed)[0]]
+    if temp_path != PIPE_OUTPUT:
+        os.replace(temp_path, output_path)
+    return output_path
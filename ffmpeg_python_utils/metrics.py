@@ -0,0 +1,149 @@
+import heapq
+import inspect
+import os
+import sqlite3
+import time
+from contextlib import suppress
+import numpy as np
+from .config import settings
+from .inc import print_info
+
+FEATURE_NAMES = ['megapixels', 'duration', 'overlay_seconds']
+"""Features of the regression: decoded megapixels (width * height * fps * duration / 10^6), seconds of media and
+seconds multiplied by the number of overlays. The time of a call is a constant plus their weighted sum."""
+
+
+def get_metrics_path() -> str:
+    return os.path.join(settings.C_CACHE_DIR, 'metrics.sqlite')
+
+
+def connect() -> sqlite3.Connection:
+    os.makedirs(settings.C_CACHE_DIR, exist_ok=True)
+    connection = sqlite3.connect(get_metrics_path())
+    connection.executescript('''
+        PRAGMA journal_mode = WAL;
+        CREATE TABLE IF NOT EXISTS calls (operation TEXT, codec TEXT, width INTEGER, height INTEGER, fps REAL,
+                                          duration REAL, overlays INTEGER, wall_time REAL, ffmpeg_time REAL,
+                                          created REAL);
+    ''')
+    return connection
+
+
+def get_call_features(input_path, kwargs: dict) -> dict:
+    """
+    Gets what the time of a call depends on from get_video_info of its inputs. A list of inputs (like clips of
+    get_concantenated_videos) adds up durations. Overlays are the number of items of the longest list argument
+    (texts, images, clips), 1 if there are no lists.
+    """
+    from ffmpeg_python_utils import get_video_info
+    input_paths = list(input_path) if isinstance(input_path, (list, tuple)) else [input_path]
+    infos = []
+    for path in input_paths:
+        # Inputs of planned jobs may not exist yet, images and some audio files have no duration
+        if isinstance(path, str) and os.path.isfile(path):
+            with suppress(Exception):
+                infos.append(get_video_info(path))
+    first = infos[0] if infos else {}
+    overlays = max([len(v) for v in kwargs.values() if isinstance(v, (list, tuple))] + [1])
+    return {'width': first.get('width') or 0, 'height': first.get('height') or 0, 'fps': first.get('fps') or 0,
+            'duration': sum(info['duration'] for info in infos), 'overlays': overlays}
+
+
+def get_feature_row(features: dict) -> list[float]:
+    duration = features['duration']
+    return [1.0, features['width'] * features['height'] * features['fps'] * duration / 10 ** 6, duration,
+            features['overlays'] * duration]
+
+
+def record_call(operation: str, codec: str, input_path, kwargs: dict, wall_time: float, ffmpeg_time: float):
+    """
+    Saves a completed call to C_CACHE_DIR/metrics.sqlite. process does it after each call which ran ffmpeg, if
+    C_TO_RECORD_METRICS. Any error (a locked database, an input which can not be probed) only skips the record.
+    """
+    try:
+        features = get_call_features(input_path, kwargs)
+        with connect() as connection:
+            connection.execute('INSERT INTO calls VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               (operation, codec, features['width'], features['height'], features['fps'],
+                                features['duration'], features['overlays'], wall_time, ffmpeg_time, time.time()))
+        connection.close()
+    except Exception as e:
+        print_info(f'Metrics of {operation} are not recorded: {e!r}', 'red', settings.C_TO_PRINT_PACKAGE_INFO)
+
+
+def load_records() -> list[dict]:
+    """Returns all recorded calls as dicts with the columns of the calls table."""
+    if not os.path.exists(get_metrics_path()):
+        return []
+    connection = connect()
+    connection.row_factory = sqlite3.Row
+    records = [dict(row) for row in connection.execute('SELECT * FROM calls')]
+    connection.close()
+    return records
+
+
+def estimate_call_time(operation: str, kwargs: dict, codec: str = None, records: list[dict] = None) -> float:
+    """
+    Estimates the wall time of a call from get_video_info of its inputs and recorded calls. A least squares fit of
+    FEATURE_NAMES is done on records of the same operation and codec. If there are fewer than C_METRICS_MIN_RECORDS
+    of them, the codec is ignored, then the operation. Without any records the duration of the media is returned,
+    like for a realtime encoder.
+
+    Usage:
+        estimate_call_time('add_video_to_video', {'input_video_path': 'in.mp4', 'video_to_overlay_paths': [...]})
+
+    Args:
+        operation (str): The name of a function of the package.
+        kwargs (dict): Its arguments. The input may not exist yet, then only the number of overlays is known.
+        codec (str, optional): The codec the call will use, C_CODEC by default.
+        records (list[dict], optional): Records from load_records, to read them once for many estimates.
+
+    Returns:
+        float: Estimated seconds.
+    """
+    import ffmpeg_python_utils
+    codec = codec or settings.C_CODEC
+    records = load_records() if records is None else records
+    input_name = next(iter(inspect.signature(getattr(ffmpeg_python_utils, operation)).parameters))
+    features = get_call_features(kwargs.get(input_name, []), kwargs)
+
+    candidates = [r for r in records if r['operation'] == operation and r['codec'] == codec]
+    if len(candidates) < settings.C_METRICS_MIN_RECORDS:
+        candidates = [r for r in records if r['operation'] == operation]
+    if len(candidates) < settings.C_METRICS_MIN_RECORDS:
+        candidates = records
+    if not candidates:
+        return features['duration']
+    x = np.array([get_feature_row(r) for r in candidates], dtype=np.float64)
+    y = np.array([r['wall_time'] for r in candidates], dtype=np.float64)
+    weights = np.linalg.lstsq(x, y, rcond=None)[0]
+    return max(float(np.array(get_feature_row(features)) @ weights), 0.0)
+
+
+def plan_jobs(jobs: list[dict], workers: int) -> list[list[dict]]:
+    """
+    Splits jobs across workers by estimated time: the longest job goes first to the least loaded worker, so the batch
+    finishes as early as possible.
+
+    Usage:
+        for worker_jobs in plan_jobs([{'function': 'get_resized_video', 'args': {...}}, ...], workers=4):
+            submit(worker_jobs)
+
+    Args:
+        jobs (list[dict]): Jobs like in manifests of the cli: {"function": name, "args": keyword arguments}.
+        workers (int): The number of workers.
+
+    Returns:
+        list[list[dict]]: Jobs of each worker, longest first.
+    """
+    records = load_records()
+    estimates = [estimate_call_time(job['function'], job['args'], records=records) for job in jobs]
+    plan = [[] for _ in range(workers)]
+    loads = [(0.0, i) for i in range(workers)]
+    for estimate, job in sorted(zip(estimates, jobs), key=lambda pair: -pair[0]):
+        load, worker = heapq.heappop(loads)
+        plan[worker].append(job)
+        heapq.heappush(loads, (load + estimate, worker))
+    print_info(f'Planned {len(jobs)} jobs on {workers} workers, estimated time {max(loads)[0]:.1f} s.',
+               to_print=settings.C_TO_PRINT_PACKAGE_INFO)
+    return plan
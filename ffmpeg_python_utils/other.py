@@ -1,7 +1,8 @@
+import io
 import os
+import subprocess
 import matplotlib.pyplot as plt
 from pydub.silence import split_on_silence
-import librosa
 from scipy import signal
 import numpy as np
 import pickle
@@ -9,13 +10,15 @@ from pydub import AudioSegment
 import hashlib
 from functools import wraps
 import inspect
-from .inc import print_info
-from .config import C_TO_PRINT_PACKAGE_INFO, C_TIME_AMONG_NEIGHBOUR_PEAKS
+from .inc import print_info, get_temp_path_near, get_file_fingerprint, locked_file
+from .config import settings
 
 
 def cache_results(function_to_modify):
     # Caches results from find_offsets just in case. Takes in account hash + kwargs.
-    # Saves cache to "cached_offset_searches.pickle" file.
+    # Saves cache to "cached_offset_searches.pickle" file in C_CACHE_DIR.
+    # The file is replaced atomically, so parallel calls never read a half-written cache, and updated under
+    # locked_file, so parallel calls never lose each other's results.
 
     @wraps(function_to_modify)
     def wrapper(*args, **kwargs):
@@ -29,9 +32,10 @@ def cache_results(function_to_modify):
         find_file = kwargs['find_file']
 
         # load cached searches if we have them
+        cache_path = os.path.join(settings.C_CACHE_DIR, 'cached_offset_searches.pickle')
         cached_searches = None
-        if os.access('cached_offset_searches.pickle', os.R_OK):
-            with open('cached_offset_searches.pickle', 'rb') as file:
+        if os.access(cache_path, os.R_OK):
+            with open(cache_path, 'rb') as file:
                 cached_searches = pickle.load(file)
 
         current_info = kwargs
@@ -53,33 +57,224 @@ def cache_results(function_to_modify):
         # function itself
         res = function_to_modify(**kwargs)
 
-        # cache the result
+        # cache the result. Reloading the cache under the lock since other calls could have updated it meanwhile
         cached_search = {'hash_within': hash_within, **kwargs, 'time_codes': res, 'hash_find': hash_find}
-        if cached_searches:
+        os.makedirs(settings.C_CACHE_DIR, exist_ok=True)
+        with locked_file(cache_path):
+            cached_searches = []
+            if os.access(cache_path, os.R_OK):
+                with open(cache_path, 'rb') as file:
+                    cached_searches = pickle.load(file)
             cached_searches.append(cached_search)
-        else:
-            cached_searches = [cached_search]
 
-        with open('cached_offset_searches.pickle', 'wb') as file:
-            pickle.dump(cached_searches, file)
+            tmp_cache_path = get_temp_path_near(cache_path)
+            with open(tmp_cache_path, 'wb') as file:
+                pickle.dump(cached_searches, file)
+            os.replace(tmp_cache_path, cache_path)
 
         return res
 
     return wrapper
 
 
-def get_hash_for_audio(input_path):
-    from ffmpeg_python_utils import get_audio_from_video
-    # Extract the video file
-    audio_name = get_audio_from_video(input_path, 'tmp_hash_audio.wav')
-    # Read the audio file as binary data
-    with open(audio_name, "rb") as f:
-        audio_data = f.read()
-    # Generate the hash value for the audio
-    hash_object = hashlib.sha256(audio_data)
-    # Get hash of the current audio
-    os.remove('tmp_hash_audio.wav')
-    return hash_object.hexdigest()
+def get_hash_for_audio(input_path, sr=None):
+    # Key of the audio find_offsets decodes: the file fingerprint and the sample rate it is decoded at (None is the
+    # original one). Nothing is decoded, so a cached search returns instantly.
+    return hashlib.sha256(f'{get_file_fingerprint(input_path)}-{sr}'.encode()).hexdigest()
+
+
+def load_audio(input_path: str, sr: int = None, mono: bool = True, start: float = None, duration: float = None,
+               memmap_path: str = None) -> tuple[np.ndarray, int]:
+    """
+    Decodes audio straight into a float32 NumPy array. ffmpeg resamples and pipes raw samples, nothing is written to
+    disk. The array is allocated once by the duration from ffprobe and filled from the pipe.
+
+    Args:
+        input_path (str): The path to an audio or video file.
+        sr (int, optional): The sample rate to resample to. None keeps the original one.
+        mono (bool, optional): Whether to mix channels down to one.
+        start (float, optional): Where to start reading, in seconds.
+        duration (float, optional): How much to read, in seconds. None means up to the end.
+        memmap_path (str, optional): If passed, samples are written to a .npy file at this path (opened by
+            np.lib.format.open_memmap) instead of memory, for files too long to keep in RAM. The file holds
+            interleaved samples shaped (n, channels).
+
+    Returns:
+        tuple[np.ndarray, int]: Samples, shaped (n,) if mono else (channels, n) like librosa.load, and the sample rate.
+    """
+    from ffmpeg_python_utils import get_audio_info
+    audio_info = get_audio_info(input_path)
+    sr = sr or audio_info['sample_rate']
+    channels = 1 if mono else audio_info['channels']
+    seek_str = f'-ss {start} ' if start else ''
+    duration_str = f'-t {duration} ' if duration is not None else ''
+    if duration is None:
+        duration = max(audio_info['duration'] - (start or 0), 0)
+    # A second more, since durations in containers are not exact. If it is still not enough, the rest is appended
+    frames = int(np.ceil(duration * sr)) + sr
+
+    cmd = f'ffmpeg -v error {seek_str}-i "{input_path}" {duration_str}-map 0:a:0 -f f32le -ac {channels} -ar {sr} -'
+    print_info(cmd, 'green', settings.C_TO_PRINT_PACKAGE_INFO)
+    if memmap_path:
+        samples = np.lib.format.open_memmap(memmap_path, mode='w+', dtype=np.float32, shape=(frames, channels))
+    else:
+        samples = np.empty((frames, channels), dtype=np.float32)
+    buffer = memoryview(samples.reshape(-1)).cast('B')
+    position = 0
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE) as ffmpeg_process:
+        while position < len(buffer):
+            read_size = ffmpeg_process.stdout.readinto(buffer[position:])
+            if not read_size:
+                break
+            position += read_size
+        extra = ffmpeg_process.stdout.read()
+    if ffmpeg_process.returncode:
+        raise subprocess.CalledProcessError(ffmpeg_process.returncode, cmd)
+    buffer.release()
+
+    frame_size = 4 * channels
+    total_frames = (position + len(extra)) // frame_size
+    if memmap_path:
+        # The header gets the decoded length. NumPy leaves room in .npy headers for the first axis to change, so it
+        # keeps its size and the samples stay where they are.
+        offset = samples.offset
+        samples.flush()
+        del samples
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, {'descr': '<f4', 'fortran_order': False,
+                                                      'shape': (total_frames, channels)})
+        if header.tell() != offset:
+            raise ValueError(f'The .npy header of {memmap_path} can not be updated in place, NumPy is too old.')
+        with open(memmap_path, 'r+b') as file:
+            file.write(header.getvalue())
+            file.seek(offset + position)
+            file.write(extra)
+            file.truncate(offset + total_frames * frame_size)
+        samples = np.load(memmap_path, mmap_mode='r+') if total_frames else np.zeros((0, channels), dtype=np.float32)
+    elif extra:
+        samples = np.concatenate([samples[:position // frame_size],
+                                  np.frombuffer(extra[:len(extra) // frame_size * frame_size],
+                                                dtype=np.float32).reshape(-1, channels)])
+    else:
+        samples = samples[:total_frames]
+    return (samples[:, 0] if mono else samples.T), sr
+
+
+def load_cached_audio(input_path: str, sr: int = None, mono: bool = True) -> tuple[np.ndarray, int]:
+    """
+    Same as load_audio for the whole file, but decoded samples are cached as .npy files in C_CACHE_DIR/audio,
+    keyed by the file fingerprint, sr and mono. Cached arrays are opened with np.load(mmap_mode='r'), so repeated
+    calls start instantly and parallel processes share the same pages. The least recently used files are removed
+    when the cache gets bigger than C_AUDIO_CACHE_SIZE.
+
+    Args:
+        input_path (str): The path to an audio or video file.
+        sr (int, optional): The sample rate to resample to. None keeps the original one.
+        mono (bool, optional): Whether to mix channels down to one.
+
+    Returns:
+        tuple[np.ndarray, int]: Read-only samples shaped like load_audio returns and the sample rate.
+    """
+    cache_dir = os.path.join(settings.C_CACHE_DIR, 'audio')
+    # Files keep the interleaved (n, channels) samples of load_audio, which 'interleaved' in the key tells apart from
+    # caches of older versions
+    key = hashlib.sha256(f'{get_file_fingerprint(input_path)}-{sr}-{mono}-interleaved'.encode()).hexdigest()[:32]
+    cached_names = os.listdir(cache_dir) if os.path.isdir(cache_dir) else []
+    for cache_name in cached_names:
+        if not (cache_name.startswith(key) and cache_name.endswith('.npy')):
+            continue
+        # The sample rate is a part of the name, since sr=None means the original one
+        cache_path = os.path.join(cache_dir, cache_name)
+        os.utime(cache_path)
+        print_info(f'Loading decoded audio of {input_path} from {cache_path}',
+                   to_print=settings.C_TO_PRINT_PACKAGE_INFO)
+        samples = np.load(cache_path, mmap_mode='r')
+        return (samples[:, 0] if mono else samples.T), int(cache_name.rsplit('_', 1)[1].split('.')[0])
+
+    # Samples are decoded straight into a .npy memmap file, so long recordings do not have to fit in memory
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = get_temp_path_near(os.path.join(cache_dir, f'{key}.npy'))
+    try:
+        samples, sr = load_audio(input_path, sr=sr, mono=mono, memmap_path=temp_path)
+        del samples
+        cache_path = os.path.join(cache_dir, f'{key}_{sr}.npy')
+        os.replace(temp_path, cache_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    remove_least_recently_used(cache_dir, settings.C_AUDIO_CACHE_SIZE)
+    samples = np.load(cache_path, mmap_mode='r')
+    return (samples[:, 0] if mono else samples.T), sr
+
+
+def remove_least_recently_used(cache_dir: str, max_size: int):
+    # Removes the least recently used .npy files until the folder is not bigger than max_size bytes.
+    # Files opened by other processes can't be removed on Windows, they are skipped.
+    paths = sorted((os.path.join(cache_dir, p) for p in os.listdir(cache_dir) if p.endswith('.npy')),
+                   key=os.path.getmtime)
+    total_size = sum(os.path.getsize(p) for p in paths)
+    for path in paths[:-1]:
+        if total_size <= max_size:
+            break
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            total_size -= size
+        except OSError:
+            pass
+
+
+def convert_channels(samples: np.ndarray, channels: int) -> np.ndarray:
+    # Converts (n,) or (c, n) samples to (channels, n): mono is copied to each channel, others are downmixed to mono first
+    if samples.ndim == 1:
+        samples = samples[np.newaxis]
+    if samples.shape[0] == channels:
+        return samples
+    return np.broadcast_to(samples.mean(axis=0), (channels, samples.shape[1]))
+
+
+def mix_audio_blocks(input_audio_paths: list[str], sound_volumes: list[float], start_times: list[float],
+                     durations: list[float], sr: int, channels: int, block_duration: float = 10):
+    """
+    Mixes sounds placed on a timeline with NumPy and yields the result block by block, so memory does not depend on
+    the length of the timeline. Each distinct file is decoded once (and cached by load_cached_audio).
+
+    Args:
+        input_audio_paths (list[str]): Paths to the sounds, one per placement. Repeated paths are decoded once.
+        sound_volumes (list[float]): Gains of the placements.
+        start_times (list[float]): Start times of the placements in seconds, not negative.
+        durations (list[float]): How much of each sound to play in seconds. None or 0 means all of it.
+        sr (int): The sample rate of the mix.
+        channels (int): The number of channels of the mix.
+        block_duration (float, optional): The length of a yielded block in seconds.
+
+    Yields:
+        bytes: Interleaved float32 samples of the next block, ready for ffmpeg -f f32le.
+    """
+    if any(start_time < 0 for start_time in start_times):
+        raise ValueError(f'start_times can not be negative: {start_times}')
+    sounds = {path: convert_channels(load_cached_audio(path, sr=sr, mono=channels == 1)[0], channels)
+              for path in set(input_audio_paths)}
+    placements = []
+    for i, path in enumerate(input_audio_paths):
+        sound = sounds[path]
+        if durations and durations[i]:
+            sound = sound[:, :round(durations[i] * sr)]
+        start = round(start_times[i] * sr)
+        placements.append([start, start + sound.shape[1], sound, sound_volumes[i]])
+
+    total = max(end for _, end, _, _ in placements)
+    block_size = round(block_duration * sr)
+    for block_start in range(0, total, block_size):
+        block_end = min(block_start + block_size, total)
+        block = np.zeros((block_end - block_start, channels), dtype=np.float32)
+        for start, end, sound, volume in placements:
+            if start >= block_end or end <= block_start:
+                continue
+            from_sample, to_sample = max(start, block_start), min(end, block_end)
+            block[from_sample - block_start:to_sample - block_start] += \
+                volume * sound[:, from_sample - start:to_sample - start].T
+        yield block.tobytes()
 
 
 def remove_silence_from_audio_file(input_path: str, output_path: str, audio_format: str = 'wav',
@@ -99,7 +294,9 @@ def remove_silence_from_audio_file(input_path: str, output_path: str, audio_form
     Returns:
         str: output_path
     """
-    sound = AudioSegment.from_file(input_path, format=audio_format)
+    samples, sr = load_audio(input_path, mono=False)
+    samples = (np.clip(samples.T, -1, 1) * 32767).astype(np.int16)
+    sound = AudioSegment(samples.tobytes(), sample_width=2, frame_rate=sr, channels=samples.shape[1])
     audio_chunks = split_on_silence(sound, min_silence_len=min_silence_len, silence_thresh=silence_thresh,
                                     keep_silence=keep_silence)
     combined = AudioSegment.empty()
@@ -115,7 +312,7 @@ def delete_neighbors(input_list):
     input_list.sort()
     output_list = [input_list[0]]
     for i in range(1, len(input_list)):
-        if input_list[i] - output_list[-1] >= C_TIME_AMONG_NEIGHBOUR_PEAKS:
+        if input_list[i] - output_list[-1] >= settings.C_TIME_AMONG_NEIGHBOUR_PEAKS:
             output_list.append(input_list[i])
     return output_list
 
@@ -139,12 +336,13 @@ def find_offsets(within_file: str, find_file: str, multiplier: float, window: in
         list: list of time codes
     """
 
-    y_within, sr_within = librosa.load(within_file, sr=None)
-    y_find, _ = librosa.load(find_file, sr=sr_within)
+    y_within, sr_within = load_cached_audio(within_file)
+    # Only the first window seconds of find_file are correlated
+    y_find, _ = load_audio(find_file, sr=sr_within, duration=window)
     c = signal.correlate(y_within, y_find[:sr_within * window], mode='valid', method='fft')
     if number is not None and number < 1:
         print_info(f'Number of peaks you are looking for is {number}. Returning empty list.', 'red',
-                   C_TO_PRINT_PACKAGE_INFO)
+                   settings.C_TO_PRINT_PACKAGE_INFO)
         return []
 
     elif number == 1:
@@ -164,14 +362,14 @@ def find_offsets(within_file: str, find_file: str, multiplier: float, window: in
                 if to_print_plots:
                     plot_offsets(c, find_file)
                 if counter > max_tries_number:
-                    if C_TO_PRINT_PACKAGE_INFO: print(
+                    if settings.C_TO_PRINT_PACKAGE_INFO: print(
                         f'Max try number reached. Returning the last time codes. {points_of_time}')
                     return points_of_time
                 if number and number != len(points_of_time):
                     print_info(
                         f'Try number № {counter}. Looking for peaks. The goal number is {number}, the number we got is {len(points_of_time)}. Prominence: {prominence}',
-                        'white', C_TO_PRINT_PACKAGE_INFO)
-                    if C_TO_PRINT_PACKAGE_INFO: print_info(f'Time codes we got: {points_of_time}', 'white')
+                        'white', settings.C_TO_PRINT_PACKAGE_INFO)
+                    if settings.C_TO_PRINT_PACKAGE_INFO: print_info(f'Time codes we got: {points_of_time}', 'white')
                     if number > len(points_of_time):
                         diff = number - len(points_of_time)
                         prominence *= 0.80 if diff > 5 else 0.95
@@ -180,7 +378,7 @@ def find_offsets(within_file: str, find_file: str, multiplier: float, window: in
                     counter += 1
                     continue
                 print_info(f'Found specified number={number}. Offsets: {points_of_time}', 'white',
-                           C_TO_PRINT_PACKAGE_INFO)
+                           settings.C_TO_PRINT_PACKAGE_INFO)
                 return points_of_time
             except IndexError:
                 prominence *= 0.8
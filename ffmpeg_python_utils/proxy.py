@@ -0,0 +1,169 @@
+import hashlib
+import inspect
+import os
+from pathlib import Path
+from .config import settings
+from .inc import print_info, get_file_fingerprint, get_temp_path_near
+from .main import process, run_command, get_video_info
+
+SCALED_X_Y_ARGUMENTS = {'x_y_coordinates', 'x_y_coordinate', 'sizes', 'size', 'goal_sizes', 'goal_size',
+                        'img_goal_sizes'}
+"""Arguments with [x, y] or [w, h] pairs (or lists of them) which are scaled to the proxy."""
+SCALED_EVEN_ARGUMENTS = {'sizes', 'size', 'goal_sizes', 'goal_size', 'img_goal_sizes'}
+"""Sizes are rounded to even numbers, yuv420p can't have odd ones."""
+SCALED_HEIGHT_ARGUMENTS = {'font_sizes', 'border_width', 'sigma'}
+"""Arguments with one number or a list of numbers which are scaled like heights."""
+
+
+@process
+def get_proxy_video(input_video_path: str, height: int = None) -> str:
+    """
+    Makes a low resolution copy of a video, encoded with the fastest preset. Proxies are cached in C_CACHE_DIR/proxies
+    by fingerprint of the source, so each source is converted only once.
+
+    Args:
+        input_video_path (str): The path to the input video file.
+        height (int, optional): The height of the proxy, C_PROXY_HEIGHT by default.
+
+    Returns:
+        str: The path to the proxy. The source itself if it is not higher than height.
+    """
+    height = height or settings.C_PROXY_HEIGHT
+    video_info = get_video_info(input_video_path)
+    if video_info['height'] <= height:
+        return input_video_path
+    key = hashlib.sha256(f'{get_file_fingerprint(input_video_path)}-{height}'.encode()).hexdigest()[:16]
+    proxy_path = os.path.join(settings.C_CACHE_DIR, 'proxies', f'{Path(input_video_path).stem}_{key}_{height}p.mkv')
+    if os.path.exists(proxy_path):
+        return proxy_path
+
+    os.makedirs(os.path.dirname(proxy_path), exist_ok=True)
+    temp_path = get_temp_path_near(proxy_path)
+    try:
+        cmd = f'ffmpeg -y -i "{input_video_path}" -map 0:v:0 -map 0:a? -vf scale=-2:{height} ' \
+              f'-c:v libx264 -preset ultrafast -crf 28 -c:a copy "{temp_path}"'
+        run_command(cmd)
+        os.replace(temp_path, proxy_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return proxy_path
+
+
+def scale_arguments(arguments: dict, x_ratio: float, y_ratio: float) -> dict:
+    """
+    Scales pixel arguments (coordinates, sizes, font sizes, border width) to another resolution. Numbers can be ints,
+    floats or strings like '1280'. ffmpeg expressions like 'iw/2' or '(w-text_w)/2' and automatic sizes (-1, -2) are
+    kept, since they are relative already.
+
+    Args:
+        arguments (dict): Arguments of a function from main.
+        x_ratio (float): New width / old width.
+        y_ratio (float): New height / old height.
+
+    Returns:
+        dict: Scaled copy of arguments.
+    """
+    def scale(value, ratio, to_even=False):
+        number = value
+        if isinstance(value, str):
+            try:
+                number = float(value)
+            except ValueError:
+                return value
+        if not isinstance(number, (int, float)) or isinstance(number, bool) or number == -1 or \
+                (to_even and number < 0):
+            return value
+        if to_even:
+            scaled_number = max(round(number * ratio / 2) * 2, 2) if number else 0
+        else:
+            is_integer = isinstance(value, int) or (isinstance(value, str) and value.strip().lstrip('-').isdigit())
+            scaled_number = round(number * ratio) if is_integer else number * ratio
+        # Strings stay strings, so the command gets the same kind of value
+        return str(scaled_number) if isinstance(value, str) else scaled_number
+
+    def scale_pair(pair, to_even):
+        return [scale(pair[0], x_ratio, to_even), scale(pair[1], y_ratio, to_even)] + list(pair[2:])
+
+    scaled = dict(arguments)
+    for name, value in arguments.items():
+        if value is None:
+            continue
+        if name in SCALED_X_Y_ARGUMENTS:
+            to_even = name in SCALED_EVEN_ARGUMENTS
+            if value and isinstance(value[0], (list, tuple)):
+                scaled[name] = [scale_pair(pair, to_even) for pair in value]
+            else:
+                scaled[name] = scale_pair(value, to_even)
+        elif name in SCALED_HEIGHT_ARGUMENTS:
+            scaled[name] = [scale(v, y_ratio) for v in value] if isinstance(value, list) else scale(value, y_ratio)
+    return scaled
+
+
+def get_preview_path(output_path: str) -> str:
+    path = Path(output_path)
+    return str(path.with_name(f'{path.stem}_preview{path.suffix}'))
+
+
+def render_calls(calls: list, to_preview: bool = False, height: int = None) -> list[str]:
+    """
+    Runs a list of calls of functions from main. With to_preview=True, each source is replaced with its cached proxy,
+    pixel arguments are scaled to it, and outputs are saved with '_preview' added to their names. If a call uses the
+    output of a previous call, it gets that preview. Then the same list is run with to_preview=False for the final render.
+
+    Usage:
+        calls = [(add_text_to_video, {'input_video_path': 'in.mp4', 'output_path': 'texts.mp4', ...}),
+                 (add_image_to_video, {'input_video_path': 'texts.mp4', 'output_path': 'final.mp4', ...})]
+        render_calls(calls, to_preview=True)  # seconds, check 'final_preview.mp4'
+        render_calls(calls)  # the final render
+
+    Args:
+        calls (list): List of (function, kwargs) of functions taking a video as the first argument. With to_preview,
+            it should be one path, not a list (like of get_concantenated_videos). A config in kwargs applies to the
+            call and its proxy.
+        to_preview (bool, optional): Whether to render previews against proxies.
+        height (int, optional): The height of proxies, C_PROXY_HEIGHT by default.
+
+    Returns:
+        list[str]: Paths to the outputs of calls.
+    """
+    outputs = []
+    # Original output path -> [preview path, width and height of the original]
+    previews = {}
+    for function, kwargs in calls:
+        # config is taken by process, the function itself doesn't have it
+        kwargs = dict(kwargs)
+        config = kwargs.pop('config', None)
+        config_kwargs = {'config': config} if config is not None else {}
+        bound_arguments = inspect.signature(function).bind(**kwargs)
+        bound_arguments.apply_defaults()
+        arguments = dict(bound_arguments.arguments)
+        if not to_preview:
+            outputs.append(function(**arguments, **config_kwargs))
+            continue
+        input_name = list(arguments)[0]
+        input_video_path = arguments[input_name]
+        if not isinstance(input_video_path, str):
+            raise ValueError(f'Previews need one video file as the first argument, {function.__name__} got '
+                             f'{input_name}={input_video_path!r}. Render such calls with to_preview=False.')
+        if input_video_path in previews:
+            preview_input_path, original_size = previews[input_video_path]
+        else:
+            video_info = get_video_info(input_video_path)
+            preview_input_path = get_proxy_video(input_video_path, height, **config_kwargs)
+            original_size = [video_info['width'], video_info['height']]
+        preview_info = get_video_info(preview_input_path)
+        x_ratio, y_ratio = preview_info['width'] / original_size[0], preview_info['height'] / original_size[1]
+        arguments = scale_arguments(arguments, x_ratio, y_ratio)
+        arguments[input_name] = preview_input_path
+        output_path = arguments.get('output_path')
+        if output_path:
+            arguments['output_path'] = get_preview_path(output_path)
+        print_info(f'Previewing {function.__name__} on {preview_input_path}', to_print=settings.C_TO_PRINT_PACKAGE_INFO)
+        outputs.append(function(**arguments, **config_kwargs))
+        if output_path:
+            # The function could change the size (e.g. add space around), so the original size is estimated back
+            output_info = get_video_info(arguments['output_path'])
+            previews[output_path] = [arguments['output_path'],
+                                     [output_info['width'] / x_ratio, output_info['height'] / y_ratio]]
+    return outputs
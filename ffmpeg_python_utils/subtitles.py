@@ -0,0 +1,181 @@
+import os
+import re
+import shutil
+import struct
+from pathlib import Path
+
+FFMPEG_COLORS = {
+    'black': '000000', 'white': 'FFFFFF', 'red': 'FF0000', 'green': '008000', 'blue': '0000FF',
+    'yellow': 'FFFF00', 'cyan': '00FFFF', 'aqua': '00FFFF', 'magenta': 'FF00FF', 'fuchsia': 'FF00FF',
+    'gray': '808080', 'grey': '808080', 'silver': 'C0C0C0', 'maroon': '800000', 'olive': '808000',
+    'lime': '00FF00', 'teal': '008080', 'navy': '000080', 'purple': '800080', 'orange': 'FFA500',
+    'pink': 'FFC0CB', 'brown': 'A52A2A', 'gold': 'FFD700', 'violet': 'EE82EE', 'indigo': '4B0082',
+    'darkgray': 'A9A9A9', 'darkgrey': 'A9A9A9', 'lightgray': 'D3D3D3', 'lightgrey': 'D3D3D3',
+    'darkred': '8B0000', 'darkgreen': '006400', 'darkblue': '00008B', 'lightblue': 'ADD8E6',
+    'lightgreen': '90EE90', 'lightyellow': 'FFFFE0',
+}
+"""ffmpeg color names which can be converted to ASS colors. Other names are rendered by drawtext."""
+
+ASS_HEADER = '''[Script Info]
+ScriptType: v4.00+
+PlayResX: {width}
+PlayResY: {height}
+ScaledBorderAndShadow: yes
+WrapStyle: 2
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+{styles}
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+{events}
+'''
+
+
+def is_number(value) -> bool:
+    return isinstance(value, (int, float)) or \
+        (isinstance(value, str) and re.fullmatch(r'-?\d+(\.\d+)?', value) is not None)
+
+
+def convert_color_to_ass(color: str) -> str:
+    """
+    Converts an ffmpeg color ('red', 'FFFFFF', '0xFFFFFF', '#FFFFFF', optionally with '@0.5' alpha) to ASS &HAABBGGRR.
+
+    Args:
+        color (str): ffmpeg color.
+
+    Returns:
+        str: ASS color.
+
+    Raises:
+        ValueError: If the color can't be converted.
+    """
+    color, _, alpha = str(color).partition('@')
+    rgb = FFMPEG_COLORS.get(color.lower(), re.sub(r'^(0x|#)', '', color))
+    if not re.fullmatch(r'[0-9a-fA-F]{6}', rgb):
+        raise ValueError(f'Color {color} can not be converted to ASS')
+    transparency = round((1 - float(alpha)) * 255) if alpha else 0
+    return f'&H{transparency:02X}{rgb[4:6]}{rgb[2:4]}{rgb[0:2]}'.upper()
+
+
+def is_ass_compatible(x_y_coordinates: list[list], font_colors: list[str], border_color: str) -> bool:
+    """
+    Checks if texts can be rendered by the ASS backend: coordinates should be numbers (not ffmpeg expressions)
+    and colors should be known.
+    """
+    if not all(is_number(x) and is_number(y) for x, y in x_y_coordinates):
+        return False
+    try:
+        [convert_color_to_ass(color) for color in font_colors + ([border_color] if border_color else [])]
+    except ValueError:
+        return False
+    return True
+
+
+def get_font_info(font_path: str) -> dict:
+    """
+    Reads the family name and vertical metrics of a TrueType/OpenType font.
+    libass sizes fonts by (win ascent + win descent) while drawtext sizes them by em, so the ratio is needed
+    to render texts of the same size. If the font can't be parsed, the file name and ratio 1 are returned.
+
+    Args:
+        font_path (str): Path to the .ttf/.otf font.
+
+    Returns:
+        dict: {'family': str, 'size_ratio': float}
+    """
+    info = {'family': Path(font_path).stem, 'size_ratio': 1.0}
+    try:
+        with open(font_path, 'rb') as file:
+            data = file.read()
+        tables = {}
+        for i in range(struct.unpack('>H', data[4:6])[0]):
+            tag, _, offset, _ = struct.unpack('>4sIII', data[12 + 16 * i:28 + 16 * i])
+            tables[tag] = offset
+        units_per_em = struct.unpack('>H', data[tables[b'head'] + 18:tables[b'head'] + 20])[0]
+        win_ascent, win_descent = struct.unpack('>HH', data[tables[b'OS/2'] + 74:tables[b'OS/2'] + 78])
+        if units_per_em and win_ascent + win_descent:
+            info['size_ratio'] = (win_ascent + win_descent) / units_per_em
+
+        name_offset = tables[b'name']
+        count, strings_offset = struct.unpack('>HH', data[name_offset + 2:name_offset + 6])
+        for i in range(count):
+            platform_id, _, _, name_id, length, offset = struct.unpack(
+                '>HHHHHH', data[name_offset + 6 + 12 * i:name_offset + 18 + 12 * i])
+            if name_id != 1:
+                continue
+            raw = data[name_offset + strings_offset + offset:name_offset + strings_offset + offset + length]
+            info['family'] = raw.decode('utf-16-be' if platform_id in (0, 3) else 'latin-1')
+            if platform_id == 3:
+                break
+    except (OSError, KeyError, struct.error, UnicodeDecodeError):
+        pass
+    return info
+
+
+def unescape_font_path(font_path: str) -> str:
+    # Font paths for drawtext are escaped like "C\:\\\\Windows\\\\Fonts\\\\Arial.ttf", here we need the real path
+    return font_path if os.path.exists(font_path) else re.sub(r'\\(.)', r'\1', font_path)
+
+
+def convert_time_to_ass(seconds: float) -> str:
+    centiseconds = round(seconds * 100)
+    return f'{centiseconds // 360000}:{centiseconds // 6000 % 60:02d}:{centiseconds // 100 % 60:02d}.' \
+           f'{centiseconds % 100:02d}'
+
+
+def escape_ass_text(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('{', '\\{').replace('}', '\\}').replace('\n', '\\N')
+
+
+def save_ass_script(output_dir: str, width: int, height: int, texts: list[str], fonts_paths: list[str],
+                    font_sizes: list[int], font_colors: list[str], start_times: list[float], durations: list[float],
+                    x_y_coordinates: list[list], fade_duration: float = 0, border_color: str = 'black',
+                    border_width: int = 5) -> tuple[str, str]:
+    """
+    Compiles texts into one ASS script, matching what add_text_to_video renders with drawtext:
+    the top left corner of each text is at [x, y], fades are linear, borders are outlines.
+    Fonts are copied to one folder for the fontsdir option of the ass filter.
+
+    Args:
+        output_dir (str): Folder to save the script and fonts in.
+        width (int): Width of the video.
+        height (int): Height of the video.
+        Other arguments are the same as in add_text_to_video, lists should be of equal length.
+
+    Returns:
+        tuple[str, str]: Path to the script and to the fonts folder.
+    """
+    fonts_dir = os.path.join(output_dir, 'fonts')
+    os.makedirs(fonts_dir, exist_ok=True)
+    fonts_info = {}
+    for font_path in set(fonts_paths):
+        fonts_info[font_path] = get_font_info(unescape_font_path(font_path))
+        shutil.copy(unescape_font_path(font_path), fonts_dir)
+
+    outline_color = convert_color_to_ass(border_color) if border_color else '&H00000000'
+    styles = {}
+    events = []
+    for i in range(len(texts)):
+        font_info = fonts_info[fonts_paths[i]]
+        style_key = (font_info['family'], round(font_sizes[i] * font_info['size_ratio'], 2),
+                     convert_color_to_ass(font_colors[i]))
+        if style_key not in styles:
+            styles[style_key] = f'Style{len(styles)}'
+        fade_str = ''
+        if fade_duration:
+            fade_ms = round(min(fade_duration, durations[i] / 2) * 1000)
+            fade_str = f'\\fad({fade_ms},{fade_ms})'
+        events.append(f'Dialogue: 0,{convert_time_to_ass(start_times[i])},'
+                      f'{convert_time_to_ass(start_times[i] + durations[i])},{styles[style_key]},,0,0,0,,'
+                      f'{{\\pos({x_y_coordinates[i][0]},{x_y_coordinates[i][1]}){fade_str}}}'
+                      f'{escape_ass_text(str(texts[i]))}')
+
+    styles_str = '\n'.join(
+        f'Style: {name},{family},{size},{color},{color},{outline_color},&H00000000,0,0,0,0,100,100,0,0,1,'
+        f'{border_width or 0},0,7,0,0,0,1' for (family, size, color), name in styles.items())
+    script_path = os.path.join(output_dir, 'texts.ass')
+    with open(script_path, 'w', encoding='utf-8') as file:
+        file.write(ASS_HEADER.format(width=width, height=height, styles=styles_str, events='\n'.join(events)))
+    return script_path, fonts_dir
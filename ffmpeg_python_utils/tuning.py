@@ -0,0 +1,136 @@
+import json
+import os
+import time
+from .config import settings, current_config
+from .graph import FilterGraph, Filter, escape_filter_value
+from .inc import print_info, get_codec_meeting_constraints, temp_workspace, get_temp_path_near, \
+    save_string_return_output, locked_file
+from .main import process, run_command, get_video_info
+
+
+def get_sample_quality(input_video_path: str, sample_path: str, start: float, duration: float) -> list[float]:
+    # Mean SSIM and PSNR of an encoded sample against the same segment of the source. ssim passes the sample frames
+    # with its metadata to psnr, so both are printed by one metadata filter.
+    graph = FilterGraph()
+    reference = graph.add_input(input_video_path, f'-ss {start} -t {duration}')
+    sample = graph.add_input(sample_path)
+    reference_1, reference_2 = graph.add_chain([f'{reference}:v:0'], [Filter('split')], outputs=2, prefix='ref')
+    with_ssim = graph.add_chain([f'{sample}:v:0', reference_1], [Filter('ssim')], prefix='ssim')
+    graph.add_output(graph.add_chain([with_ssim, reference_2], [
+        Filter('psnr'), Filter('metadata', mode='print', file=escape_filter_value('pipe:1'))], prefix='psnr'))
+    graph.optimize()
+    cmd = f'ffmpeg {graph.get_inputs_str()} {graph.get_maps_str()} -f null -'
+    ssims, psnrs = [], []
+    for line in run_command(cmd, graph).decode().splitlines():
+        if line.startswith('lavfi.ssim.All='):
+            ssims.append(float(line.split('=')[1]))
+        elif line.startswith('lavfi.psnr.psnr_avg='):
+            psnrs.append(float(line.split('=')[1]))
+    if not ssims or not psnrs:
+        raise ValueError(f'No SSIM or PSNR of {sample_path} was printed by ffmpeg, the sample may have no frames.')
+    return [sum(ssims) / len(ssims), sum(psnrs) / len(psnrs)]
+
+
+def load_tuning_cache(cache_path: str) -> dict:
+    # Choices of get_tuned_codec_settings by key, os.replace makes sure the file is never half-written
+    if not os.path.exists(cache_path):
+        return {}
+    with open(cache_path) as file:
+        return json.load(file)
+
+
+def choose_candidate(results: list[dict], min_speed: float = None, min_ssim: float = None) -> dict:
+    # With a quality floor the cheapest candidate is the fastest one meeting it, with only a speed target it is the
+    # best quality one fast enough. If nothing meets the targets, the closest candidate is taken.
+    meeting = [r for r in results
+               if (min_speed is None or r['speed'] >= min_speed) and (min_ssim is None or r['ssim'] >= min_ssim)]
+    if not meeting:
+        print_info(f'No settings meet speed {min_speed} and SSIM {min_ssim}, taking the closest ones.', 'red', True)
+        if min_ssim is not None:
+            return max(results, key=lambda r: (r['ssim'], r['speed']))
+        return max(results, key=lambda r: (r['speed'], r['ssim']))
+    if min_ssim is not None:
+        return max(meeting, key=lambda r: (r['speed'], -r['size']))
+    return max(meeting, key=lambda r: (r['ssim'], -r['size']))
+
+
+@process
+def get_tuned_codec_settings(input_video_path: str, min_speed: float = None, min_ssim: float = None,
+                             content_class: str = 'default', to_apply: bool = False) -> str:
+    """
+    Chooses encoder settings from C_TUNING_CANDIDATES for a target: a realtime factor (min_speed) or a quality floor
+    (min_ssim). Each candidate encodes C_TUNING_SAMPLES short segments of the source, the time it takes gives the
+    speed, and ssim/psnr against the source give the quality. With min_ssim the fastest candidate meeting the targets
+    is chosen, with only min_speed the best quality one. Choices are cached in C_CACHE_DIR/tuning.json per codec,
+    content class, resolution and target, so similar sources are not tuned again.
+
+    Usage:
+        # Encode at least 4x faster than realtime, in the best quality possible at that speed
+        get_tuned_codec_settings('lecture.mp4', min_speed=4, content_class='screencast', to_apply=True)
+
+    Args:
+        input_video_path (str): The path to a source representing the content class.
+        min_speed (float, optional): Seconds of video encoded per second, 1 is realtime.
+        min_ssim (float, optional): The minimum mean SSIM (0-1) of the samples, like 0.98.
+        content_class (str, optional): Name of the kind of content (like 'screencast' or 'sports') the choice is
+            cached for.
+        to_apply (bool, optional): Whether to put the settings into C_CODEC_SETTINGS of the current Config, so
+            the rest of the `with Config(...)` block uses them. Outside of a block it raises a ValueError, the
+            defaults are shared by all threads. Settings for one call are passed as
+            config=Config(C_CODEC_SETTINGS={**settings.C_CODEC_SETTINGS, codec: chosen}) instead.
+
+    Returns:
+        str: The chosen settings, like '-c:v libx264 -preset veryfast -crf 20'.
+    """
+    if min_speed is None and min_ssim is None:
+        raise ValueError('Set min_speed, min_ssim or both.')
+    # Only an entered Config has a token. The default one is shared by every thread and Config.
+    if to_apply and current_config.get().token is None:
+        raise ValueError('to_apply needs a `with Config(...)` block to put the settings into, the defaults are '
+                         'never changed.')
+    video_info = get_video_info(input_video_path)
+    size = [video_info['width'], video_info['height']]
+    codec_to_use = get_codec_meeting_constraints(size)
+    key = f'{codec_to_use}|{content_class}|{size[0]}x{size[1]}|speed {min_speed}|ssim {min_ssim}'
+
+    cache_path = os.path.join(settings.C_CACHE_DIR, 'tuning.json')
+    chosen = load_tuning_cache(cache_path).get(key)
+    if chosen is None:
+        # Samples are spread evenly over the video
+        duration = min(settings.C_TUNING_SAMPLE_DURATION, video_info['duration'])
+        starts = [round((video_info['duration'] - duration) * (i + 1) / (settings.C_TUNING_SAMPLES + 1), 3)
+                  for i in range(settings.C_TUNING_SAMPLES)]
+        results = []
+        with temp_workspace() as workspace:
+            for candidate in settings.C_TUNING_CANDIDATES[codec_to_use]:
+                encoding_time, size_in_bytes, qualities = 0, 0, []
+                for i, start in enumerate(starts):
+                    sample_path = os.path.join(workspace, f'sample_{i}.mp4')
+                    cmd = f'ffmpeg -y -ss {start} -t {duration} -i "{input_video_path}" -map 0:v:0 {candidate} ' \
+                          f'"{sample_path}"'
+                    start_time = time.perf_counter()
+                    run_command(cmd)
+                    encoding_time += time.perf_counter() - start_time
+                    size_in_bytes += os.path.getsize(sample_path)
+                    qualities.append(get_sample_quality(input_video_path, sample_path, start, duration))
+                results.append({'settings': candidate, 'speed': duration * len(starts) / encoding_time,
+                                'ssim': sum(q[0] for q in qualities) / len(qualities),
+                                'psnr': sum(q[1] for q in qualities) / len(qualities), 'size': size_in_bytes})
+                print_info(f'Tuning: {results[-1]}', to_print=settings.C_TO_PRINT_PACKAGE_INFO)
+        chosen = choose_candidate(results, min_speed, min_ssim)
+        # Other processes may have tuned other keys meanwhile, the cache is read again under the lock
+        os.makedirs(settings.C_CACHE_DIR, exist_ok=True)
+        with locked_file(cache_path):
+            cache = load_tuning_cache(cache_path)
+            cache[key] = chosen
+            temp_path = get_temp_path_near(cache_path)
+            save_string_return_output(json.dumps(cache, indent=4), temp_path)
+            os.replace(temp_path, cache_path)
+
+    print_info(f'Tuned settings for {key}: {chosen}', 'green', settings.C_TO_PRINT_PACKAGE_INFO)
+    if to_apply:
+        # The entered Config is a copy made for this block, so the settings leave with it. The dict is shared by
+        # the module and Configs, the Config gets a changed copy.
+        current_config.get().overrides['C_CODEC_SETTINGS'] = {**settings.C_CODEC_SETTINGS,
+                                                              codec_to_use: chosen['settings']}
+    return chosen['settings']
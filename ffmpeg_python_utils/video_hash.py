@@ -0,0 +1,198 @@
+import os
+import sqlite3
+import numpy as np
+from .config import settings
+from .inc import print_info, get_file_fingerprint
+from .main import run_command
+
+FRAME_SIZE = 32
+"""Frames are decoded as FRAME_SIZE x FRAME_SIZE grayscale, the DCT of it gives the hash."""
+HASH_SIZE = 8
+"""The lowest HASH_SIZE x HASH_SIZE DCT frequencies make the 64 bits of a hash."""
+BANDS = 4
+"""Hashes are split into this number of 16-bit bands, each is indexed by sqlite (multi-index hashing)."""
+FLAT_FRAME_STD = 4
+"""Frames with a smaller standard deviation (black, single color) are skipped, they match each other anyway."""
+
+# Rows of the orthonormal DCT-II matrix for the frequencies kept in the hash
+DCT_MATRIX = np.sqrt(2 / FRAME_SIZE) * np.cos(
+    np.pi * np.outer(np.arange(HASH_SIZE), 2 * np.arange(FRAME_SIZE) + 1) / (2 * FRAME_SIZE))
+DCT_MATRIX[0] /= np.sqrt(2)
+
+
+def get_perceptual_hashes(input_video_path: str, fps: float = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Computes 64-bit perceptual (DCT) hashes of a video. ffmpeg decodes a few frames per second, downscaled to
+    32x32 grayscale, in one pass and pipes them raw into a NumPy array. Each bit of a hash tells whether a low
+    frequency of the frame is above the median, so hashes survive re-encoding, rescaling and small color changes.
+
+    Args:
+        input_video_path (str): The path to the input video file.
+        fps (float, optional): How many frames per second are hashed, C_VIDEO_HASH_FPS by default.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Hashes (int64, the bits of uint64) and times of their frames in seconds.
+            Flat frames are skipped.
+    """
+    fps = fps or settings.C_VIDEO_HASH_FPS
+    cmd = f'ffmpeg -i "{input_video_path}" -an -sn -vf fps={fps},scale={FRAME_SIZE}:{FRAME_SIZE}:flags=area,' \
+          f'format=gray -f rawvideo "pipe:1"'
+    frames = np.frombuffer(run_command(cmd), dtype=np.uint8).reshape(-1, FRAME_SIZE, FRAME_SIZE).astype(np.float64)
+    times = np.arange(len(frames)) / fps
+    not_flat = frames.std(axis=(1, 2)) >= FLAT_FRAME_STD
+    frames, times = frames[not_flat], times[not_flat]
+
+    coefficients = (DCT_MATRIX @ frames @ DCT_MATRIX.T).reshape(-1, HASH_SIZE * HASH_SIZE)
+    # The DC coefficient is the mean brightness, it does not take part in the median
+    bits = coefficients > np.median(coefficients[:, 1:], axis=1, keepdims=True)
+    hashes = np.packbits(bits, axis=1).view('>u8').ravel().astype(np.uint64).view(np.int64)
+    return hashes, times
+
+
+def get_hamming_distances(hashes: np.ndarray, other_hashes: np.ndarray) -> np.ndarray:
+    # Number of different bits of pairs of hashes
+    xor = (np.asarray(hashes, dtype=np.int64) ^ np.asarray(other_hashes, dtype=np.int64)).view(np.uint8)
+    return np.unpackbits(xor).reshape(-1, 64).sum(axis=1)
+
+
+def get_bands(hashes: np.ndarray) -> np.ndarray:
+    # (n, BANDS) array of 16-bit parts of hashes
+    return np.stack([(hashes.view(np.uint64) >> np.uint64(16 * i)) & np.uint64(0xFFFF) for i in range(BANDS)],
+                    axis=1).astype(np.int64)
+
+
+def get_band_variants(band: int, radius: int) -> list[int]:
+    # All 16-bit values within Hamming distance radius of band
+    variants = [band]
+    for _ in range(radius):
+        variants = list({v ^ (1 << bit) for v in variants for bit in range(16)} | set(variants))
+    return variants
+
+
+class VideoHashIndex:
+    """
+    On-disk index of perceptual hashes for finding near-duplicate videos (the same footage re-encoded, rescaled or
+    renamed) before spending render time on them. Frame hashes are split into 16-bit bands indexed by sqlite. Two
+    hashes within Hamming distance d share a band within distance d // BANDS, so a query looks up only those band
+    values (multi-index hashing) instead of comparing with every indexed frame.
+
+    Usage:
+        with VideoHashIndex() as index:
+            index.add(['library/a.mp4', 'library/b.mp4'])
+            duplicates = index.find('upload.mp4')  # {'library/a.mp4': 0.97}
+            if not duplicates:
+                index.add(['upload.mp4'])
+
+    Args:
+        index_path (str, optional): Path to the sqlite file. By default, 'video_hashes.sqlite' in C_CACHE_DIR.
+    """
+
+    def __init__(self, index_path: str = None):
+        self.index_path = index_path or os.path.join(settings.C_CACHE_DIR, 'video_hashes.sqlite')
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.index_path)
+        bands_str = ', '.join(f'band_{i} INTEGER' for i in range(BANDS))
+        indexes_str = '\n'.join(f'CREATE INDEX IF NOT EXISTS frames_by_band_{i} ON frames (band_{i});'
+                                for i in range(BANDS))
+        self.connection.executescript(f'''
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS videos (id INTEGER PRIMARY KEY, path TEXT UNIQUE, fingerprint TEXT,
+                                               frames INTEGER);
+            CREATE TABLE IF NOT EXISTS frames (video_id INTEGER, time REAL, hash INTEGER, {bands_str});
+            CREATE INDEX IF NOT EXISTS frames_by_video ON frames (video_id);
+            {indexes_str}
+        ''')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def add(self, input_paths: list[str]) -> list[str]:
+        """
+        Adds videos to the index. Already indexed videos are skipped, changed ones are indexed again.
+
+        Args:
+            input_paths (list[str]): Paths to video files.
+
+        Returns:
+            list[str]: Paths which were (re)indexed.
+        """
+        indexed = []
+        for input_path in input_paths:
+            path = os.path.abspath(input_path)
+            fingerprint = get_file_fingerprint(path)
+            row = self.connection.execute('SELECT id, fingerprint FROM videos WHERE path = ?', (path,)).fetchone()
+            if row and row[1] == fingerprint:
+                continue
+            print_info(f'Indexing perceptual hashes of {path}', to_print=settings.C_TO_PRINT_PACKAGE_INFO)
+            hashes, times = get_perceptual_hashes(path)
+            with self.connection:
+                if row:
+                    self.connection.execute('DELETE FROM frames WHERE video_id = ?', (row[0],))
+                    self.connection.execute('DELETE FROM videos WHERE id = ?', (row[0],))
+                video_id = self.connection.execute(
+                    'INSERT INTO videos (path, fingerprint, frames) VALUES (?, ?, ?)',
+                    (path, fingerprint, len(hashes))).lastrowid
+                self.connection.executemany(
+                    f'INSERT INTO frames VALUES (?, ?, ?{", ?" * BANDS})',
+                    ([video_id, t, h, *bands] for t, h, bands in
+                     zip(times.tolist(), hashes.tolist(), get_bands(hashes).tolist())))
+            indexed.append(input_path)
+        return indexed
+
+    def remove(self, input_path: str):
+        """Removes a video from the index."""
+        path = os.path.abspath(input_path)
+        with self.connection:
+            self.connection.execute('DELETE FROM frames WHERE video_id IN '
+                                    '(SELECT id FROM videos WHERE path = ?)', (path,))
+            self.connection.execute('DELETE FROM videos WHERE path = ?', (path,))
+
+    def find(self, input_video_path: str, max_distance: int = None, min_similarity: float = None) -> dict:
+        """
+        Finds indexed videos which are near-duplicates of a video. The video itself is not added.
+
+        Args:
+            input_video_path (str): The path to the video to check.
+            max_distance (int, optional): Maximum Hamming distance (of 64 bits) of hashes of matching frames.
+                Lookups get slower when it reaches the next multiple of BANDS. C_VIDEO_HASH_MAX_DISTANCE by default.
+            min_similarity (float, optional): Minimum share of hashed frames of the video which match frames of an
+                indexed video to call it a duplicate. C_VIDEO_HASH_MIN_SIMILARITY by default.
+
+        Returns:
+            dict: {path: similarity} of duplicates, the most similar first. The video itself is left out if indexed.
+        """
+        hashes, _ = get_perceptual_hashes(input_video_path)
+        if not len(hashes):
+            return {}
+        max_distance = settings.C_VIDEO_HASH_MAX_DISTANCE if max_distance is None else max_distance
+        min_similarity = settings.C_VIDEO_HASH_MIN_SIMILARITY if min_similarity is None else min_similarity
+        radius = max_distance // BANDS
+        self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS query (band INTEGER, value INTEGER, frame INTEGER)')
+        self.connection.execute('DELETE FROM query')
+        self.connection.executemany('INSERT INTO query VALUES (?, ?, ?)',
+                                    ([band, variant, frame] for frame, bands in enumerate(get_bands(hashes).tolist())
+                                     for band, value in enumerate(bands)
+                                     for variant in get_band_variants(value, radius)))
+        candidates = np.array(self.connection.execute(' UNION '.join(
+            f'SELECT q.frame, f.video_id, f.hash FROM query q JOIN frames f ON f.band_{i} = q.value '
+            f'WHERE q.band = {i}' for i in range(BANDS))).fetchall(), dtype=np.int64).reshape(-1, 3)
+        # Bands only preselect candidates, the whole hashes are compared
+        candidates = candidates[get_hamming_distances(hashes[candidates[:, 0]], candidates[:, 2]) <= max_distance]
+
+        paths = dict(self.connection.execute('SELECT id, path FROM videos'))
+        duplicates = {}
+        for video_id in np.unique(candidates[:, 1]).tolist():
+            path = paths[video_id]
+            similarity = len(np.unique(candidates[candidates[:, 1] == video_id, 0])) / len(hashes)
+            if similarity >= min_similarity and path != os.path.abspath(input_video_path):
+                duplicates[path] = round(similarity, 3)
+        print_info(f'Found {len(duplicates)} duplicates of {input_video_path}.',
+                   to_print=settings.C_TO_PRINT_PACKAGE_INFO)
+        return dict(sorted(duplicates.items(), key=lambda item: -item[1]))
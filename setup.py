@@ -25,6 +25,8 @@ setup(
     license='MIT License, see LICENSE file',
     packages=['ffmpeg_python_utils'],
     install_requires=['numpy', 'librosa', 'matplotlib', 'pydub', 'scipy'],
+    extras_require={'yaml': ['pyyaml']},
+    entry_points={'console_scripts': ['ffmpeg-python-utils=ffmpeg_python_utils.cli:main']},
 
     classifiers=[
         "Programming Language :: Python :: 3.10",
@@ -4,7 +4,7 @@ from ffmpeg_python_utils import add_text_to_video, get_subclips_with_sound, add_
     add_blurred_space_around_video, \
     get_cropped_video, add_colored_space_around_video, get_concantenated_videos, get_image_info, \
     get_audio_from_video, get_frame, get_mirrored_video, get_rotated_video, get_video_from_picture, \
-    add_rectangle_to_video, get_resized_image
+    add_rectangle_to_video, get_resized_image, get_jump_cut_video
 
 if __name__ == '__main__':
     input_path = './test/test _uc_berkeley_salto.mp4'
@@ -108,3 +108,7 @@ if __name__ == '__main__':
 
     # Get video from picture
     get_video_from_picture(picture, output_path=output_path + 'video_from_picture.mp4', duration=8)
+
+    # Get video without silent parts
+    get_jump_cut_video(input_path, output_path=output_path + 'jump cut.mp4', min_silence_len=500, silence_thresh=-45,
+                       keep_silence=100)
@@ -0,0 +1,24 @@
+import io
+from ffmpeg_python_utils.analysis import MetadataParser
+
+
+def test_metadata_parser_collects_series_values_and_intervals():
+    results = {'scenes': {}, 'silence': {}, 'loudness': {}}
+    parser = MetadataParser(results)
+    for line in ['frame:0 pts:0 pts_time:0', 'lavfi.scd.score=1.5',
+                 'frame:1 pts:5 pts_time:0.2', 'lavfi.scd.score=12', 'lavfi.scd.time=0.2',
+                 'lavfi.silence_start=-0.01', 'lavfi.silence_end=1.5', 'lavfi.silence_start=3',
+                 'lavfi.r128.M=-20.5', 'lavfi.r128.I=-23', 'lavfi.r128.I=-22']:
+        parser.parse_line(line)
+    assert results == {'scenes': {'scores': [[0, 1.5], [0.2, 12]], 'times': [0.2]},
+                       'silence': {'intervals': [[0, 1.5], [3, None]]},
+                       'loudness': {'momentary': [[0.2, -20.5]], 'integrated': -22}}
+
+
+def test_metadata_parser_skips_other_detectors_and_keeps_errors():
+    results = {'scenes': {}}
+    parser = MetadataParser(results)
+    parser.parse_stream(io.BytesIO(b'frame:0 pts:0 pts_time:0\nlavfi.black_start=1\nlavfi.unknown=2\n'
+                                   b'[error] Invalid data\n\n'))
+    assert results == {'scenes': {}}
+    assert parser.other_lines == ['[error] Invalid data']
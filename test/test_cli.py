@@ -0,0 +1,37 @@
+import os
+from ffmpeg_python_utils.cli import get_dependencies, get_estimate_args, get_outputs, get_job_hash, is_up_to_date
+
+JOBS = [
+    {'id': 'sizes', 'function': 'get_resized_videos', 'after': [],
+     'args': {'input_video_path': 'in.mp4', 'output_paths': ['720.mp4', '360.mp4'], 'sizes': [[1280, 720]]}},
+    {'id': 'texts', 'function': 'add_text_to_video', 'after': [],
+     'args': {'input_video_path': '360.mp4', 'output_path': 'texts.mp4', 'texts': ['Hi', 'Bye']}},
+    {'id': 'joined', 'function': 'get_concantenated_videos', 'after': [],
+     'args': {'input_video_paths': ['intro.mp4', 'texts.mp4'], 'output_path': 'joined.mp4'}},
+]
+
+
+def test_jobs_depend_on_output_paths_of_other_jobs():
+    assert get_dependencies(JOBS) == {'sizes': set(), 'texts': {'sizes'}, 'joined': {'texts'}}
+
+
+def test_estimates_do_not_probe_outputs_of_other_jobs():
+    outputs = get_outputs(JOBS)
+    assert get_estimate_args(JOBS[1], outputs)['input_video_path'] is None
+    assert get_estimate_args(JOBS[2], outputs)['input_video_paths'] == ['intro.mp4', None]
+    assert get_estimate_args(JOBS[0], outputs) == JOBS[0]['args']
+
+
+def test_jobs_with_many_outputs_are_up_to_date(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    job = JOBS[0]
+    state = {'sizes': get_job_hash(job)}
+    for i, path in enumerate(['in.mp4', '720.mp4']):
+        open(path, 'w').close()
+        os.utime(path, (i, i))
+    assert not is_up_to_date(job, state)
+    open('360.mp4', 'w').close()
+    os.utime('360.mp4', (1, 1))
+    assert is_up_to_date(job, state)
+    os.utime('in.mp4', (2, 2))
+    assert not is_up_to_date(job, state)
@@ -0,0 +1,65 @@
+import pytest
+from ffmpeg_python_utils.config import Config
+from ffmpeg_python_utils.graph import FilterGraph, Filter, escape_filter_value
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    with Config(C_TO_PRINT_PACKAGE_INFO=False):
+        yield
+
+
+def test_filter_str():
+    assert str(Filter('scale', 1920, -1)) == 'scale=1920:-1'
+    assert str(Filter('drawbox', x=0, color='red', enable=[1, 2])) == "drawbox=x=0:color=red:enable='between(t,1,2)'"
+    assert Filter('scale=1920:-1') == Filter('scale', 1920, -1)
+
+
+def test_identical_inputs_are_opened_once():
+    graph = FilterGraph()
+    assert graph.add_input('a.mp4') == graph.add_input('a.mp4') == 0
+    assert graph.add_input('a.mp4', '-ss 5') == 1
+    assert graph.add_input('a.mp4', reuse=False) == 2
+
+
+def test_optimize_merges_chains_formats_and_scales():
+    graph = FilterGraph()
+    video = graph.add_chain([f'{graph.add_input("in.mp4")}:v'], [Filter('format', pix_fmts='rgba')])
+    video = graph.add_chain([video], [Filter('drawbox', x=0, y=0, w=10, h=10, color='red')])
+    video = graph.add_chain([video], [Filter('format', pix_fmts='rgba'), Filter('scale', 'iw/2', -1),
+                                      Filter('scale', 1280, 720)])
+    graph.add_output(video)
+    graph.add_output('0:a')
+    graph.optimize()
+    assert str(graph) == '[0:v]format=pix_fmts=rgba,drawbox=x=0:y=0:w=10:h=10:color=red,scale=1280:720[s3]'
+    assert graph.get_maps_str() == '-map "[s3]" -map 0:a'
+
+
+def test_optimize_drops_filters_out_of_duration_and_unused_inputs():
+    graph = FilterGraph()
+    video = f'{graph.add_input("in.mp4")}:v'
+    image = graph.add_chain([f'{graph.add_input("image.png")}'], [Filter('scale', 64, 64)])
+    video = graph.add_chain([video, image], [Filter('overlay', enable=[20, 30])])
+    video = graph.add_chain([video], [Filter('drawbox', color='red', enable=[5, 30])])
+    graph.add_output(video)
+    graph.add_output('0:a')
+    graph.optimize(duration=10)
+    assert str(graph) == "[0:v]drawbox=color=red:enable='between(t,5,30)'[s3]"
+    assert graph.get_inputs_str() == '-i "in.mp4"'
+
+
+def test_video_output_without_filters_maps_only_the_video():
+    graph = FilterGraph()
+    image = graph.add_chain([f'{graph.add_input("image.png", "-loop 1")}'], [Filter('scale', 64, 64)])
+    video = graph.add_chain([f'{graph.add_input("in.mp4")}', image], [Filter('overlay', enable=[20, 30])])
+    graph.add_output(video)
+    graph.add_output('1:a')
+    graph.optimize(duration=10)
+    assert not graph
+    assert graph.get_inputs_str() == '-i "in.mp4"'
+    assert graph.get_maps_str() == '-map 0:v -map 0:a'
+
+
+def test_escape_filter_value():
+    assert escape_filter_value('pipe:1') == 'pipe\\\\:1'
+    assert escape_filter_value('C:\\Fonts\\a,b.ttf') == 'C\\\\:\\\\\\\\Fonts\\\\\\\\a\\,b.ttf'
@@ -0,0 +1,44 @@
+import random
+from ffmpeg_python_utils.inc import merge_intervals, invert_intervals, get_time_buckets
+
+
+def test_merge_intervals_sorts_and_merges_overlapping_and_touching():
+    assert merge_intervals([[5, 6], [1, 3], [2, 4], [4, 4.5]]) == [[1, 4.5], [5, 6]]
+    assert merge_intervals([]) == []
+
+
+def test_invert_intervals():
+    assert invert_intervals([[1, 2], [5, 6]], 10) == [[0, 1], [2, 5], [6, 10]]
+    assert invert_intervals([], 3) == [[0, 3]]
+    assert invert_intervals([[0, 3]], 3) == []
+
+
+def test_invert_intervals_padding_is_clipped_and_merges_kept_parts():
+    assert invert_intervals([[1, 2], [5, 6]], 10, padding=0.25) == [[0, 1.25], [1.75, 5.25], [5.75, 10]]
+    assert invert_intervals([[1, 2], [5, 6]], 10, padding=0.5) == [[0, 10]]
+
+
+def test_get_time_buckets_splits_at_interval_bounds():
+    assert get_time_buckets([[1, 2], [1.5, 4]], 5, 10) == [[0, 1, []], [1, 1.5, [0]], [1.5, 2, [0, 1]], [2, 4, [1]],
+                                                            [4, 5, []]]
+    assert get_time_buckets([], 5, 3) == [[0, 5, []]]
+    assert get_time_buckets([[-1, 9]], 5, 3) == [[0, 5, [0]]]
+
+
+def test_get_time_buckets_joins_the_cheapest_neighbours():
+    assert get_time_buckets([[1, 2], [1.5, 4]], 5, 2) == [[0, 2, [0, 1]], [2, 5, [1]]]
+    assert get_time_buckets([[1, 2], [1.5, 4]], 5, 0) == [[0, 5, [0, 1]]]
+
+
+def test_get_time_buckets_cover_the_duration_with_active_intervals():
+    random.seed(0)
+    for _ in range(200):
+        intervals = [[start, start + random.uniform(0, 5)] for start in
+                     (random.uniform(-1, 20) for _ in range(random.randint(0, 30)))]
+        max_buckets = random.randint(1, 10)
+        buckets = get_time_buckets(intervals, 20, max_buckets)
+        assert len(buckets) <= max_buckets
+        assert buckets[0][0] == 0 and buckets[-1][1] == 20
+        assert all(left[1] == right[0] for left, right in zip(buckets, buckets[1:]))
+        for start, end, active in buckets:
+            assert active == [i for i, (s, e) in enumerate(intervals) if s < end and e > start]
@@ -0,0 +1,144 @@
+import io
+import os
+import re
+import subprocess
+import pytest
+from ffmpeg_python_utils import main
+from ffmpeg_python_utils.config import Config
+from ffmpeg_python_utils.main import Stream, get_chained_video, get_mirrored_video, get_resized_video, \
+    add_text_to_video, get_jump_cut_video, add_audio_to_video, add_video_to_video, get_slideshow_video, \
+    get_piped_command, pipe_ends, PIPE_INPUT, PIPE_OUTPUT
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    with Config(C_TO_PRINT_PACKAGE_INFO=False, C_TO_PRINT_EXECUTION_TIME=False, C_CODEC='cpu'):
+        yield
+
+
+@pytest.fixture
+def filter_graphs():
+    return []
+
+
+@pytest.fixture
+def commands(monkeypatch, filter_graphs):
+    # Runs no ffmpeg. A command reads its piped input and writes the name of its first filter to the piped output.
+    commands = []
+
+    def run_command(cmd, filter_graph=None, input_chunks=None):
+        ends = pipe_ends.get() or [None, None]
+        if ends[0] is not None or ends[1] is not None:
+            cmd = get_piped_command(cmd, ends)
+        commands.append(cmd)
+        filter_graphs.append(str(filter_graph))
+        data = b''
+        if PIPE_INPUT in cmd:
+            while chunk := os.read(ends[0], 1024):
+                data += chunk
+        if PIPE_OUTPUT in cmd:
+            os.write(ends[1], data + re.search(r'\](\w+)', str(filter_graph)).group(1).encode() + b';')
+        elif cmd.startswith('ffmpeg'):
+            with open(re.findall(r'"([^"]*)"', cmd)[-1], 'wb') as file:
+                file.write(cmd.encode())
+        return b''
+
+    monkeypatch.setattr(main, 'run_command', run_command)
+    return commands
+
+
+def test_chained_video_reads_and_writes_streams(commands, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    output = io.BytesIO()
+    result = get_chained_video(Stream(io.BytesIO(b'in;'), 'mpegts'), Stream(output, 'mp4'),
+                               [(get_mirrored_video, {}), (get_resized_video, {'size': [640, 360]})])
+    assert result.target is output
+    assert output.getvalue() == b'in;hflip;scale;'
+    # Stages run at the same time, so their commands may come in any order
+    first, last = sorted(commands, key=lambda cmd: 'libx264' in cmd)
+    assert '-f mpegts -i "pipe:0"' in first and '-c:v rawvideo -c:a pcm_s16le -f nut pipe:1' in first
+    assert '-f nut -i "pipe:0"' in last and '-c:v libx264 -crf 15 -c:a aac -f mp4 "pipe:1"' in last
+    assert '-movflags frag_keyframe+empty_moov' in last
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.fixture
+def video(tmp_path, monkeypatch):
+    # A 10 seconds long video with keyframes every 2 seconds
+    monkeypatch.setattr(main, 'get_video_info', lambda path: {'duration': 10, 'width': 1280, 'height': 720})
+    monkeypatch.setattr(main, 'get_keyframe_times', lambda path: [0, 2, 4, 6, 8])
+    path = tmp_path / 'in.mkv'
+    path.write_bytes(b'video')
+    return str(path)
+
+
+def test_affected_ranges_copy_the_audio_of_rendered_segments(commands, video, tmp_path):
+    add_text_to_video(video, str(tmp_path / 'out.mkv'), ['Hi'], ['font.ttf'], [40], ['white'], [4.5], [1],
+                      [[10, 10]], only_affected_ranges=True)
+    rendered = [cmd for cmd in commands if '_rendered.mkv' in cmd]
+    assert len(rendered) == 1 and '-c:a copy' in rendered[0]
+    assert '-c copy' in commands[-1]
+
+
+def test_affected_ranges_reject_a_stream_output(commands, video):
+    with pytest.raises(ValueError):
+        add_text_to_video(video, Stream(io.BytesIO(), 'mpegts'), ['Hi'], ['font.ttf'], [40], ['white'], [4.5], [1],
+                          [[10, 10]], only_affected_ranges=True)
+
+
+def test_jump_cut_encodes_rendered_segments_like_the_copied_audio(commands, video, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'get_silence_intervals', lambda path, **kwargs: [[4, 5]])
+    monkeypatch.setattr(main, 'get_audio_info', lambda path: {'codec': 'mp3', 'sample_rate': 48000, 'channels': 2})
+    get_jump_cut_video(video, str(tmp_path / 'out.mp4'), keep_silence=0, min_copy_duration=3)
+    # Parts 0-4 and 6-8 are copied between keyframes, 5-6 and 8-10 are rendered
+    segments = [cmd.split('"')[-2].rsplit('_', 1)[-1] for cmd in commands[:-1]]
+    assert segments == ['copied.mkv', 'rendered.mkv', 'copied.mkv', 'rendered.mkv']
+    for cmd in commands[:-1]:
+        assert ('-c:a libmp3lame -ar 48000 -ac 2' in cmd) == ('_rendered.mkv' in cmd)
+    assert '-f concat' in commands[-1] and '-c copy' in commands[-1]
+
+
+def test_placements_of_the_same_file_read_their_own_inputs(commands, video, tmp_path):
+    add_audio_to_video(video, str(tmp_path / 'out.mp4'), [video, video], [1], [0, 5])
+    assert commands[-1].count(f'-i "{video}"') == 3
+    add_video_to_video(video, str(tmp_path / 'out.mp4'), [video, video], [[320, 180]], [[0, 0]], [0, 5], [2])
+    assert commands[-1].count(f'-i "{video}"') == 3
+
+
+def test_audio_tracks_keep_amix_normalization_and_end_times_without_premix(commands, filter_graphs, video, tmp_path):
+    add_audio_to_video(video, str(tmp_path / 'out.mp4'), [video], [0.5], [2], [6])
+    graph = filter_graphs[-1]
+    assert graph.index('adelay') < graph.index('atrim=start=0:duration=6')
+    assert 'normalize' not in graph
+
+
+def test_many_texts_are_drawn_by_drawtext_by_default(commands, filter_graphs, video, tmp_path):
+    texts = [f'Text {i}' for i in range(60)]
+    add_text_to_video(video, str(tmp_path / 'out.mp4'), texts, ['font.ttf'], [40], ['white'],
+                      [i / 10 for i in range(60)], [1], [[10, 10]])
+    assert filter_graphs[-1].count('drawtext=') == 60
+
+
+def test_slideshow_of_images_of_different_formats_is_joined_by_filters(commands, filter_graphs, tmp_path):
+    paths = []
+    for name in ['a.jpg', 'b.jpeg', 'c.png']:
+        paths.append(str(tmp_path / name))
+        open(paths[-1], 'w').close()
+    get_slideshow_video(paths[:2], str(tmp_path / 'out.mp4'), [2], size=[640, 360])
+    assert '-f concat' in commands[-1] and '-fps_mode vfr' in commands[-1]
+    get_slideshow_video(paths, str(tmp_path / 'out.mp4'), [2], size=[640, 360])
+    assert '-f concat' not in commands[-1] and commands[-1].count('-loop 1 -framerate 25 -t 2') == 3
+    assert 'concat=n=3:v=1:a=0' in filter_graphs[-1]
+
+
+def test_metrics_record_the_codec_the_command_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(main.subprocess, 'run', lambda cmd, **kwargs: subprocess.CompletedProcess(cmd, 0, b''))
+    records = []
+    monkeypatch.setattr(main, 'record_call', lambda operation, codec, *args: records.append([operation, codec]))
+    path = tmp_path / 'in.mp4'
+    path.write_bytes(b'video')
+    # nvenc can't encode less than 145 pixels, so the cpu encodes it
+    with Config(C_CODEC='nvidia', C_TO_RECORD_METRICS=True):
+        get_resized_video(str(path), str(tmp_path / 'small.mp4'), [100, 100])
+        get_mirrored_video(str(path), str(tmp_path / 'mirrored.mp4'))
+    assert records == [['get_resized_video', 'cpu'], ['get_mirrored_video', 'nvidia']]
@@ -0,0 +1,13 @@
+import os
+from ffmpeg_python_utils.other import get_hash_for_audio
+
+
+def test_audio_hash_is_keyed_by_fingerprint_and_sample_rate(tmp_path):
+    path = tmp_path / 'a.wav'
+    path.write_bytes(b'audio')
+    assert get_hash_for_audio(str(path)) == get_hash_for_audio(str(path))
+    assert get_hash_for_audio(str(path)) != get_hash_for_audio(str(path), sr=8000)
+    hash_before = get_hash_for_audio(str(path))
+    path.write_bytes(b'other')
+    os.utime(path, ns=(0, 0))
+    assert get_hash_for_audio(str(path)) != hash_before
@@ -0,0 +1,23 @@
+from ffmpeg_python_utils.config import Config, settings
+from ffmpeg_python_utils.main import process
+from ffmpeg_python_utils.proxy import render_calls, scale_arguments
+
+
+@process
+def get_codec(input_video_path: str, output_path: str, size: list = None) -> str:
+    return settings.C_CODEC
+
+
+def test_render_calls_pass_the_config_of_a_call(tmp_path):
+    path = tmp_path / 'in.mp4'
+    path.write_bytes(b'video')
+    with Config(C_CODEC='nvidia', C_TO_PRINT_PACKAGE_INFO=False):
+        assert render_calls([(get_codec, {'input_video_path': str(path), 'output_path': 'out.mp4',
+                                          'config': {'C_CODEC': 'cpu'}}),
+                             (get_codec, {'input_video_path': str(path), 'output_path': 'out.mp4'})]) == \
+               ['cpu', 'nvidia']
+
+
+def test_scale_arguments():
+    assert scale_arguments({'size': [1921, -1], 'font_sizes': [40, 20], 'texts': ['a']}, 0.5, 0.25) == \
+           {'size': [960, -1], 'font_sizes': [10, 5], 'texts': ['a']}
@@ -0,0 +1,24 @@
+import pytest
+from ffmpeg_python_utils.subtitles import convert_color_to_ass, is_ass_compatible
+
+
+@pytest.mark.parametrize('color, ass_color', [
+    ('red', '&H000000FF'),
+    ('White', '&H00FFFFFF'),
+    ('#A0B0C0', '&H00C0B0A0'),
+    ('0x112233@0.5', '&H80332211'),
+    ('ff8800@1', '&H000088FF'),
+])
+def test_convert_color_to_ass(color, ass_color):
+    assert convert_color_to_ass(color) == ass_color
+
+
+def test_convert_color_to_ass_rejects_unknown_colors():
+    with pytest.raises(ValueError):
+        convert_color_to_ass('not_a_color')
+
+
+def test_is_ass_compatible():
+    assert is_ass_compatible([[10, 20]], ['white'], 'black')
+    assert not is_ass_compatible([['(w-text_w)/2', 20]], ['white'], 'black')
+    assert not is_ass_compatible([[10, 20]], ['white'], 'not_a_color')
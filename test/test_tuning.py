@@ -0,0 +1,68 @@
+import contextvars
+import json
+import pytest
+from ffmpeg_python_utils import tuning
+from ffmpeg_python_utils.config import Config, settings
+from ffmpeg_python_utils.tuning import choose_candidate, get_sample_quality, get_tuned_codec_settings
+
+RESULTS = [
+    {'settings': 'fast', 'speed': 8, 'ssim': 0.95, 'size': 100},
+    {'settings': 'medium', 'speed': 4, 'ssim': 0.98, 'size': 90},
+    {'settings': 'medium_big', 'speed': 4, 'ssim': 0.98, 'size': 120},
+    {'settings': 'slow', 'speed': 1, 'ssim': 0.99, 'size': 80},
+]
+
+
+def test_choose_candidate_with_a_quality_floor_takes_the_fastest():
+    assert choose_candidate(RESULTS, min_ssim=0.97)['settings'] == 'medium'
+    assert choose_candidate(RESULTS, min_speed=2, min_ssim=0.97)['settings'] == 'medium'
+
+
+def test_choose_candidate_with_a_speed_target_takes_the_best_quality():
+    assert choose_candidate(RESULTS, min_speed=4)['settings'] == 'medium'
+    assert choose_candidate(RESULTS, min_speed=1)['settings'] == 'slow'
+
+
+def test_choose_candidate_takes_the_closest_if_nothing_meets_the_targets():
+    assert choose_candidate(RESULTS, min_ssim=0.999)['settings'] == 'slow'
+    assert choose_candidate(RESULTS, min_speed=10)['settings'] == 'fast'
+
+
+def test_get_sample_quality_averages_printed_metadata(monkeypatch):
+    monkeypatch.setattr(tuning, 'run_command', lambda cmd, graph=None: (
+        b'frame:0 pts:0 pts_time:0\nlavfi.ssim.All=0.97\nlavfi.psnr.psnr_avg=40\n'
+        b'frame:1 pts:1 pts_time:0.04\nlavfi.ssim.All=0.99\nlavfi.psnr.psnr_avg=42\n'))
+    with Config(C_TO_PRINT_PACKAGE_INFO=False):
+        assert get_sample_quality('in.mp4', 'sample.mp4', 5, 2) == pytest.approx([0.98, 41])
+
+
+def test_get_sample_quality_without_metadata_raises(monkeypatch):
+    monkeypatch.setattr(tuning, 'run_command', lambda cmd, graph=None: b'')
+    with Config(C_TO_PRINT_PACKAGE_INFO=False), pytest.raises(ValueError):
+        get_sample_quality('in.mp4', 'sample.mp4', 5, 2)
+
+
+@pytest.fixture
+def tuned(tmp_path, monkeypatch):
+    # A source whose settings are cached already
+    monkeypatch.setattr(tuning, 'get_video_info', lambda path: {'width': 1280, 'height': 720, 'duration': 10})
+    (tmp_path / 'tuning.json').write_text(json.dumps({'cpu|default|1280x720|speed 4|ssim None': RESULTS[1]}))
+    path = tmp_path / 'in.mp4'
+    path.write_bytes(b'video')
+    with Config(C_CODEC='cpu', C_CACHE_DIR=str(tmp_path), C_TO_PRINT_PACKAGE_INFO=False):
+        yield str(path)
+
+
+def test_tuned_settings_are_applied_to_the_block_only(tuned):
+    default_settings = settings.C_CODEC_SETTINGS
+    with Config():
+        assert get_tuned_codec_settings(tuned, min_speed=4, to_apply=True) == 'medium'
+        assert settings.C_CODEC_SETTINGS['cpu'] == 'medium'
+    assert settings.C_CODEC_SETTINGS == default_settings
+
+
+def test_tuned_settings_are_not_applied_to_the_defaults(tuned):
+    # A new context has no Config entered
+    with pytest.raises(ValueError):
+        contextvars.Context().run(get_tuned_codec_settings, tuned, min_speed=4, to_apply=True)
+    assert get_tuned_codec_settings(tuned, min_speed=4) == 'medium'
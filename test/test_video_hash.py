@@ -0,0 +1,13 @@
+from ffmpeg_python_utils.video_hash import get_band_variants
+
+
+def test_get_band_variants_without_radius_is_the_band():
+    assert get_band_variants(0b1010, 0) == [0b1010]
+
+
+def test_get_band_variants_are_all_values_within_the_radius():
+    band = 0xA5C3
+    for radius, count in [(1, 1 + 16), (2, 1 + 16 + 120)]:
+        variants = get_band_variants(band, radius)
+        assert len(variants) == len(set(variants)) == count
+        assert all(0 <= v < 1 << 16 and bin(v ^ band).count('1') <= radius for v in variants)